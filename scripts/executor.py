@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# Subprocess executor shared by the scripts in this repo. Each script directory has a symlink to this
+# file, so `import executor` works next to the script. Keep the copy next to a script if you deploy it alone.
+#
+# One asyncio loop on a background thread runs every command, at most `limit` at a time. Plain code and
+# worker threads use call() / stream() / gather(), coroutines can await run() directly, from any loop.
+# Every finished command leaves a Result (cmd, cwd, start, seconds, returncode, timed_out), kept in
+# Executor.results and, with a trace file, appended as a JSON line.
+#
+# Environment, so every script supports it without extra options:
+#   EXECUTOR_TRACE=path   append the JSON line of every finished command to path
+#   EXECUTOR_RECORD=path  run commands and save their output to a cassette (JSON lines)
+#   EXECUTOR_REPLAY=path  run nothing, answer from a recorded cassette. Dry runs and tests without root
+#                         or live services, a command that wasn't recorded raises ReplayMiss.
+import asyncio, codecs, hashlib, io, json, os, signal, subprocess, threading, time
+
+STREAM_BUFFER = 10000  # Lines a stream holds, reading the command's output waits while it is full.
+
+class ReplayMiss(LookupError):
+    pass
+
+class Result:
+    def __init__(self, cmd, cwd=None, returncode=None, stdout="", stderr="", start=0.0, seconds=0.0,
+                 timed_out=False):
+        self.cmd = cmd
+        self.cwd = cwd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.start = start
+        self.seconds = seconds
+        self.timed_out = timed_out
+
+    def trace(self):
+        return {"cmd": self.cmd, "cwd": self.cwd, "start": round(self.start, 3), "seconds": round(self.seconds, 4),
+                "returncode": self.returncode, "timed_out": self.timed_out,
+                "stdout_bytes": len(self.stdout or ""), "stderr_bytes": len(self.stderr or "")}
+
+def _key(cmd, cwd, input):
+    # Cassette lookup key, the input only by its hash (it can hold keys).
+    digest = hashlib.sha256(input.encode()).hexdigest() if input is not None else None
+    return json.dumps([cmd, cwd, digest])
+
+async def _emit(on_line, line):
+    if asyncio.iscoroutinefunction(on_line):
+        await on_line(line)
+    else:
+        on_line(line)
+
+def _load_cassette(path):
+    calls = {}
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            calls.setdefault(entry["key"], []).append(entry)
+    return calls
+
+class Executor:
+    def __init__(self, limit=None, timeout=None, trace=None, record=None, replay=None):
+        self.limit = limit or os.cpu_count() or 4
+        self.timeout = timeout  # Seconds, per command. None waits forever.
+        self.trace_path = trace or os.environ.get("EXECUTOR_TRACE")
+        self.record_path = record or os.environ.get("EXECUTOR_RECORD")
+        replay = replay or os.environ.get("EXECUTOR_REPLAY")
+        self.cassette = _load_cassette(replay) if replay else None
+        self.results = []
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _loop(self):
+        # Started on first use, and again in a forked child: the loop thread doesn't survive fork().
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._event_loop = asyncio.new_event_loop()
+                threading.Thread(target=self._event_loop.run_forever, name="executor", daemon=True).start()
+                self._semaphore = asyncio.run_coroutine_threadsafe(self._new_semaphore(), self._event_loop).result()
+            return self._event_loop
+
+    async def _new_semaphore(self):
+        return asyncio.Semaphore(self.limit)
+
+    async def run(self, cmd, cwd=None, input=None, timeout=None, capture=True, on_line=None, check=False):
+        # cmd is an argument list, or a string run by the shell. Output is captured as text unless capture
+        # is False (inherits the terminal). With on_line, stdout and stderr are merged and on_line gets
+        # every line (\r counts as a line end, like a text mode pipe) instead of collecting them. A coroutine
+        # on_line is awaited, reading the pipe waits for it.
+        if asyncio.get_running_loop() is not self._loop():
+            # Awaited on another loop (Ex: asyncio.run), the command still runs on ours, under the same limit.
+            # on_line is then called on the executor thread.
+            return await asyncio.wrap_future(self.submit(self.run(cmd, cwd, input, timeout, capture, on_line, check)))
+        if not isinstance(cmd, str):
+            cmd = [os.fspath(arg) for arg in cmd]
+        cwd = os.fspath(cwd) if cwd is not None else None
+        key = _key(cmd, cwd, input)
+        if self.cassette is not None:
+            result = self._replay(key, cmd, cwd)
+            for line in (result.stdout.splitlines(keepends=True) if on_line else ()):
+                await _emit(on_line, line)
+        else:
+            async with self._semaphore:
+                result = await self._spawn(cmd, cwd, input, timeout or self.timeout, capture, on_line)
+        self._finish(result, key)
+        if check and result.timed_out:
+            raise subprocess.TimeoutExpired(cmd, timeout or self.timeout, result.stdout, result.stderr)
+        if check and result.returncode:
+            raise subprocess.CalledProcessError(result.returncode, cmd, result.stdout, result.stderr)
+        return result
+
+    async def _spawn(self, cmd, cwd, input, timeout, capture, on_line):
+        pipe = subprocess.PIPE if capture or on_line else None
+        # With a timeout the command gets its own process group, so a shell's children are killed with it.
+        # Without, it stays in ours and gets Ctrl-C from the terminal.
+        options = {"cwd": cwd, "stdin": subprocess.PIPE if input is not None else None, "stdout": pipe,
+                   "stderr": subprocess.STDOUT if on_line else pipe, "start_new_session": timeout is not None}
+        start, started = time.time(), time.monotonic()
+        if isinstance(cmd, str):
+            process = await asyncio.create_subprocess_shell(cmd, **options)
+        else:
+            process = await asyncio.create_subprocess_exec(*cmd, **options)
+        data = input.encode() if input is not None else None
+        work = self._read_lines(process, data, on_line) if on_line else process.communicate(data)
+        timed_out = False
+        try:
+            stdout, stderr = await asyncio.wait_for(work, timeout)
+        except asyncio.TimeoutError:
+            os.killpg(process.pid, signal.SIGKILL)
+            await process.wait()
+            stdout, stderr, timed_out = b"", b"", True
+        decode = lambda out: out.decode(errors="replace") if isinstance(out, bytes) else out
+        return Result(cmd, cwd, process.returncode, decode(stdout), decode(stderr), start,
+                      time.monotonic() - started, timed_out)
+
+    async def _read_lines(self, process, data, on_line):
+        if data is not None:
+            process.stdin.write(data)
+            await process.stdin.drain()
+            process.stdin.close()
+        decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")("replace"), translate=True)
+        # The output is only kept when it has to go into a cassette, rsync can print millions of lines.
+        kept = [] if self.record_path else None
+        pending = ""
+        while True:
+            chunk = await process.stdout.read(65536)
+            lines = (pending + decoder.decode(chunk, final=not chunk)).split("\n")
+            pending = lines.pop()
+            for line in lines:
+                await _emit(on_line, line + "\n")
+                if kept is not None:
+                    kept.append(line + "\n")
+            if not chunk:
+                break
+        if pending:
+            await _emit(on_line, pending)
+            if kept is not None:
+                kept.append(pending)
+        await process.wait()
+        return "".join(kept or ()), ""
+
+    def _replay(self, key, cmd, cwd):
+        calls = self.cassette.get(key)
+        if not calls:
+            raise ReplayMiss(f"Not in the cassette: {cmd} (cwd {cwd})")
+        entry = calls.pop(0) if len(calls) > 1 else calls[0]
+        return Result(cmd, cwd, entry["returncode"], entry["stdout"], entry["stderr"], time.time(), 0.0,
+                      entry["timed_out"])
+
+    def _finish(self, result, key):
+        # Runs on the loop thread only, no locking needed.
+        self.results.append(result)
+        if self.trace_path:
+            with open(self.trace_path, "a") as f:
+                f.write(json.dumps(result.trace()) + "\n")
+        if self.record_path:
+            entry = {"key": key, "returncode": result.returncode, "stdout": result.stdout or "",
+                     "stderr": result.stderr or "", "timed_out": result.timed_out}
+            with open(self.record_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def submit(self, coro):
+        # concurrent.futures.Future of a coroutine run on the executor loop.
+        return asyncio.run_coroutine_threadsafe(coro, self._loop())
+
+    def call(self, cmd, **options):
+        # run() from plain code or a worker thread. Returns the Result.
+        return self.submit(self.run(cmd, **options)).result()
+
+    def gather(self, *coros):
+        # Runs coroutines (Ex: several run() calls) concurrently, returns their results in order.
+        async def gather():
+            return await asyncio.gather(*coros)
+        return self.submit(gather()).result()
+
+    def stream(self, cmd, **options):
+        # Iterate over the output lines of a command while it runs, see Stream.
+        return Stream(self, cmd, options)
+
+class Stream:
+    # for line in executor.stream(cmd): ... then .result, the finished command's Result.
+    # At most STREAM_BUFFER lines wait for the consumer, after that the command blocks on its pipe.
+    def __init__(self, executor, cmd, options):
+        self._event_loop = executor._loop()
+        self._lines = asyncio.Queue(STREAM_BUFFER)
+        self._closed = False
+        self._future = executor.submit(self._run(executor, cmd, options))
+
+    async def _run(self, executor, cmd, options):
+        try:
+            return await executor.run(cmd, on_line=self._put, **options)
+        finally:
+            await self._put(None)
+
+    async def _put(self, line):
+        if not self._closed:
+            await self._lines.put(line)
+
+    async def _take(self):
+        # Everything buffered, at least one line. One thread switch per batch instead of per line.
+        lines = [await self._lines.get()]
+        while not self._lines.empty():
+            lines.append(self._lines.get_nowait())
+        return lines
+
+    def _drain(self):
+        while not self._lines.empty():
+            self._lines.get_nowait()
+
+    def close(self):
+        # Stop collecting lines, the command runs to the end and the rest of its output is dropped.
+        self._closed = True
+        self._event_loop.call_soon_threadsafe(self._drain)
+
+    def __iter__(self):
+        try:
+            while True:
+                for line in asyncio.run_coroutine_threadsafe(self._take(), self._event_loop).result():
+                    if line is None:
+                        return
+                    yield line
+        finally:
+            self.close()
+
+    @property
+    def result(self):
+        return self._future.result()
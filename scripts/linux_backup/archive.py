@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# Packed archive tier for cold snapshots: a hostname-Wnn-yyyy tree becomes two files next to it.
+#
+#   /disk01/backups/hostname/hostname-W10-2025.pack       <- tar stream in independent gzip frames
+#   /disk01/backups/hostname/hostname-W10-2025.pack.idx   <- SQLite: frame offsets, one row per file
+#
+# The tree is walked once and streamed through tarfile into FRAME_SIZE frames, nothing is staged. Every
+# frame is a complete gzip member, so the pack is a valid .tar.gz (`tar xzf` works without this script).
+# The index maps every path to its offset in the tar stream and every frame to its offset in the pack,
+# restoring one file decompresses only the frames its data lies in.
+#
+# A packed snapshot no longer shares hard links with its neighbours, archive only snapshots that are
+# rarely read. The newest snapshot is never archived, the next backup links against it.
+#
+# Usage:
+#   archive.py pack /disk01/backups/hostname/hostname-W10-2025          Pack one snapshot, remove the tree
+#   archive.py cold hostname --days 60 [--dry-run]                       Pack every snapshot older than 60 days
+#   archive.py ls /disk01/backups/hostname/hostname-W10-2025 /etc         Files in the pack below /etc
+#   archive.py extract /disk01/backups/hostname/hostname-W10-2025 /tmp/restore /etc/hosts /home/user
+import argparse, datetime, gzip, os, sqlite3, stat, tarfile, time
+
+import dedup_store, retention, snapshots
+
+FRAME_SIZE = 4 * 1024 * 1024    # Uncompressed tar bytes per frame, the smallest unit a restore reads.
+COMPRESS_LEVEL = 6
+INDEX_SCHEMA = """
+CREATE TABLE frames (raw_offset INTEGER PRIMARY KEY, raw_length INTEGER, offset INTEGER, length INTEGER);
+CREATE TABLE files (path TEXT PRIMARY KEY, type TEXT, mode INTEGER, uid INTEGER, gid INTEGER, size INTEGER,
+                    mtime INTEGER, linkname TEXT, data_offset INTEGER);
+CREATE TABLE meta (key TEXT PRIMARY KEY, value);
+"""
+# tarfile member type -> files.type
+TYPES = {tarfile.REGTYPE: "f", tarfile.DIRTYPE: "d", tarfile.SYMTYPE: "l", tarfile.LNKTYPE: "h",
+         tarfile.FIFOTYPE: "p", tarfile.CHRTYPE: "c", tarfile.BLKTYPE: "b"}
+
+def pack_path(backup_dir):
+    return backup_dir.rstrip("/") + snapshots.PACK_SUFFIX
+
+def index_path(backup_dir):
+    return pack_path(backup_dir) + ".idx"
+
+# === PACK ===
+
+class FrameWriter:
+    # Write-only file object for tarfile. Cuts the tar stream into FRAME_SIZE pieces, each written
+    # to `out` as its own gzip member and recorded in the frames table. tell() is the tar offset.
+    def __init__(self, out, conn):
+        self.out = out
+        self.conn = conn
+        self.buffer = bytearray()
+        self.raw_offset = 0
+        self.offset = 0
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= FRAME_SIZE:
+            self._frame(FRAME_SIZE)
+        return len(data)
+
+    def tell(self):
+        return self.raw_offset + len(self.buffer)
+
+    def _frame(self, size):
+        raw = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        member = gzip.compress(raw, COMPRESS_LEVEL, mtime=0)
+        self.out.write(member)
+        self.conn.execute("INSERT INTO frames VALUES (?, ?, ?, ?)", (self.raw_offset, len(raw), self.offset, len(member)))
+        self.raw_offset += len(raw)
+        self.offset += len(member)
+
+    def close(self):
+        if self.buffer:
+            self._frame(len(self.buffer))
+
+def _walk(root):
+    # Every entry below root, parents before children, sorted so packs of similar trees compress alike.
+    pending = [root]
+    while pending:
+        path = pending.pop()
+        with os.scandir(path) as entries:
+            entries = sorted(entries, key=lambda e: e.name)
+        for entry in entries:
+            yield entry.path
+        pending.extend(e.path for e in reversed(entries) if e.is_dir(follow_symlinks=False))
+
+def pack(backup_dir, remove_tree=True):
+    # Writes the pack and its index, then removes the tree. Returns (files, tree bytes, pack bytes).
+    backup_dir = backup_dir.rstrip("/")
+    pack_file, index_file = pack_path(backup_dir), index_path(backup_dir)
+    for path in (pack_file + ".tmp", index_file + ".tmp"):
+        if os.path.exists(path):
+            os.remove(path)
+    conn = sqlite3.connect(index_file + ".tmp")
+    conn.executescript(INDEX_SCHEMA)
+    files = size = 0
+    with open(pack_file + ".tmp", "wb") as out:
+        writer = FrameWriter(out, conn)
+        tar = tarfile.open(fileobj=writer, mode="w", format=tarfile.PAX_FORMAT)
+        for path in _walk(backup_dir):
+            info = tar.gettarinfo(path, os.path.relpath(path, backup_dir))
+            if info is None or info.type not in TYPES:
+                continue  # Sockets
+            if info.isreg():
+                with open(path, "rb") as f:
+                    tar.addfile(info, f)
+                # Header(s) first, the data is padded to whole blocks up to the new offset.
+                data_offset = tar.offset - -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                size += info.size
+            else:
+                tar.addfile(info)
+                data_offset = None
+            conn.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         ("/" + info.name, TYPES[info.type], info.mode, info.uid, info.gid, info.size,
+                          int(info.mtime), "/" + info.linkname if info.islnk() else info.linkname or None,
+                          data_offset))
+            files += 1
+        tar.close()
+        writer.close()
+        out.flush()
+        os.fsync(out.fileno())
+    conn.executemany("INSERT INTO meta VALUES (?, ?)", (("snapshot", os.path.basename(backup_dir)),
+                                                       ("files", files), ("bytes", size),
+                                                       ("packed", datetime.datetime.now().isoformat(timespec="seconds"))))
+    conn.commit()
+    conn.close()
+    # Index last: a pack without its index is an unfinished one.
+    os.replace(pack_file + ".tmp", pack_file)
+    os.replace(index_file + ".tmp", index_file)
+    if remove_tree:
+        retention.scan_trees([backup_dir], delete=True)
+    return files, size, os.path.getsize(pack_file)
+
+def cold_snapshots(host_dir, today, days):
+    # Snapshot trees older than `days`, never the newest one.
+    trees = snapshots.list_snapshots(host_dir)[:-1]
+    return [d for d in trees if (today - snapshots.snapshot_date(os.path.basename(d))).days > days]
+
+# === READ ===
+
+class Pack:
+    def __init__(self, backup_dir):
+        self.index = sqlite3.connect(f"file:{index_path(backup_dir)}?mode=ro", uri=True)
+        self.pack = open(pack_path(backup_dir), "rb")
+        self.cached = (None, b"")    # Last decompressed frame, small files share frames.
+        self.frames_read = 0
+
+    def close(self):
+        self.index.close()
+        self.pack.close()
+
+    def entries(self, prefix="/"):
+        # Index rows at or below prefix, parents first. "0" sorts right after "/", so the range is
+        # exactly the paths starting with prefix + "/", byte for byte.
+        prefix = prefix.rstrip("/")
+        return self.index.execute("SELECT * FROM files WHERE path = ? OR (path >= ? AND path < ?) ORDER BY path",
+                                  (prefix or "/", prefix + "/", prefix + "0")).fetchall()
+
+    def _frame(self, raw_offset, offset, length):
+        if self.cached[0] != raw_offset:
+            self.pack.seek(offset)
+            self.cached = (raw_offset, gzip.decompress(self.pack.read(length)))
+            self.frames_read += 1
+        return self.cached[1]
+
+    def read(self, data_offset, size):
+        # Yields the size bytes at data_offset of the tar stream, one frame at a time.
+        end = data_offset + size
+        rows = self.index.execute("""SELECT raw_offset, offset, length FROM frames
+                                     WHERE raw_offset >= (SELECT MAX(raw_offset) FROM frames WHERE raw_offset <= ?)
+                                       AND raw_offset < ? ORDER BY raw_offset""", (data_offset, end))
+        for raw_offset, offset, length in rows:
+            data = self._frame(raw_offset, offset, length)
+            yield data[max(data_offset - raw_offset, 0):end - raw_offset]
+
+def _set_meta(dest, mode, uid, gid, mtime):
+    os.chown(dest, uid, gid)
+    os.chmod(dest, stat.S_IMODE(mode))
+    os.utime(dest, (mtime, mtime))
+
+def extract(backup_dir, target_root, prefix="/"):
+    # Rebuild the packed snapshot (or the part below prefix) as a normal tree under target_root.
+    # Entries already there are replaced, so overlapping prefixes can go into the same target.
+    # Returns (entries, frames decompressed).
+    archive = Pack(backup_dir)
+    rows = archive.entries(prefix)
+    dirs = []
+    for path, kind, mode, uid, gid, size, mtime, linkname, data_offset in rows:
+        dest = os.path.join(target_root, path.lstrip("/"))
+        if kind == "d":
+            os.makedirs(dest, exist_ok=True)
+            dirs.append((dest, mode, uid, gid, mtime))
+            continue
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if os.path.lexists(dest):
+            # Unlinked, not overwritten: it can be a hard link to a file restored before.
+            os.unlink(dest)
+        if kind == "l":
+            os.symlink(linkname, dest)
+            os.lchown(dest, uid, gid)
+        elif kind == "h":
+            # Link to an earlier member, copied when that one is outside prefix.
+            target = os.path.join(target_root, linkname.lstrip("/"))
+            if os.path.exists(target):
+                os.link(target, dest)
+            else:
+                source = archive.index.execute("SELECT size, data_offset FROM files WHERE path = ?",
+                                               (linkname,)).fetchone()
+                with open(dest, "wb") as out:
+                    for piece in archive.read(source[1], source[0]):
+                        out.write(piece)
+                _set_meta(dest, mode, uid, gid, mtime)
+        elif kind == "f":
+            with open(dest, "wb") as out:
+                for piece in archive.read(data_offset, size):
+                    out.write(piece)
+            _set_meta(dest, mode, uid, gid, mtime)
+        elif kind == "p":
+            os.mkfifo(dest)
+            _set_meta(dest, mode, uid, gid, mtime)
+        # Devices are not restored.
+    # Dirs last and deepest first, so writing their contents doesn't bump the restored mtimes.
+    for dest, mode, uid, gid, mtime in sorted(dirs, reverse=True):
+        _set_meta(dest, mode, uid, gid, mtime)
+    frames = archive.frames_read
+    archive.close()
+    return len(rows), frames
+
+def main():
+    parser = argparse.ArgumentParser(description="Packed archive tier for cold snapshots")
+    parser.add_argument("--base", default=snapshots.DEFAULT_BACKUP_BASE, help="Backup base directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack_cmd = commands.add_parser("pack", help="Pack one snapshot tree")
+    pack_cmd.add_argument("snapshot")
+    pack_cmd.add_argument("--keep-tree", action="store_true", help="Don't remove the tree afterwards")
+    cold = commands.add_parser("cold", help="Pack every snapshot of a host older than --days")
+    cold.add_argument("host", help="Host directory name under --base")
+    cold.add_argument("--days", type=int, required=True)
+    cold.add_argument("--dry-run", action="store_true", help="Only list the snapshots that would be packed")
+    ls = commands.add_parser("ls", help="List packed files")
+    ls.add_argument("snapshot")
+    ls.add_argument("prefix", nargs="?", default="/")
+    ext = commands.add_parser("extract", help="Restore paths from a pack into a directory")
+    ext.add_argument("snapshot")
+    ext.add_argument("target")
+    ext.add_argument("paths", nargs="*", default=["/"])
+    args = parser.parse_args()
+
+    if args.command in ("pack", "cold"):
+        if args.command == "pack":
+            todo = [args.snapshot]
+        else:
+            todo = cold_snapshots(os.path.join(args.base, args.host), datetime.date.today(), args.days)
+        for backup_dir in todo:
+            if dedup_store.has_index(backup_dir):
+                print(f"skip   {os.path.basename(backup_dir)}: dedup snapshot, already stored as chunks")
+                continue
+            if args.command == "cold" and args.dry_run:
+                print(f"would pack {os.path.basename(backup_dir)}")
+                continue
+            started = time.monotonic()
+            files, size, packed = pack(backup_dir, remove_tree=not getattr(args, "keep_tree", False))
+            print(f"packed {os.path.basename(backup_dir)}: {files} files, {size / 1024**2:.1f} MiB -> "
+                  f"{packed / 1024**2:.1f} MiB in {time.monotonic() - started:.1f}s")
+    elif args.command == "ls":
+        archive = Pack(args.snapshot)
+        for path, kind, mode, uid, gid, size, mtime, linkname, _ in archive.entries(args.prefix):
+            when = datetime.datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M")
+            print(f"{kind}{stat.filemode(mode)[1:]} {uid:>5} {gid:>5} {size:>12} {when} {path}"
+                  + (f" -> {linkname}" if linkname else ""))
+        archive.close()
+    elif args.command == "extract":
+        for path in args.paths:
+            count, frames = extract(args.snapshot, args.target, path)
+            print(f"Extracted {count} entries below {path}, {frames} frames read")
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,57 @@
 #!/usr/bin/env python3
-import os, sys, subprocess, datetime, logging
-from pathlib import Path
+import os, re, sys, datetime, logging
+import concurrent.futures, tempfile
+
+import archive, backup_metrics, change_tracker, dedup_store, executor, retention, rsync_output, snapshot_manifest
 
 #TODO(MHC) - 
 #            2b. Make all these frequencies configurable.
 
 # === CONFIGURATION ===
 RETENTION_DAYS = 30*6 #6 months
+# Tiered retention on top of RETENTION_DAYS, 0 disables a tier. See retention.py.
+KEEP_WEEKLY = 0     # Keep the newest N weekly snapshots instead of using RETENTION_DAYS
+KEEP_MONTHLY = 0    # Also keep the newest snapshot of each of the last N months
+KEEP_YEARLY = 0     # Also keep the newest snapshot of each of the last N years
+PURGE_DRY_RUN = False
+PURGE_WORKERS = 8
+# Pack rsync snapshots older than N days into one compressed file with a random-access index
+# (archive.py), after the purge. restore_node.py reads them directly. 0 disables, the newest snapshot is never packed.
+ARCHIVE_AFTER_DAYS = 0
 DEBUG=False
 BACKUP_ROOT_DIR = "/disk01"
 BACKUP_BASE = f"{BACKUP_ROOT_DIR}/backups"
+# What gets backed up. Only changed to point at a synthetic tree, Ex: benchmark.py.
+# Sharding and the change journal always work on "/".
+SOURCE_ROOT = "/"
+# How a new week is seeded from the most recent snapshot:
+#   "link" - rsync --link-dest, unchanged files are hard links into last week's snapshot.
+#   "copy" - Physically copy last week's snapshot first (old behaviour, doubles disk usage).
+SNAPSHOT_MODE = "link"
+# Where snapshots go:
+#   "rsync" - Plain rsync tree per week (see SNAPSHOT_MODE).
+#   "dedup" - Content addressed chunk store shared by all hosts in BACKUP_BASE/.dedup, each week is a chunk index.
+#             See dedup_store.py. DEDUP_WORKERS processes hash chunks, None = one per CPU.
+BACKUP_BACKEND = "rsync"
+DEDUP_WORKERS = None
+# Incremental runs from the inotify change journal kept by change_tracker.py (must be running as a service).
+# Only journaled paths go through rsync --files-from. Falls back to a full scan on a new week, when the
+# tracker is down or restarted, or when its journal overflowed.
+CHANGE_JOURNAL = False
+CHANGE_JOURNAL_DIR = "/var/lib/backup_tracker"
+# Parallel sharded rsync. 0 or 1 runs a single rsync over "/" (old behaviour).
+# N > 1 splits the tree into one shard per directory SHARD_DEPTH levels below "/"
+# and runs up to N rsync processes at once. Helps on multi-core NVMe hosts with lots of small files.
+SHARD_WORKERS = 0
+SHARD_DEPTH = 2
+# Write a SQLite manifest (path, size, mtime, mode, inode) next to every snapshot, see snapshot_manifest.py.
+# MANIFEST_HASH also records a blake2b hash of every file rsync transferred.
+MANIFEST = True
+MANIFEST_HASH = False
+# Phase timings and throughput of every run, see backup_metrics.py. Always appended to
+# BACKUP_BASE/<host>/backup_metrics.jsonl, also written for node_exporter's textfile collector
+# unless METRICS_TEXTFILE_DIR is None.
+METRICS_TEXTFILE_DIR = "/var/lib/node_exporter/textfile_collector"
 EXCLUDES = [
     f"{BACKUP_ROOT_DIR}",             # Could be an NFS mount, skip entire root
     #Ignore entire root dirs which some are 
@@ -73,15 +115,29 @@ EXCLUDES = [
     "/usr/src/*",                   # Kernel headers/sources
 ]
 
+# rsync --stats lines we keep, mapped to our own key names.
+RSYNC_STATS_KEYS = {
+    "Number of files": "files",
+    "Number of regular files transferred": "files_transferred",
+    "Total file size": "total_size",
+    "Total transferred file size": "bytes_transferred",
+    "File list generation time": "file_list_seconds",
+}
+# rsync runs through the shared executor (../executor.py): per-command timings, EXECUTOR_TRACE, record/replay.
+# Sized from SHARD_WORKERS when the module is loaded.
+EXECUTOR = executor.Executor(limit=max(SHARD_WORKERS, 1))
+
 # === LOGGING SETUP ===
-hostname = os.uname().nodename
-logfile = f"/var/log/backup_{hostname}.log"
-logging.basicConfig(
-    filename=logfile,
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+LOG_FILE = f"/var/log/backup_{os.uname().nodename}.log"
+
+def setup_logging():
+    # Only main() does this, importing the module (Ex: benchmark.py) leaves the real log alone.
+    logging.basicConfig(
+        filename=LOG_FILE,
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
 
 def log(msg):
     print(msg)
@@ -92,121 +148,412 @@ def get_dir_level(path, max_level=6):
     parts = os.path.normpath(path).split(os.sep)
     return os.sep.join(parts[:max_level])
 
-def run_backup():
+def find_previous_backup(backup_dir, attempts=10):
+    # Walk back one ISO week at a time until we find an existing snapshot.
+    # Ex: backup_dir = '/disk01/backups/hostname/hostname-W30-2025'
+    host_dir, current_week_backup_name = os.path.split(backup_dir)
+    hostname, current_backup_week, current_backup_year = current_week_backup_name.rsplit('-', 2)
+    week_start = datetime.date.fromisocalendar(int(current_backup_year), int(current_backup_week[1:]), 1)
+    while attempts > 0: #Loop until we find a backup to seed from or we run out of attempts
+        # Week-1, handles the W01 -> W52/W53 rollover condition for us.
+        week_start -= datetime.timedelta(weeks=1)
+        last_backup_year, last_backup_week, _ = week_start.isocalendar()
+        last_backup_dir = os.path.join(host_dir, f"{hostname}-W{last_backup_week:02d}-{last_backup_year}")
+
+        if os.path.isdir(last_backup_dir):
+            return last_backup_dir
+        attempts = attempts - 1
+        log(f"Weekly backup was missed: {os.path.basename(last_backup_dir)}")
+        log(f"Going back one more week. Attempts left: {attempts}")
+    return None
+
+def parse_rsync_stats(lines):
+    # Pull the numbers we care about out of rsync's --stats block. Ex:
+    #   Number of files: 82,824 (reg: 70,101, dir: 11,540, link: 1,183)
+    #   Number of regular files transferred: 80
+    #   Total file size: 35,243,536,120 bytes
+    #   Total transferred file size: 35,243,536 bytes
+    #   File list generation time: 0.001 seconds
+    stats = {}
+    for line in lines:
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        key = key.strip()
+        if key not in RSYNC_STATS_KEYS:
+            continue
+        if key == "Number of files":
+            reg = re.search(r"reg: ([\d,]+)", value)
+            stats["reg_files"] = int(reg.group(1).replace(",", "")) if reg else 0
+        number = re.match(r"\s*([\d,]+(\.\d+)?)", value)
+        if number:
+            number = number.group(1).replace(",", "")
+            stats[RSYNC_STATS_KEYS[key]] = float(number) if "." in number else int(number)
+    return stats
+
+def log_snapshot_stats(seed_dir, stats):
+    # With --link-dest every regular file rsync did not transfer was hard-linked from the seed.
+    copied = stats.get("files_transferred", 0)
+    copied_bytes = stats.get("bytes_transferred", 0)
+    linked = max(stats.get("reg_files", 0) - copied, 0)
+    linked_bytes = max(stats.get("total_size", 0) - copied_bytes, 0)
+    log(f"Snapshot seeded from {seed_dir}: linked {linked} files ({linked_bytes} bytes), "
+        f"copied {copied} files ({copied_bytes} bytes)")
+
+EXCLUDE_TOKENS = re.compile(r"\*\*|\*|\?|\[[^]]+\]")
+_exclude_regexes = {}
+
+def exclude_regex(pattern):
+    # rsync's wildcards: * and ? stop at "/", ** crosses it. Patterns starting with "/" are anchored at
+    # the root, others match the end of the path. A match also covers everything below the path.
+    # A trailing "/" (directories only in rsync) is ignored, the path's type isn't known here.
+    regex = ""
+    end = 0
+    for token in EXCLUDE_TOKENS.finditer(pattern.rstrip("/")):
+        regex += re.escape(pattern[end:token.start()])
+        text = token.group()
+        if text.startswith("["):
+            regex += "[^" + text[2:] if text[1] == "!" else text
+        else:
+            regex += {"**": ".*", "*": "[^/]*", "?": "[^/]"}[text]
+        end = token.end()
+    regex += re.escape(pattern.rstrip("/")[end:])
+    return re.compile(("" if pattern.startswith("/") else "(.*/)?") + regex + "(/.*)?$")
+
+def is_excluded(path):
+    # Whether rsync --exclude with EXCLUDES skips the absolute path. Picks shards, and is the exclude
+    # filter of the dedup backend and of change_tracker.py, which don't run rsync.
+    for pattern in EXCLUDES:
+        if pattern not in _exclude_regexes:
+            _exclude_regexes[pattern] = exclude_regex(pattern)
+        if _exclude_regexes[pattern].match(path):
+            return True
+    return False
+
+def find_shards(depth=SHARD_DEPTH):
+    # Every real directory exactly `depth` levels below "/" becomes a shard.
+    # Symlinks, other filesystems (--one-file-system) and excluded dirs are left to the remainder shard.
+    root_dev = os.lstat("/").st_dev
+    shards = []
+    pending = ["/"]
+    while pending:
+        path = pending.pop()
+        try:
+            entries = list(os.scandir(path))
+        except OSError as e:
+            logging.warning(f"Cannot scan {path} for shards: {e}")
+            continue
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False) or is_excluded(entry.path):
+                continue
+            if entry.stat(follow_symlinks=False).st_dev != root_dev:
+                continue
+            # get_dir_level() only cuts paths deeper than depth, so an unchanged path is not a shard yet.
+            if get_dir_level(entry.path, depth) != entry.path:
+                shards.append(entry.path)
+            else:
+                pending.append(entry.path)
+    return sorted(shards)
+
+def merge_rsync_stats(all_stats):
+    # Counts add up. The shards run side by side, so for times the slowest shard is the one that counts.
+    merged = {}
+    for stats in all_stats:
+        for key, value in stats.items():
+            if key.endswith("_seconds"):
+                merged[key] = max(merged.get(key, 0), value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+def run_rsync_shard(rsync_cmd, label, manifest=None):
+    # rsync for one shard without console output, errors go to the log file.
+    process = EXECUTOR.stream(rsync_cmd)
+    stats_lines = []
+    for event in rsync_output.parse_rsync_output(process):
+        kind = event["event"]
+        if kind == "stats":
+            stats_lines.append(event["line"])
+        elif kind == "item" and manifest:
+            manifest.add(event)
+        elif kind == "error":
+            logging.warning(f"[{label}] {event['line']}")
+    result = process.result
+    if DEBUG:
+        logging.debug(f"[{label}] rsync exited with {result.returncode} after {result.seconds:.1f}s")
+    return result.returncode, parse_rsync_stats(stats_lines)
+
+def run_sharded_backup(rsync_opts, backup_dir, manifest=None, workers=SHARD_WORKERS):
+    # rsync -R keeps full source paths, so anchored EXCLUDES match exactly as in a single run over "/".
+    shards = find_shards()
+    log(f"Running sharded backup: {len(shards)} shards at depth {SHARD_DEPTH}, {workers} workers")
+    rsync_base = ["rsync", "-aAX", "--relative", "--info=stats2", "--one-file-system", "--no-xattrs"] + rsync_opts
+
+    # Pre-create shard parents so concurrent rsyncs don't race creating the same implied dirs.
+    for shard in shards:
+        os.makedirs(os.path.join(backup_dir, os.path.dirname(shard).lstrip(os.sep)), exist_ok=True)
+
+    results = []
+    # Progress only on a terminal, like rsync_output.ProgressDisplay, cron mails don't need a line per shard.
+    progress = sys.stdout.isatty()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_rsync_shard, rsync_base + [shard, backup_dir], shard, manifest): shard for shard in shards}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            returncode, stats = future.result()
+            results.append((returncode, stats))
+            if returncode != 0:
+                log(f"Shard {futures[future]} finished with exit code {returncode}")
+            if progress:
+                print(f"\rShards done: {done}/{len(shards)}", end="", flush=True)
+    if progress:
+        print()
+
+    # Remainder shard: everything above SHARD_DEPTH (shallow files, dir attributes, symlinks, mounts).
+    # Runs last so parent directory mtimes are set after the shards have written into them.
+    with tempfile.NamedTemporaryFile("w", prefix="backup_shards_", suffix=".txt") as shard_excludes:
+        shard_excludes.write("".join(f"{shard}/\n" for shard in shards))
+        shard_excludes.flush()
+        remainder_cmd = rsync_base + [f"--exclude-from={shard_excludes.name}", "/", backup_dir]
+        results.append(run_rsync_shard(remainder_cmd, "/", manifest))
+
+    # Worst exit code wins, stats are merged across shards.
+    returncode = max(code for code, _ in results)
+    return returncode, merge_rsync_stats(stats for _, stats in results)
+
+def run_rsync_console(rsync_cmd, manifest=None):
+    # Single rsync over "/" with the live console display. Returns (exit code, stats).
+    process = EXECUTOR.stream(rsync_cmd)
+    display = rsync_output.ProgressDisplay()
+    stats_lines = []
+
+    for event in rsync_output.parse_rsync_output(process):
+        kind = event["event"]
+        if kind == "stats":
+            stats_lines.append(event["line"])
+        elif kind == "item":
+            if manifest:
+                manifest.add(event)
+            if DEBUG:
+                logging.debug(f"/{event['path']}")
+        elif kind == "error":
+            logging.warning(event["line"])
+        display.update(event)
+
+    display.finish()
+    return process.result.returncode, parse_rsync_stats(stats_lines)
+
+def run_dedup_backup(backup_dir, seed_dir):
+    # Chunk SOURCE_ROOT straight into the shared store, unchanged files reuse the seed snapshot's chunk list.
+    # EXCLUDES are anchored at SOURCE_ROOT like rsync's.
+    exclude = lambda path: is_excluded(os.path.normpath("/" + os.path.relpath(path, SOURCE_ROOT)))
+    try:
+        result = dedup_store.ingest(SOURCE_ROOT, backup_dir, dedup_store.store_dir(BACKUP_BASE), exclude=exclude,
+                                    previous_dir=seed_dir, workers=DEDUP_WORKERS)
+        log(f"Dedup backup: {result['files']} files, {result['reused']} unchanged, "
+            f"{result['chunked']} chunked ({result['bytes_read']} bytes read)")
+        if result["errors"]:
+            log(f"Backup finished with errors. {result['errors']} files could not be read and are not in the snapshot.")
+        else:
+            log("Backup completed successfully.")
+        return result
+    except Exception as e:
+        log(f"Backup failed: {e}")
+        return None
+
+def take_journal_changes(new_week):
+    # (files, dirs) changed since the last backup, or None when this run has to scan everything.
+    # Always rotates the journal, a full scan covers whatever it held.
+    files, dirs, reason = change_tracker.take_changes(CHANGE_JOURNAL_DIR)
+    if new_week:
+        reason = "new week"
+    if reason:
+        log(f"Full scan: {reason}")
+        return None
+    log(f"Change journal: {len(files)} files and {len(dirs)} directories changed since the last backup")
+    return files, dirs
+
+def run_incremental_backup(rsync_opts, backup_dir, changes, manifest=None):
+    # rsync only the journaled paths. --files-from turns off the recursion -a implies, -r brings it
+    # back so journaled directories are copied with everything below them.
+    files, dirs = changes
+    with tempfile.NamedTemporaryFile("w", prefix="backup_changes_", suffix=".txt") as files_from:
+        count = change_tracker.write_files_from(files, dirs, files_from)
+        files_from.flush()
+        if not count:
+            log("Nothing changed since the last backup")
+            return 0, {}
+        rsync_cmd = ["rsync", "-aAX", "-r", f"--files-from={files_from.name}", "--info=progress2,stats2",
+                     "--one-file-system", "--no-xattrs", "/", backup_dir] + rsync_opts
+        return run_rsync_console(rsync_cmd, manifest)
+
+def run_backup(today=None, metrics=None):
     # Weekly backup @ frequency of cron job. Reduces initial copy time.
-    today = datetime.date.today()
+    today = today or datetime.date.today()
     year, week, _ = today.isocalendar()  # (year, week number, weekday)
     hostname = os.uname().nodename
+    metrics = metrics or backup_metrics.RunMetrics(hostname)
     #Ex: backup_dir = '/disk01/backups/hostname/hostname-W30-2025'
     backup_dir = os.path.join(BACKUP_BASE, hostname, f"{hostname}-W{week:02d}-{year}")
 
     #Is this a new week?
-    if not os.path.exists(backup_dir):
-        #For efficiency, lets copy last week's backup, then rsync.
-        # First, what week is it, then go back until we got the most recent backup.
-
-        # Ex: current_week_backup_name = 'hostname-W30-2025'
-        current_week_backup_name = backup_dir.split('/')[-1]
-        attempts = 10
-        while attempts > 0: #Loop until we find a backup to copy from or we run out of attempts
-            hostname, current_backup_week, current_backup_year = current_week_backup_name.split('-')
-            if current_backup_week == "W01": #Rollever condition
-                last_backup_week   = "W52"
-                last_backup_year   = str(int(current_backup_year)-1)
-            else:
-                last_backup_week = str(int(current_backup_week[1:])-1)
-                last_backup_year = current_backup_year
-
-            #Put it all back together, just week-1 or week=52 + year-1 if rolleover condition
-            last_backup_dir = os.path.join(BACKUP_BASE, hostname, f"{hostname}-W{last_backup_week}-{last_backup_year}")
-            
-            if os.path.exists(last_backup_dir):  
-                #Only copy if the directory exists.  
+    seed_dir = None
+    new_week = not os.path.exists(backup_dir)
+    if new_week:
+        # For efficiency, seed this week from the most recent backup, then rsync.
+        with metrics.phase("seed"):
+            seed_dir = find_previous_backup(backup_dir)
+            if seed_dir and SNAPSHOT_MODE == "copy" and BACKUP_BACKEND == "rsync":
+                #Legacy behaviour, physically copy the whole previous snapshot first.
                 import shutil
-                shutil.copytree(last_backup_dir, backup_dir, copy_function=shutil.copy2, dirs_exist_ok=True)
-                break #Success, break out of the loop
-            else:
-                attempts = attempts - 1
-                current_week_backup_name = last_backup_dir.split('/')[-1]
-                log(f"Weekly backup was missed: {current_week_backup_name}")
-                log(f"Going back one more week. Attempts left: {attempts}")
+                log(f"Copying {seed_dir} to {backup_dir}")
+                shutil.copytree(seed_dir, backup_dir, copy_function=shutil.copy2, dirs_exist_ok=True)
+                seed_dir = None
 
     log(f"Starting backup for {hostname} to {backup_dir}")
-    exclude_args = sum([["--exclude", path] for path in EXCLUDES], [])
-    rsync_cmd = ["rsync", "-aAXv", "--info=progress2,stats", "--one-file-system", "--no-xattrs", "/", backup_dir] + exclude_args
+    if BACKUP_BACKEND == "dedup":
+        with metrics.phase("transfer"):
+            result = run_dedup_backup(backup_dir, seed_dir)
+        if result:
+            # 23 is rsync's "some files were not transferred", the same outcome.
+            metrics.set(exit_code=23 if result["errors"] else 0, files_total=result["files"],
+                        files_transferred=result["chunked"] - result["errors"], bytes_transferred=result["bytes_read"],
+                        files_failed=result["errors"])
+        else:
+            metrics.set(exit_code=-1)
+        return
+
+    # Options shared by the single and the sharded rsync runs.
+    rsync_opts = [f"--out-format={rsync_output.RSYNC_OUT_FORMAT}"] + sum([["--exclude", path] for path in EXCLUDES], [])
+    # Unchanged files are hard-linked against last week's snapshot, only changed files are written. Later
+    # runs of the week link against it too: without --link-dest rsync would update the attributes of the
+    # inodes this snapshot shares with older ones in place, and an interrupted first run would lose its seed.
+    link_dest = seed_dir
+    if not new_week and SNAPSHOT_MODE != "copy":
+        link_dest = find_previous_backup(backup_dir)
+    if link_dest:
+        log(f"Seeding {backup_dir} from {link_dest} using hard links")
+        rsync_opts.insert(0, f"--link-dest={link_dest}")
+
+    changes = None
+    if CHANGE_JOURNAL:
+        with metrics.phase("journal"):
+            changes = take_journal_changes(new_week)
+
+    manifest = None
+    if MANIFEST:
+        # name2 makes rsync print unchanged items too, so the manifest covers the whole snapshot.
+        # Incremental runs only see the journaled paths and update the existing manifest instead.
+        rsync_opts.append("--info=name2")
+        manifest = snapshot_manifest.ManifestWriter(backup_dir, seed_dir, hash_files=MANIFEST_HASH,
+                                                    incremental=changes is not None)
 
     try:
-        process = subprocess.Popen(rsync_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-        
-        #Reserve lines for the console
-        # Static header for progress line
-        print("Transferred(b)   Percent   Speed        ETA       Transfer Info")
-
-        NUM_LINES=3
-        print("\n"*NUM_LINES)
-
-        #rsync Log Line Types
-        progress_line=""
-        rsync_path_line=""
-        last_rsync_path_line=""
-        catch_all_line=""
-
-        #Begin printing to console
-        for line in process.stdout:
-            #Examples:
-            #  35,243,536   0%  223.03kB/s    0:02:34 (xfr#80, ir-chk=1002/82824)
-            #  /rootdir/path/to/file.extension
-            
-            #Rip off trailing whitespace and newline
-            line = line.strip()
-
-            # Categorize and update line content first
-            if "kB/s" in line or "MB/s" in line or "xfr#" in line:
-                progress_line = line
-            elif os.path.exists("/"+line): 
-                rsync_path_line = "/" + line
-                if DEBUG and (line not in last_rsync_path_line):#Only log new lines to logfile
-                    last_rsync_path_line = line
-                    logging.debug(f"/{line}")
-            else: #assume error
-                logging.warning(line)
-                catch_all_line = line
-
-            # Move cursor up NUM_LINES
-            sys.stdout.write(f'\033[{NUM_LINES}F')  # Move up to start of reserved area
-
-            # Print each line, clearing the previous content. !!MUST MATCH NUM_LINES!!
-            sys.stdout.write('\033[K' + "Last Status Msg: " + catch_all_line + '\n')  # Clear + write path line
-            sys.stdout.write('\033[K' + "Status: " + progress_line + '\n')  # Clear + write progress line
-            sys.stdout.write('\033[K' + "Last File: " + rsync_path_line + '\n')  # Clear + write path line
-
-            sys.stdout.flush()
-
-        process.wait()
-
-        if process.returncode == 0:
+        with metrics.phase("transfer"):
+            if changes is not None:
+                returncode, stats = run_incremental_backup(rsync_opts, backup_dir, changes, manifest)
+            elif SHARD_WORKERS > 1:
+                returncode, stats = run_sharded_backup(rsync_opts, backup_dir, manifest)
+            else:
+                rsync_cmd = ["rsync", "-aAX", "--info=progress2,stats2", "--one-file-system", "--no-xattrs",
+                             os.path.join(SOURCE_ROOT, ""), backup_dir] + rsync_opts
+                returncode, stats = run_rsync_console(rsync_cmd, manifest)
+        metrics.set(exit_code=returncode, files_total=stats.get("files"), files_transferred=stats.get("files_transferred"),
+                    bytes_transferred=stats.get("bytes_transferred"), snapshot_bytes=stats.get("total_size"),
+                    file_list_seconds=stats.get("file_list_seconds"))
+
+        if manifest:
+            with metrics.phase("manifest"):
+                log(f"Manifest written to {manifest.close()} ({manifest.rows} entries)")
+
+        if seed_dir:
+            log_snapshot_stats(seed_dir, stats)
+
+        # 24 = files vanished while copying, those are gone from the journal's point of view too.
+        if CHANGE_JOURNAL and returncode in (0, 24):
+            change_tracker.commit(CHANGE_JOURNAL_DIR)
+
+        if returncode == 0:
             log("Backup completed successfully.")
         else:
-            log(f"Backup finished with errors. Exit code: {process.returncode}")
+            log(f"Backup finished with errors. Exit code: {returncode}")
     except Exception as e:
+        metrics.set(exit_code=-1)
         log(f"Backup failed: {e}")
 
-def purge_old_backups():
+def purge_old_backups(today=None, metrics=None):
     log(f"Purging backups older than {RETENTION_DAYS} days...")
-    #TODO(MHC) - Do this part.
+    today = today or datetime.date.today()
+    hostname = os.uname().nodename
+    metrics = metrics or backup_metrics.RunMetrics(hostname)
+    host_dir = os.path.join(BACKUP_BASE, hostname)
+    if not os.path.isdir(host_dir):
+        return
+    try:
+        with metrics.phase("purge"):
+            kept, expired, files, reclaimed = retention.purge(host_dir, today, RETENTION_DAYS,
+                                                              KEEP_WEEKLY, KEEP_MONTHLY, KEEP_YEARLY,
+                                                              dry_run=PURGE_DRY_RUN, workers=PURGE_WORKERS)
+    except Exception as e:
+        log(f"Purge failed: {e}")
+        return
+    if not PURGE_DRY_RUN:
+        metrics.set(purged_snapshots=len(expired), reclaimed_bytes=reclaimed, kept_snapshots=len(kept))
+    for backup_dir in expired:
+        log(f"{'Would purge' if PURGE_DRY_RUN else 'Purged'} {os.path.basename(backup_dir)}")
+    verb = "Would reclaim" if PURGE_DRY_RUN else "Reclaimed"
+    log(f"{verb} {reclaimed} bytes from {files} files in {len(expired)} snapshots, kept {len(kept)} snapshots")
+
+    if ARCHIVE_AFTER_DAYS and not PURGE_DRY_RUN:
+        with metrics.phase("archive"):
+            for backup_dir in archive.cold_snapshots(host_dir, today, ARCHIVE_AFTER_DAYS):
+                if dedup_store.has_index(backup_dir):
+                    continue
+                try:
+                    count, size, packed = archive.pack(backup_dir)
+                except Exception as e:
+                    log(f"Packing {os.path.basename(backup_dir)} failed: {e}")
+                    continue
+                log(f"Packed {os.path.basename(backup_dir)}: {count} files, {size} -> {packed} bytes")
+
+    store = dedup_store.store_dir(BACKUP_BASE)
+    if os.path.isdir(store) and not PURGE_DRY_RUN:
+        with metrics.phase("dedup_gc"):
+            chunks, size = dedup_store.gc(store)
+        log(f"Dedup store: freed {chunks} unreferenced chunks ({size} bytes)")
+
+def record_metrics(metrics):
+    # History line, Prometheus textfile and a log line per regression. Never fails the backup.
+    transfer = metrics.phases.get("transfer")
+    if transfer:
+        metrics.set(transfer_bytes_per_second=round((metrics.values.get("bytes_transferred") or 0) / transfer),
+                    files_per_second=round((metrics.values.get("files_total") or 0) / transfer))
+    record = metrics.record()
+    host_dir = os.path.join(BACKUP_BASE, metrics.host)
+    try:
+        for message in backup_metrics.find_regressions(record, backup_metrics.read_history(host_dir)):
+            log(f"Slower than usual: {message}")
+        backup_metrics.append_history(record, host_dir)
+        if METRICS_TEXTFILE_DIR:
+            backup_metrics.write_textfile(record, METRICS_TEXTFILE_DIR)
+    except Exception as e:
+        log(f"Writing metrics failed: {e}")
 
 def main():
+    setup_logging()
     today = datetime.date.today().strftime("%b %d %Y")
     start = datetime.datetime.now().strftime("%H:%M")
     start_time = datetime.datetime.now()
     log(f"")
     log(f"")
     log(f"========== Backup job started on {today} at {start} ==========")
-    run_backup()
-    purge_old_backups()
+    metrics = backup_metrics.RunMetrics(os.uname().nodename)
+    run_backup(metrics=metrics)
+    purge_old_backups(metrics=metrics)
     today = datetime.date.today().strftime("%b %d %Y")
     now = datetime.datetime.now().strftime("%H:%M")
     finish_time = datetime.datetime.now()
+    metrics.set(duration_seconds=round((finish_time - start_time).total_seconds(), 3))
+    record_metrics(metrics)
     log(f"========== Backup job finished on {today} at {now}. Elapsed: {finish_time-start_time}=========\n\n")
     log(f"")
     log(f"")
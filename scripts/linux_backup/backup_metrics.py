@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# Per-run phase timings and throughput for backup_host.py.
+#
+# backup_host.main() times every phase of run_backup() and purge_old_backups() into a RunMetrics and
+# writes it out twice:
+#   - a Prometheus textfile-collector file, <METRICS_TEXTFILE_DIR>/backup_<host>.prom (last run only)
+#   - one JSON line per run appended to BACKUP_BASE/<host>/backup_metrics.jsonl (history)
+# A run is compared against the median of the previous REGRESSION_WINDOW runs, and slowdowns are logged.
+#
+# Usage:
+#   backup_metrics.py history [--host hostname] [--last 20]
+import argparse, contextlib, json, os, statistics, time
+
+import snapshots
+
+HISTORY_NAME = "backup_metrics.jsonl"
+REGRESSION_WINDOW = 8
+# Flag a run that took this many times the median duration, or moved data at 1/x of the median rate.
+REGRESSION_FACTOR = 1.5
+
+# Values without HELP text here are still exported, with the key as HELP.
+METRIC_HELP = {
+    "duration_seconds": "Wall time of the whole backup job.",
+    "exit_code": "rsync exit code of the backup, 0 is success, -1 when it failed before rsync finished.",
+    "files_total": "Files in the snapshot.",
+    "files_transferred": "Regular files written to the snapshot.",
+    "bytes_transferred": "Bytes written to the snapshot.",
+    "files_failed": "Files the dedup backend could not read, they are not in the snapshot.",
+    "snapshot_bytes": "Total size of the files in the snapshot.",
+    "file_list_seconds": "rsync's file list generation time, the scan part of the transfer phase.",
+    "transfer_bytes_per_second": "bytes_transferred divided by the transfer phase.",
+    "files_per_second": "files_total divided by the transfer phase.",
+    "purged_snapshots": "Snapshots removed by the purge.",
+    "reclaimed_bytes": "Bytes freed by the purge.",
+    "kept_snapshots": "Snapshots left after the purge.",
+}
+
+class RunMetrics:
+    def __init__(self, host):
+        self.host = host
+        self.started = time.time()
+        self.phases = {}
+        self.values = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # Time a block, a phase entered twice (Ex: several rsync passes) adds up.
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.monotonic() - started
+
+    def set(self, **values):
+        self.values.update(values)
+
+    def record(self):
+        return {"host": self.host, "started": int(self.started), "phases": {k: round(v, 3) for k, v in self.phases.items()},
+                **self.values}
+
+# === OUTPUT ===
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+def write_textfile(record, textfile_dir):
+    # Written to a temp file and renamed, node_exporter must never read half a file.
+    host = _label(record["host"])
+    lines = ["# HELP backup_last_run_timestamp_seconds Start of the last backup job.",
+             "# TYPE backup_last_run_timestamp_seconds gauge",
+             f'backup_last_run_timestamp_seconds{{host="{host}"}} {record["started"]}',
+             "# HELP backup_phase_seconds Time spent in each phase of the last backup job.",
+             "# TYPE backup_phase_seconds gauge"]
+    lines += [f'backup_phase_seconds{{host="{host}",phase="{_label(name)}"}} {seconds}'
+              for name, seconds in record["phases"].items()]
+    for key, value in record.items():
+        if key in ("host", "started", "phases") or not isinstance(value, (int, float)):
+            continue
+        lines += [f"# HELP backup_{key} {METRIC_HELP.get(key, key)}",
+                  f"# TYPE backup_{key} gauge",
+                  f'backup_{key}{{host="{host}"}} {value}']
+    os.makedirs(textfile_dir, exist_ok=True)
+    path = os.path.join(textfile_dir, f"backup_{record['host']}.prom")
+    with open(path + ".tmp", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(path + ".tmp", path)
+    return path
+
+def history_path(host_dir):
+    return os.path.join(host_dir, HISTORY_NAME)
+
+def append_history(record, host_dir):
+    os.makedirs(host_dir, exist_ok=True)
+    with open(history_path(host_dir), "a") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+def read_history(host_dir):
+    try:
+        with open(history_path(host_dir)) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+# === REGRESSIONS ===
+
+def find_regressions(record, previous):
+    # Compare one run with the median of the runs before it. Returns a list of messages.
+    previous = previous[-REGRESSION_WINDOW:]
+    if len(previous) < 3:
+        return []
+    messages = []
+    checks = [(key, record.get(key), [r.get(key) for r in previous], key.endswith("per_second"))
+              for key in ("duration_seconds", "transfer_bytes_per_second")]
+    checks += [(f"{name} phase", seconds, [r["phases"].get(name) for r in previous], False)
+               for name, seconds in record["phases"].items()]
+    for name, value, past, higher_is_better in checks:
+        past = [v for v in past if v]
+        if value is None or len(past) < 3:
+            continue
+        median = statistics.median(past)
+        if (not higher_is_better and median >= 1 and value > median * REGRESSION_FACTOR) or \
+                (higher_is_better and value < median / REGRESSION_FACTOR):
+            messages.append(f"{name}: {value:.1f} vs median {median:.1f} of the last {len(past)} runs")
+    return messages
+
+def print_history(host_dir, last):
+    runs = read_history(host_dir)[-last - REGRESSION_WINDOW:]
+    phases = sorted({name for run in runs for name in run["phases"]})
+    print(f"== {os.path.basename(host_dir)} ==")
+    print(f"{'started':<17} {'total':>8} " + " ".join(f"{p:>10}" for p in phases) + f" {'MB/s':>8} {'written MB':>11}")
+    for i, run in enumerate(runs):
+        if i < len(runs) - last:
+            continue
+        started = time.strftime("%Y-%m-%d %H:%M", time.localtime(run["started"]))
+        rate = (run.get("transfer_bytes_per_second") or 0) / 1024**2
+        written = (run.get("bytes_transferred") or 0) / 1024**2
+        flag = " !" if find_regressions(run, runs[:i]) else ""
+        print(f"{started:<17} {run.get('duration_seconds', 0):>7.0f}s "
+              + " ".join(f"{run['phases'].get(p, 0):>9.1f}s" for p in phases)
+              + f" {rate:>8.1f} {written:>11.1f}{flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Show backup timing history, '!' marks a regression")
+    parser.add_argument("command", choices=["history"])
+    parser.add_argument("--base", default=snapshots.DEFAULT_BACKUP_BASE, help="Backup base directory")
+    parser.add_argument("--host", help="Only this host")
+    parser.add_argument("--last", type=int, default=20, help="Number of runs to show per host")
+    args = parser.parse_args()
+    hosts = [os.path.join(args.base, args.host)] if args.host else snapshots.list_hosts(args.base)
+    for host_dir in hosts:
+        if read_history(host_dir):
+            print_history(host_dir, args.last)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# Benchmarks for the backup pipeline against a repeatable synthetic file tree.
+#
+# `run` generates a tree (same --seed, same tree) and drives backup_host.py's own functions against
+# a temporary BACKUP_BASE, one stage at a time:
+#   first_week   full backup into an empty BACKUP_BASE
+#   rollover     next ISO week after --changed of the files were modified, seeded from the first week
+#   incremental  same week again after another --changed of the files were modified
+#   purge        KEEP_WEEKLY = 1, drops the first week
+#   restore      restore_node.py dry run + restore of the newest snapshot into an empty directory
+# Every stage runs in a forked child, so its numbers include rsync and worker processes and nothing else:
+# wall time, CPU time, read/write syscalls and bytes (/proc/self/io), peak RSS and files/s.
+# Results are written to a JSON file, `compare` prints two of them side by side.
+#
+# Usage:
+#   benchmark.py run --files 50000 --changed 0.05 --out results.json [--backend dedup] [--work-dir /var/tmp/bench]
+#   benchmark.py generate /var/tmp/tree --files 10000 --depth 4
+#   benchmark.py compare before.json after.json
+import argparse, datetime, json, logging, math, os, platform, random, shutil, sys
+import tempfile, time, traceback
+
+import backup_host, backup_metrics, dedup_store, restore_node, snapshots
+
+# Monday of W30-2025, the stages pretend to run on this week and the next.
+FIRST_WEEK = datetime.date(2025, 7, 21)
+# Generated files get mtimes from here on, one week apart per mutation.
+BASE_MTIME = 1735689600  # 2025-01-01
+
+# === TREE GENERATOR ===
+
+def file_size(rng, median_size, max_size):
+    # Log-normal: lots of small files, a long tail of big ones, like a real root filesystem.
+    return min(int(rng.lognormvariate(math.log(median_size), 1.5)), max_size)
+
+def write_file(path, rng, size, mtime):
+    with open(path, "wb") as f:
+        f.write(rng.randbytes(size))
+    os.utime(path, (mtime, mtime))
+
+def generate_tree(root, files=10000, depth=4, fanout=8, median_size=4096, max_size=64 * 1024**2, seed=0):
+    # Returns the relative paths of the generated files. Dirs are 1..depth levels deep, fanout dirs per level.
+    rng = random.Random(seed)
+    paths = []
+    for i in range(files):
+        parts = [f"d{rng.randrange(fanout)}" for _ in range(rng.randint(1, depth))]
+        rel = os.path.join(*parts, f"f{i:07d}.dat")
+        os.makedirs(os.path.join(root, *parts), exist_ok=True)
+        write_file(os.path.join(root, rel), rng, file_size(rng, median_size, max_size), BASE_MTIME)
+        paths.append(rel)
+    return paths
+
+def mutate_tree(root, paths, fraction, generation, median_size=4096, max_size=64 * 1024**2, seed=0):
+    # Rewrite `fraction` of the files with new content and a newer mtime. Returns how many changed.
+    rng = random.Random(seed * 1000 + generation)
+    changed = rng.sample(paths, int(len(paths) * fraction))
+    mtime = BASE_MTIME + generation * 7 * 86400
+    for rel in changed:
+        write_file(os.path.join(root, rel), rng, file_size(rng, median_size, max_size), mtime)
+    return len(changed)
+
+def tree_bytes(root):
+    return sum(os.lstat(os.path.join(d, name)).st_size for d, _, names in os.walk(root) for name in names)
+
+# === MEASUREMENT ===
+
+def proc_io():
+    # rchar/wchar, syscr/syscw (read/write syscalls), read_bytes/write_bytes (storage). Reaped children count too.
+    try:
+        with open("/proc/self/io") as f:
+            return {key: int(value) for key, value in (line.split(":") for line in f)}
+    except OSError:
+        return {}
+
+def measure(stage, files, fn):
+    read_fd, write_fd = os.pipe()
+    started = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        code = 0
+        before = proc_io()
+        try:
+            fn()
+            after = proc_io()
+            result = {key: after[key] - before.get(key, 0) for key in after}
+        except BaseException as e:
+            traceback.print_exc()
+            result, code = {"error": str(e)}, 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        with os.fdopen(write_fd, "w") as out:
+            json.dump(result, out)
+        os._exit(code)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        io = json.loads(f.read() or "{}")
+    _, status, usage = os.wait4(pid, 0)
+    wall = time.perf_counter() - started
+    record = {
+        "stage": stage,
+        "wall_s": round(wall, 3),
+        "user_s": round(usage.ru_utime, 3),
+        "sys_s": round(usage.ru_stime, 3),
+        "read_syscalls": io.get("syscr"),
+        "write_syscalls": io.get("syscw"),
+        "read_bytes": io.get("read_bytes"),
+        "write_bytes": io.get("write_bytes"),
+        "rchar": io.get("rchar"),
+        "wchar": io.get("wchar"),
+        "peak_rss_kb": usage.ru_maxrss,
+        "files": files,
+        "files_per_s": round(files / wall, 1) if wall else None,
+        "exit_status": os.waitstatus_to_exitcode(status),
+    }
+    if "error" in io:
+        record["error"] = io["error"]
+    print(f"[*] {stage}: {wall:.2f}s, {record['files_per_s']} files/s, peak RSS {usage.ru_maxrss} KiB")
+    return record
+
+# === STAGES ===
+
+def backup(today):
+    # run_backup logs a failed rsync instead of raising, its metrics say whether the run worked.
+    metrics = backup_metrics.RunMetrics(os.uname().nodename)
+    backup_host.run_backup(today, metrics)
+    exit_code = metrics.values.get("exit_code", -1)
+    if exit_code != 0:
+        raise RuntimeError(f"backup exited with {exit_code}")
+
+def restore_latest(base, target, workers):
+    host_dir = os.path.join(base, os.uname().nodename)
+    backup_dir = snapshots.list_snapshots(host_dir)[-1]
+    source = backup_dir
+    if dedup_store.has_index(backup_dir):
+        source = os.path.join(base, ".restore-benchmark")
+        dedup_store.materialize(backup_dir, source, dedup_store.store_dir(base))
+    items = restore_node.dry_run(source, target, [])
+    returncode = restore_node.restore(source, target, items, workers)
+    if returncode not in (0, 23):
+        raise RuntimeError(f"restore exited with {returncode}")
+
+def run_benchmark(args, work_dir):
+    tree = os.path.join(work_dir, "tree")
+    base = os.path.join(work_dir, "backups")
+    target = os.path.join(work_dir, "restore")
+    os.makedirs(base)
+    os.makedirs(target)
+    # backup_host's log() goes to the work dir, not to the real backup log.
+    logging.basicConfig(filename=os.path.join(work_dir, "backup.log"), level=logging.INFO,
+                        format='%(asctime)s [%(levelname)s] %(message)s')
+
+    backup_host.BACKUP_BASE = base
+    backup_host.SOURCE_ROOT = tree
+    backup_host.BACKUP_BACKEND = args.backend
+    backup_host.SNAPSHOT_MODE = args.snapshot_mode
+    backup_host.MANIFEST = not args.no_manifest
+    backup_host.MANIFEST_HASH = args.manifest_hash
+    backup_host.CHANGE_JOURNAL = False
+    backup_host.SHARD_WORKERS = 0
+    backup_host.PURGE_WORKERS = args.workers
+
+    print(f"[*] Generating {args.files} files in {tree}")
+    sizes = dict(median_size=args.median_size, max_size=args.max_size, seed=args.seed)
+    paths = generate_tree(tree, args.files, args.depth, args.fanout, **sizes)
+    week2 = FIRST_WEEK + datetime.timedelta(weeks=1)
+
+    stages = [measure("first_week", len(paths), lambda: backup(FIRST_WEEK))]
+    changed = mutate_tree(tree, paths, args.changed, 1, **sizes)
+    stages.append(measure("rollover", len(paths), lambda: backup(week2)))
+    mutate_tree(tree, paths, args.changed, 2, **sizes)
+    stages.append(measure("incremental", len(paths), lambda: backup(week2)))
+    backup_host.KEEP_WEEKLY = 1
+    stages.append(measure("purge", len(paths), lambda: backup_host.purge_old_backups(week2)))
+    stages.append(measure("restore", len(paths), lambda: restore_latest(base, target, args.workers)))
+
+    try:
+        rsync_version = backup_host.EXECUTOR.call(["rsync", "--version"]).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        rsync_version = None
+    return {
+        "started": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "rsync": rsync_version,
+        "config": {key: value for key, value in vars(args).items() if key not in ("command", "func")},
+        "tree": {"files": len(paths), "bytes": tree_bytes(tree), "changed_per_week": changed},
+        "stages": stages,
+    }
+
+def cmd_run(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="backup-bench-", dir="/var/tmp")
+    if os.path.exists(os.path.join(work_dir, "tree")):
+        sys.exit(f"{work_dir} already holds a benchmark, use an empty --work-dir")
+    try:
+        results = run_benchmark(args, work_dir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[*] Results written to {args.out}")
+
+def cmd_generate(args):
+    paths = generate_tree(args.root, args.files, args.depth, args.fanout, args.median_size, args.max_size, args.seed)
+    print(f"[*] Generated {len(paths)} files, {tree_bytes(args.root)} bytes in {args.root}")
+
+def cmd_compare(args):
+    with open(args.before) as f:
+        before = {s["stage"]: s for s in json.load(f)["stages"]}
+    with open(args.after) as f:
+        after = {s["stage"]: s for s in json.load(f)["stages"]}
+    print(f"{'stage':<12} {'before':>10} {'after':>10} {'change':>8} {'files/s before':>15} {'files/s after':>14}")
+    for stage, old in before.items():
+        new = after.get(stage)
+        if not new:
+            continue
+        change = (new["wall_s"] - old["wall_s"]) / old["wall_s"] if old["wall_s"] else 0
+        print(f"{stage:<12} {old['wall_s']:>9.2f}s {new['wall_s']:>9.2f}s {change:>+8.0%} "
+              f"{old['files_per_s']:>15} {new['files_per_s']:>14}")
+
+def add_tree_args(parser):
+    parser.add_argument("--files", type=int, default=10000, help="Number of files to generate")
+    parser.add_argument("--depth", type=int, default=4, help="Maximum directory depth")
+    parser.add_argument("--fanout", type=int, default=8, help="Directories per level")
+    parser.add_argument("--median-size", type=int, default=4096, help="Median file size in bytes")
+    parser.add_argument("--max-size", type=int, default=64 * 1024**2, help="Largest file size in bytes")
+    parser.add_argument("--seed", type=int, default=0, help="Same seed, same tree")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the backup pipeline on a synthetic tree")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Time every backup stage, write a JSON results file")
+    add_tree_args(run)
+    run.add_argument("--changed", type=float, default=0.05, help="Share of files modified between runs")
+    run.add_argument("--backend", choices=["rsync", "dedup"], default="rsync")
+    run.add_argument("--snapshot-mode", choices=["link", "copy"], default="link")
+    run.add_argument("--no-manifest", action="store_true")
+    run.add_argument("--manifest-hash", action="store_true")
+    run.add_argument("--workers", type=int, default=4, help="Purge and restore workers")
+    run.add_argument("--work-dir", help="Empty directory for the tree and BACKUP_BASE (default: a temp dir)")
+    run.add_argument("--keep", action="store_true", help="Don't delete the work dir afterwards")
+    run.add_argument("--out", default="benchmark_results.json")
+    run.set_defaults(func=cmd_run)
+
+    generate = sub.add_parser("generate", help="Only generate a synthetic tree")
+    generate.add_argument("root")
+    add_tree_args(generate)
+    generate.set_defaults(func=cmd_generate)
+
+    compare = sub.add_parser("compare", help="Compare two results files")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# Resident inotify change tracker for backup_host.py.
+#
+# The tracker watches every directory under "/" (minus EXCLUDES, same filesystem only) and appends
+# changed paths to a journal in JOURNAL_DIR. backup_host.py then sends only those paths through
+# rsync --files-from instead of letting rsync stat the whole root filesystem.
+#
+# Journal lines:
+#   F /etc/hosts        file changed, created or moved in
+#   D /home/user/new    directory created or moved in, rsync recurses into it
+#   !START 1753500000   tracker (re)started, events before this are unknown
+#   !OVERFLOW           kernel queue overflowed or a watch could not be added, events were lost
+# Any "!" line in the consumed journal, a dead tracker or a new week means a full scan instead.
+#
+# Usage (run as root, e.g. from a systemd service):
+#   change_tracker.py run
+#   change_tracker.py status
+import argparse, ctypes, ctypes.util, errno, fcntl, os, select, struct, sys, time
+
+JOURNAL_DIR = "/var/lib/backup_tracker"
+JOURNAL = "journal"
+PENDING = "journal.pending"
+LOCK = "journal.lock"
+PID_FILE = "tracker.pid"
+FLUSH_SECONDS = 5
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+EVENT_HEADER = struct.Struct("iIII")
+
+def journal_file(name, journal_dir=JOURNAL_DIR):
+    return os.path.join(journal_dir, name)
+
+class JournalLock:
+    # flock shared by the tracker (append) and backup_host.py (rotate), so no line is written
+    # into a journal after it has been rotated away and read.
+    def __init__(self, journal_dir):
+        self.path = journal_file(LOCK, journal_dir)
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+
+def append(journal_dir, lines):
+    with JournalLock(journal_dir):
+        with open(journal_file(JOURNAL, journal_dir), "a") as f:
+            f.write("".join(line + "\n" for line in lines))
+
+# === TRACKER ===
+
+class Tracker:
+    def __init__(self, root="/", exclude=lambda path: False, journal_dir=JOURNAL_DIR):
+        self.root = root
+        self.exclude = exclude
+        self.journal_dir = journal_dir
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root_dev = os.lstat(root).st_dev
+        self.watches = {}
+        self.changed = set()
+
+    def watch_tree(self, top):
+        # Watch top and every directory below it. Returns False once the watch limit is hit.
+        pending = [top]
+        while pending:
+            path = pending.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    print(f"[!] Out of inotify watches at {path}, raise fs.inotify.max_user_watches", file=sys.stderr)
+                    self.changed.add("!OVERFLOW")
+                    return False
+                continue  # Vanished or not a directory any more.
+            self.watches[wd] = path
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if (entry.is_dir(follow_symlinks=False) and not self.exclude(entry.path)
+                                and entry.stat(follow_symlinks=False).st_dev == self.root_dev):
+                            pending.append(entry.path)
+            except OSError:
+                continue
+        return True
+
+    def handle(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size: offset + EVENT_HEADER.size + length].split(b"\0", 1)[0]
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                self.changed.add("!OVERFLOW")
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            parent = self.watches.get(wd)
+            if parent is None or not name:
+                continue
+            path = os.path.join(parent, os.fsdecode(name))
+            if self.exclude(path) or mask & (IN_DELETE | IN_MOVED_FROM):
+                # Deletes need no transfer, backups never delete from the snapshot.
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch_tree(path)
+                    self.changed.add(f"D {path}")
+                continue
+            self.changed.add(f"F {path}")
+
+    def flush(self):
+        if self.changed:
+            append(self.journal_dir, sorted(self.changed))
+            self.changed.clear()
+
+    def run(self):
+        os.makedirs(self.journal_dir, mode=0o700, exist_ok=True)
+        with open(journal_file(PID_FILE, self.journal_dir), "w") as f:
+            f.write(str(os.getpid()))
+        started = time.monotonic()
+        self.watch_tree(self.root)
+        print(f"[*] Watching {len(self.watches)} directories in {time.monotonic() - started:.1f}s")
+        # Written once every watch is in place: the full scan this forces covers anything before it.
+        append(self.journal_dir, [f"!START {int(time.time())}"])
+        last_flush = time.monotonic()
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], FLUSH_SECONDS)
+            if ready:
+                try:
+                    self.handle(os.read(self.fd, 1024 * 1024))
+                except BlockingIOError:
+                    pass
+            if time.monotonic() - last_flush >= FLUSH_SECONDS:
+                self.flush()
+                last_flush = time.monotonic()
+
+# === CONSUMER (backup_host.py) ===
+
+def tracker_running(journal_dir=JOURNAL_DIR):
+    try:
+        with open(journal_file(PID_FILE, journal_dir)) as f:
+            os.kill(int(f.read().strip()), 0)
+        return True
+    except (OSError, ValueError):
+        return False
+
+def take_changes(journal_dir=JOURNAL_DIR):
+    # Rotate the journal and return (files, dirs, None) to back up, or (None, None, reason) when a full
+    # scan is needed. Consumed lines stay in PENDING until commit(), so a failed backup retries them.
+    if not tracker_running(journal_dir):
+        return None, None, "change tracker is not running"
+    pending = journal_file(PENDING, journal_dir)
+    with JournalLock(journal_dir):
+        journal = journal_file(JOURNAL, journal_dir)
+        if os.path.exists(journal):
+            with open(journal) as src, open(pending, "a") as dst:
+                dst.write(src.read())
+            os.remove(journal)
+    if not os.path.exists(pending):
+        return [], [], None
+    files, dirs = set(), set()
+    with open(pending) as f:
+        for line in f:
+            kind, _, path = line.rstrip("\n").partition(" ")
+            if kind == "!START":
+                return None, None, "change tracker restarted since the last backup"
+            if kind == "!OVERFLOW":
+                return None, None, "change journal overflowed"
+            (dirs if kind == "D" else files).add(path)
+    return sorted(files), sorted(dirs), None
+
+def commit(journal_dir=JOURNAL_DIR):
+    # Backup succeeded, everything in PENDING is now in the snapshot.
+    try:
+        os.remove(journal_file(PENDING, journal_dir))
+    except FileNotFoundError:
+        pass
+
+def write_files_from(files, dirs, out):
+    # rsync --files-from list relative to "/". Paths deleted since they were journaled are dropped,
+    # a dir already being recursed into covers every path below it.
+    count = 0
+    dirs = set(dirs)
+    for path in sorted(set(files) | dirs):
+        if not os.path.lexists(path):
+            continue
+        if any(_parents(path, dirs)):
+            continue
+        out.write(path.lstrip("/") + "\n")
+        count += 1
+    return count
+
+def _parents(path, dirs):
+    parent = os.path.dirname(path)
+    while parent not in ("/", ""):
+        if parent in dirs:
+            yield parent
+        parent = os.path.dirname(parent)
+
+def main():
+    parser = argparse.ArgumentParser(description="inotify change tracker for incremental backups")
+    parser.add_argument("command", choices=["run", "status"])
+    parser.add_argument("--journal-dir", default=JOURNAL_DIR)
+    args = parser.parse_args()
+    if args.command == "status":
+        running = tracker_running(args.journal_dir)
+        journal = journal_file(JOURNAL, args.journal_dir)
+        lines = sum(1 for _ in open(journal)) if os.path.exists(journal) else 0
+        print(f"Tracker {'running' if running else 'not running'}, {lines} journal lines pending")
+        return
+    # Same exclude rules as the backup itself.
+    import backup_host
+    Tracker(exclude=backup_host.is_excluded, journal_dir=args.journal_dir).run()
+
+if __name__ == "__main__":
+    main()
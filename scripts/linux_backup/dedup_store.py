@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+# Content addressed deduplication store shared by every host under BACKUP_BASE.
+#
+#   /disk01/backups/.dedup/store.db            <- chunk hash -> size, reference count
+#   /disk01/backups/.dedup/chunks/ab/abcd...   <- one file per unique chunk
+#   /disk01/backups/hostname/hostname-W30-2025/.chunk-index   <- the snapshot, as a chunk index
+#
+# Files are split into content defined chunks (byte class mark, 256KiB min / 1MiB avg / 4MiB max), so
+# an edit in the middle of a big file only stores the chunks around the edit. Chunking runs in a
+# process pool. Files whose size, mtime and inode match the previous snapshot reuse its chunk list
+# without being read at all.
+#
+# Every snapshot holds one reference on each distinct chunk it uses. purge_old_backups releases the
+# references of expired snapshots and garbage collects chunks nobody references any more.
+#
+# Usage:
+#   dedup_store.py materialize /disk01/backups/hostname/hostname-W30-2025 /tmp/restore   Rebuild the tree
+#   dedup_store.py gc [--base /disk01/backups]                                             Drop unreferenced chunks
+#   dedup_store.py stats [--base /disk01/backups]
+import argparse, concurrent.futures, hashlib, itertools, logging, os, sqlite3, stat, sys, time
+
+import snapshots
+
+STORE_NAME = ".dedup"
+INDEX_NAME = ".chunk-index"
+MIN_CHUNK = 256 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+CUT_BITS = 20                   # ~1MiB average chunk after MIN_CHUNK
+READ_SIZE = 8 * 1024 * 1024
+GC_GRACE_SECONDS = 24 * 3600    # Chunks written by a backup that is still running are not referenced yet.
+
+# Every byte value falls in class 0 or 1, a chunk ends after CUT_BITS bytes whose classes spell CUT_MARK.
+# That happens about once every 2**CUT_BITS bytes. The mark is balanced and has no long runs (Thue-Morse),
+# so an uneven class split or text with short words still cuts close to the average.
+CUT_CLASSES = bytes(hashlib.blake2b(bytes([i]), digest_size=1).digest()[0] & 1 for i in range(256))
+CUT_MARK = bytes(bin(i).count("1") & 1 for i in range(CUT_BITS))
+CUT_SCAN = 1024 * 1024          # Classify this much at a time, most chunks end within the first block.
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, refs INTEGER NOT NULL) WITHOUT ROWID;
+"""
+INDEX_SCHEMA = """
+CREATE TABLE entries (
+    path   TEXT PRIMARY KEY,
+    mode   INTEGER NOT NULL,
+    uid    INTEGER NOT NULL,
+    gid    INTEGER NOT NULL,
+    size   INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ino    INTEGER NOT NULL,
+    nlink  INTEGER NOT NULL,
+    target TEXT
+) WITHOUT ROWID;
+CREATE TABLE file_chunks (
+    path TEXT NOT NULL,
+    seq  INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (path, seq)
+) WITHOUT ROWID;
+"""
+
+def store_dir(backup_base):
+    return os.path.join(backup_base, STORE_NAME)
+
+def index_path(backup_dir):
+    return os.path.join(backup_dir, INDEX_NAME)
+
+def has_index(backup_dir):
+    return os.path.exists(index_path(backup_dir))
+
+def chunk_path(store, digest):
+    return os.path.join(store, "chunks", digest[:2], digest)
+
+def open_store(store):
+    os.makedirs(os.path.join(store, "chunks"), exist_ok=True)
+    # Several hosts can finish at the same time, wait on the lock instead of failing.
+    conn = sqlite3.connect(os.path.join(store, "store.db"), timeout=300)
+    conn.executescript(STORE_SCHEMA)
+    return conn
+
+# === CHUNKING (runs in worker processes) ===
+
+def find_cut(data):
+    # Length of the next chunk at the start of data, cut at the end of the first CUT_MARK past MIN_CHUNK.
+    # translate() and find() run in C, a per byte hash in Python doesn't keep up with the disk.
+    size = len(data)
+    if size <= MIN_CHUNK:
+        return size
+    end = min(size, MAX_CHUNK)
+    start = MIN_CHUNK - len(CUT_MARK) + 1
+    while True:
+        stop = min(start + CUT_SCAN, end)
+        found = bytes(data[start:stop]).translate(CUT_CLASSES).find(CUT_MARK)
+        if found >= 0:
+            return start + found + len(CUT_MARK)
+        if stop == end:
+            return end
+        # Overlap the blocks so a mark across the boundary is still found.
+        start = stop - len(CUT_MARK) + 1
+
+def store_chunk(store, data):
+    digest = hashlib.blake2b(data, digest_size=32).hexdigest()
+    path = chunk_path(store, digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    else:
+        # Touch so a GC running right now sees the chunk as recently used.
+        os.utime(path)
+    return digest, len(data)
+
+def chunk_file(store, path):
+    # Returns (path, [(hash, size), ...]), writing chunks the store does not have yet.
+    chunks = []
+    buf = bytearray()
+    with open(path, "rb") as f:
+        eof = False
+        while not eof or buf:
+            while not eof and len(buf) < MAX_CHUNK:
+                block = f.read(READ_SIZE)
+                if not block:
+                    eof = True
+                buf += block
+            if not buf:
+                break
+            # Only cut a short tail at EOF, otherwise wait for a full window.
+            cut = find_cut(memoryview(buf)) if not eof or len(buf) > MIN_CHUNK else len(buf)
+            chunks.append(store_chunk(store, bytes(buf[:cut])))
+            del buf[:cut]
+    return path, chunks
+
+# === INGEST ===
+
+def walk(root, exclude):
+    # Yields (path, lstat) for everything under root on the same filesystem, skipping exclude(path).
+    root_dev = os.lstat(root).st_dev
+    pending = [root]
+    while pending:
+        path = pending.pop()
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+        for entry in entries:
+            if exclude(entry.path):
+                continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            yield entry.path, st
+            if stat.S_ISDIR(st.st_mode) and st.st_dev == root_dev:
+                pending.append(entry.path)
+
+def ingest(source, backup_dir, store, exclude=lambda path: False, previous_dir=None, workers=None):
+    # Back up `source` into the store and write backup_dir's chunk index.
+    # Returns {"files", "chunked", "reused", "bytes_read", "errors"}. Files that can't be read are logged,
+    # counted in errors and left out of the snapshot.
+    os.makedirs(backup_dir, exist_ok=True)
+    final = index_path(backup_dir)
+    tmp = final + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    index = sqlite3.connect(tmp)
+    index.execute("PRAGMA journal_mode=OFF")
+    index.execute("PRAGMA synchronous=OFF")
+    index.executescript(INDEX_SCHEMA)
+    # Unchanged files are looked up in the previous index, this snapshot's own last run counts too.
+    previous = index_path(previous_dir) if previous_dir and has_index(previous_dir) else final
+    has_previous = os.path.exists(previous)
+    if has_previous:
+        index.execute("ATTACH DATABASE ? AS prev", (previous,))
+
+    result = {"files": 0, "chunked": 0, "reused": 0, "bytes_read": 0, "errors": 0}
+
+    def collect(future, path):
+        try:
+            _, chunks = future.result()
+        except OSError as e:
+            # Vanished or unreadable while backing up. An entry without chunks would restore as an empty file.
+            logging.warning(f"Dedup backup: skipped {path}: {e}")
+            index.execute("DELETE FROM entries WHERE path = ?", (path,))
+            result["errors"] += 1
+            return
+        index.executemany("INSERT INTO file_chunks VALUES (?, ?, ?, ?)",
+                          ((path, seq, digest, size) for seq, (digest, size) in enumerate(chunks)))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        max_in_flight = (workers or os.cpu_count() or 1) * 4
+        for path, st in itertools.chain([(source, os.lstat(source))], walk(source, exclude)):
+            rel = os.path.normpath("/" + os.path.relpath(path, source))
+            target = os.readlink(path) if stat.S_ISLNK(st.st_mode) else None
+            index.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                          (rel, st.st_mode, st.st_uid, st.st_gid, st.st_size, st.st_mtime_ns, st.st_ino, st.st_nlink, target))
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            result["files"] += 1
+            if has_previous and index.execute(
+                    "SELECT 1 FROM prev.entries WHERE path = ? AND size = ? AND mtime_ns = ? AND ino = ?",
+                    (rel, st.st_size, st.st_mtime_ns, st.st_ino)).fetchone():
+                index.execute("INSERT INTO file_chunks SELECT * FROM prev.file_chunks WHERE path = ?", (rel,))
+                result["reused"] += 1
+                continue
+            in_flight[pool.submit(chunk_file, store, path)] = rel
+            result["chunked"] += 1
+            result["bytes_read"] += st.st_size
+            if len(in_flight) >= max_in_flight:
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    collect(future, in_flight.pop(future))
+        for future in concurrent.futures.as_completed(list(in_flight)):
+            collect(future, in_flight.pop(future))
+
+    index.commit()
+    if has_previous:
+        index.execute("DETACH DATABASE prev")
+    index.execute("CREATE INDEX file_chunks_hash ON file_chunks(hash)")
+    index.commit()
+    index.close()
+
+    # Take references for the new index before dropping the old one, chunks shared by both never hit 0.
+    conn = open_store(store)
+    _adjust_refs(conn, tmp, +1)
+    if os.path.exists(final):
+        _adjust_refs(conn, final, -1)
+    os.replace(tmp, final)
+    conn.close()
+    return result
+
+def _adjust_refs(conn, index_file, delta):
+    # One reference per snapshot per distinct chunk.
+    conn.execute("ATTACH DATABASE ? AS idx", (index_file,))
+    with conn:
+        conn.execute(f"""INSERT INTO chunks (hash, size, refs)
+                         SELECT hash, MAX(size), {delta} FROM idx.file_chunks GROUP BY hash
+                         ON CONFLICT(hash) DO UPDATE SET refs = refs + {delta}""")
+    conn.execute("DETACH DATABASE idx")
+
+def release(backup_dir, store):
+    # Drop the references a snapshot holds, called before its directory is deleted.
+    if not has_index(backup_dir):
+        return
+    conn = open_store(store)
+    _adjust_refs(conn, index_path(backup_dir), -1)
+    conn.close()
+
+def gc(store, dry_run=False):
+    # Delete chunks with no references left. Returns (chunks, bytes) freed.
+    conn = open_store(store)
+    rows = conn.execute("SELECT hash, size FROM chunks WHERE refs <= 0").fetchall()
+    cutoff = time.time() - GC_GRACE_SECONDS
+    freed = []
+    for digest, size in rows:
+        path = chunk_path(store, digest)
+        try:
+            if os.lstat(path).st_mtime > cutoff:
+                continue
+            if not dry_run:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+        freed.append((digest, size))
+    if not dry_run:
+        with conn:
+            conn.executemany("DELETE FROM chunks WHERE hash = ? AND refs <= 0", ((digest,) for digest, _ in freed))
+    conn.close()
+    return len(freed), sum(size for _, size in freed)
+
+# === MATERIALIZE ===
+
+def _write_file(store, dest, chunks, mode, uid, gid, mtime_ns):
+    with open(dest, "wb") as out:
+        for digest in chunks:
+            with open(chunk_path(store, digest), "rb") as f:
+                out.write(f.read())
+    _set_meta(dest, mode, uid, gid, mtime_ns)
+
+def materialize(backup_dir, target_root, store, prefix="/", workers=8):
+    # Rebuild the snapshot (or the part below prefix) as a normal tree under target_root.
+    index = sqlite3.connect(f"file:{index_path(backup_dir)}?mode=ro", uri=True)
+    prefix = prefix.rstrip("/")
+    # "0" sorts right after "/": exactly the paths below prefix, unlike LIKE (case, "_" and "%").
+    rows = index.execute("SELECT * FROM entries WHERE path = ? OR (path >= ? AND path < ?) ORDER BY path",
+                         (prefix or "/", prefix + "/", prefix + "0")).fetchall()
+    linked = {}
+    links = []
+    dirs = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for path, mode, uid, gid, size, mtime_ns, ino, nlink, link_target in rows:
+            dest = os.path.join(target_root, path.lstrip("/"))
+            if stat.S_ISDIR(mode):
+                os.makedirs(dest, exist_ok=True)
+                dirs.append((dest, mode, uid, gid, mtime_ns))
+                continue
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if stat.S_ISLNK(mode):
+                os.symlink(link_target, dest)
+                os.lchown(dest, uid, gid)
+                continue
+            if stat.S_ISFIFO(mode):
+                os.mkfifo(dest)
+                _set_meta(dest, mode, uid, gid, mtime_ns)
+            elif stat.S_ISREG(mode):
+                if nlink > 1 and ino in linked:
+                    # The first link may still be queued in the pool, link once it's written.
+                    links.append((linked[ino], dest))
+                    continue
+                linked[ino] = dest
+                chunks = [r[0] for r in index.execute("SELECT hash FROM file_chunks WHERE path = ? ORDER BY seq", (path,))]
+                futures.append(pool.submit(_write_file, store, dest, chunks, mode, uid, gid, mtime_ns))
+            # Devices and sockets are not backed up.
+        for future in futures:
+            future.result()
+    for source, dest in links:
+        os.link(source, dest)
+    # Dirs last and deepest first, so writing their contents doesn't bump the restored mtimes.
+    for dest, mode, uid, gid, mtime_ns in sorted(dirs, reverse=True):
+        _set_meta(dest, mode, uid, gid, mtime_ns)
+    index.close()
+    return len(rows)
+
+def _set_meta(dest, mode, uid, gid, mtime_ns):
+    os.chown(dest, uid, gid)
+    os.chmod(dest, stat.S_IMODE(mode))
+    os.utime(dest, ns=(mtime_ns, mtime_ns))
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplicated snapshot store for backup_host.py")
+    parser.add_argument("--base", default=snapshots.DEFAULT_BACKUP_BASE, help="Backup base directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    mat = commands.add_parser("materialize", help="Rebuild a snapshot tree from its chunk index")
+    mat.add_argument("snapshot")
+    mat.add_argument("target")
+    mat.add_argument("--prefix", default="/", help="Only rebuild this path and below")
+    gc_cmd = commands.add_parser("gc", help="Delete chunks no snapshot references")
+    gc_cmd.add_argument("--dry-run", action="store_true")
+    commands.add_parser("stats", help="Chunk count, stored and referenced bytes")
+    args = parser.parse_args()
+
+    store = store_dir(args.base)
+    if args.command == "materialize":
+        if not has_index(args.snapshot):
+            sys.exit(f"{args.snapshot} has no chunk index")
+        count = materialize(args.snapshot, args.target, store, args.prefix)
+        print(f"Materialized {count} entries into {args.target}")
+    elif args.command == "gc":
+        chunks, size = gc(store, args.dry_run)
+        print(f"{'Would free' if args.dry_run else 'Freed'} {chunks} chunks, {size} bytes")
+    elif args.command == "stats":
+        conn = open_store(store)
+        chunks, stored, refs = conn.execute("SELECT COUNT(*), TOTAL(size), TOTAL(refs) FROM chunks").fetchone()
+        print(f"{chunks} chunks, {int(stored)} bytes stored, {int(refs)} snapshot references")
+
+if __name__ == "__main__":
+    main()
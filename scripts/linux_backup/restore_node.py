@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# Restore a snapshot, or part of it, into any target root.
+#
+# The dry run's item list is the only walk of the snapshot: after confirming, exactly the items it
+# reported are fed to rsync --files-from, split into groups that run in parallel.
+#
+# Usage:
+#   sudo restore_node.py                                          Interactive host/snapshot picker, restore to /
+#   sudo restore_node.py --host hostname --snapshot hostname-W30-2025 --include /etc --include '/home/*/.ssh'
+#   sudo restore_node.py ... --target /mnt/newroot --workers 8 --yes
+import argparse, concurrent.futures, os, sys, tempfile, threading, time
+
+import archive, dedup_store, executor, rsync_output, snapshots
+
+GLOB_CHARS = "*?["
+STATUS_SECONDS = 0.5
+# rsync runs through the shared executor (../executor.py). main() sizes it to --workers.
+EXECUTOR = executor.Executor()
+
+# === PICKER ===
+
+def pick(prompt, options):
+    for i, option in enumerate(options, 1):
+        print(f"  {i}) {option}")
+    choice = input(prompt).strip()
+    if not choice.isdigit() or not 1 <= int(choice) <= len(options):
+        sys.exit("Invalid selection.")
+    return options[int(choice) - 1]
+
+def confirm(prompt, assume_yes):
+    if assume_yes:
+        return True
+    return input(f"{prompt} (yes/no): ").strip() == "yes"
+
+# === RSYNC ===
+
+def include_args(includes):
+    # Returns (prefixes, filters). Plain path prefixes become rsync -R sources, so only those subtrees
+    # are walked. Once there is a glob every include becomes a filter rule over the whole snapshot.
+    if not any(c in i for i in includes for c in GLOB_CHARS):
+        return includes, []
+    filters = ["--prune-empty-dirs", "--include=*/"]
+    for pattern in includes:
+        filters += [f"--include={pattern}", f"--include={pattern.rstrip('/')}/**"]
+    filters.append("--exclude=*")
+    return [], filters
+
+def outermost(prefixes):
+    # Drops prefixes inside another one, Ex: /etc/ssh when /etc is restored too.
+    kept = []
+    for prefix in sorted(p.rstrip("/") or "/" for p in prefixes):
+        if not any(prefix == k or prefix.startswith(k.rstrip("/") + "/") for k in kept):
+            kept.append(prefix)
+    return kept
+
+def dry_run(source, target, includes):
+    # Returns [item events] rsync would transfer. Nothing is written.
+    prefixes, filters = include_args(includes)
+    sources = [f"{source}/./{p.strip('/')}" for p in prefixes] or [f"{source}/"]
+    rsync_cmd = (["rsync", "-aAXn", "--relative", "--no-xattrs", f"--out-format={rsync_output.RSYNC_OUT_FORMAT}"]
+                 + filters + sources + [target])
+    if not prefixes:
+        rsync_cmd.remove("--relative")
+    process = EXECUTOR.stream(rsync_cmd)
+    items = []
+    for event in rsync_output.parse_rsync_output(process):
+        if event["event"] == "item":
+            items.append(event)
+        elif event["event"] == "error":
+            print(event["line"], file=sys.stderr)
+    if process.result.returncode not in (0, 23, 24):
+        sys.exit(f"Dry run failed with exit code {process.result.returncode}")
+    return items
+
+def split_items(items, workers, depth=2):
+    # Group files by their first `depth` path components and spread the groups over the workers,
+    # biggest first, so one huge subtree doesn't end up behind lots of small ones.
+    groups = {}
+    for item in items:
+        key = "/".join(item["path"].split("/")[:depth])
+        size, paths = groups.setdefault(key, [0, []])
+        groups[key][0] = size + item["length"]
+        paths.append(item["path"])
+    buckets = [[0, []] for _ in range(max(workers, 1))]
+    for size, paths in sorted(groups.values(), key=lambda g: g[0], reverse=True):
+        bucket = min(buckets, key=lambda b: b[0])
+        bucket[0] += size
+        bucket[1].extend(paths)
+    return [paths for _, paths in buckets if paths]
+
+class Progress:
+    # Restored files/bytes summed over every worker, printed at most every STATUS_SECONDS.
+    def __init__(self, total_files, total_bytes):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = self.bytes = 0
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def add(self, length):
+        with self.lock:
+            self.files += 1
+            self.bytes += length
+
+    def line(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.bytes / 1024**2 / elapsed if elapsed else 0
+        return (f"Restored {self.files}/{self.total_files} items, "
+                f"{self.bytes / 1024**2:.1f}/{self.total_bytes / 1024**2:.1f} MiB, {rate:.1f} MB/s")
+
+def run_group(source, target, paths, progress, extra_args=()):
+    with tempfile.NamedTemporaryFile("w", prefix="restore_", suffix=".txt") as files_from:
+        files_from.write("".join(p + "\n" for p in paths))
+        files_from.flush()
+        rsync_cmd = ["rsync", "-aAX", "--no-xattrs", f"--files-from={files_from.name}",
+                     f"--out-format={rsync_output.RSYNC_OUT_FORMAT}", *extra_args, f"{source}/", target]
+        process = EXECUTOR.stream(rsync_cmd)
+        for event in rsync_output.parse_rsync_output(process):
+            if event["event"] == "item":
+                progress.add(event["length"])
+            elif event["event"] == "error":
+                print(f"\n{event['line']}", file=sys.stderr)
+        # The --files-from file must outlive rsync.
+        returncode = process.result.returncode
+    return returncode
+
+def restore(source, target, items, workers):
+    # Parent dirs are created up front so parallel rsyncs never race on mkdir. Directory items
+    # go last, in one rsync, so their owners, modes and mtimes are not bumped by files landing in them.
+    files = [i for i in items if i["itemize"][1:2] != "d"]
+    dirs = [i["path"] for i in items if i["itemize"][1:2] == "d"]
+    for parent in {os.path.dirname(i["path"].rstrip("/")) for i in files}:
+        os.makedirs(os.path.join(target, parent), exist_ok=True)
+
+    progress = Progress(len(items), sum(i["length"] for i in files))
+    tty = sys.stdout.isatty()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_group, source, target, paths, progress) for paths in split_items(files, workers)]
+        while True:
+            done, not_done = concurrent.futures.wait(futures, timeout=STATUS_SECONDS)
+            if tty:
+                print(f"\r\033[K{progress.line()}", end="", flush=True)
+            if not not_done:
+                break
+    codes = [f.result() for f in futures]
+    if dirs:
+        codes.append(run_group(source, target, dirs, progress))
+    print(f"\r\033[K{progress.line()}" if tty else progress.line())
+    return max(codes, default=0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Restore a snapshot made by backup_host.py")
+    parser.add_argument("--base", default=snapshots.DEFAULT_BACKUP_BASE, help="Backup base directory")
+    parser.add_argument("--host", help="Host to restore from, asked for when missing")
+    parser.add_argument("--snapshot", help="Snapshot name, Ex: hostname-W30-2025, asked for when missing")
+    parser.add_argument("--include", action="append", default=[],
+                        help="Path prefix or glob to restore, repeatable. Default: everything")
+    parser.add_argument("--target", default="/", help="Root to restore into (default /)")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel rsync processes")
+    parser.add_argument("--list", action="store_true", help="Print every item of the dry run")
+    parser.add_argument("--yes", action="store_true", help="Don't ask for confirmation")
+    args = parser.parse_args()
+    # Before the first command, the executor reads its limit once. +1 for the directory pass.
+    EXECUTOR.limit = max(args.workers, 1) + 1
+
+    if os.geteuid() != 0:
+        sys.exit("Please run this script as root (using sudo).")
+    if not os.path.isdir(args.base):
+        sys.exit(f"Backup root directory {args.base} does not exist.")
+
+    host = args.host
+    if not host:
+        hosts = [os.path.basename(h) for h in snapshots.list_hosts(args.base)]
+        if not hosts:
+            sys.exit(f"No hosts found in {args.base}")
+        print("Available hosts:")
+        host = pick("Select a host by number: ", hosts)
+    host_dir = os.path.join(args.base, host)
+
+    snapshot = args.snapshot
+    if not snapshot:
+        backups = [os.path.basename(b) for b in snapshots.list_snapshots(host_dir, packed=True)]
+        if not backups:
+            sys.exit(f"No backups found for host {host}")
+        print(f"Available backups for host {host}:")
+        snapshot = pick("Select a backup by number: ", backups)
+    backup_dir = os.path.join(host_dir, snapshot)
+
+    print()
+    print("You are about to restore backup:")
+    print(f"  Host: {host}")
+    print(f"  Backup: {snapshot}")
+    print(f"  Directory: {backup_dir}")
+    print(f"  Paths: {', '.join(args.include) if args.include else 'everything'}")
+    print(f"  Target: {args.target}")
+    print("This will overwrite files in the target.")
+    if not confirm("Are you sure you want to proceed with a dry-run?", args.yes):
+        sys.exit("Restore aborted.")
+
+    staging = None
+    source = backup_dir
+    if dedup_store.has_index(backup_dir):
+        # Dedup snapshots only hold a chunk index, rebuild the requested part into a staging dir first.
+        staging = tempfile.TemporaryDirectory(prefix=".restore-", dir=args.base)
+        prefixes, _ = include_args(args.include)
+        print(f"Materializing dedup snapshot into {staging.name}...")
+        for prefix in outermost(prefixes or ["/"]):
+            dedup_store.materialize(backup_dir, staging.name, dedup_store.store_dir(args.base), prefix)
+        source = staging.name
+    elif not os.path.isdir(backup_dir) and snapshots.is_packed(backup_dir):
+        # Packed snapshots (archive.py): only the frames holding the requested paths are decompressed.
+        staging = tempfile.TemporaryDirectory(prefix=".restore-", dir=args.base)
+        prefixes, _ = include_args(args.include)
+        print(f"Extracting packed snapshot into {staging.name}...")
+        for prefix in outermost(prefixes or ["/"]):
+            archive.extract(backup_dir, staging.name, prefix)
+        source = staging.name
+
+    try:
+        print("\nRunning dry-run to preview restore...")
+        items = dry_run(source, args.target, args.include)
+        total = sum(i["length"] for i in items if i["itemize"][1:2] != "d")
+        if args.list:
+            for item in items:
+                print(f"{item['itemize']} /{item['path']}")
+        print(f"Dry-run complete: {len(items)} items, {total / 1024**2:.1f} MiB to restore.")
+        if not items:
+            print("Nothing to restore.")
+            return
+        if not confirm("Proceed with actual restore?", args.yes):
+            sys.exit("Restore aborted.")
+
+        print("\nStarting restore...")
+        returncode = restore(source, args.target, items, args.workers)
+    finally:
+        if staging:
+            staging.cleanup()
+    if returncode == 0:
+        print("Restore completed.")
+    else:
+        sys.exit(f"Restore finished with errors. Exit code: {returncode}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# Retention engine for the hostname-Wnn-yyyy weekly snapshots.
+#
+# Tiered policy, a snapshot is kept if any tier wants it:
+#   weekly  - every snapshot younger than retention_days, or the newest N snapshots if weekly=N is set
+#   monthly - the newest snapshot of each of the last M months that have one
+#   yearly  - the newest snapshot of each of the last Y years that have one
+# The newest snapshot is never purged.
+#
+# Expired trees are deleted by a parallel scandir based remover. Reclaimed bytes are counted per
+# inode, a file only frees space when every one of its hard links is inside the purged snapshots.
+# Snapshots packed by archive.py count like trees, expiring one deletes its pack and index.
+#
+# Usage:
+#   retention.py hostname --days 180 --monthly 12 --yearly 5 --dry-run
+import argparse, concurrent.futures, datetime, os
+
+import dedup_store, snapshots, snapshot_manifest
+
+DEFAULT_WORKERS = 8
+
+def select_expired(snapshot_dirs, today, retention_days, weekly=0, monthly=0, yearly=0):
+    # Returns (kept, expired), kept is {snapshot dir: [reasons]}, expired is a list of dirs oldest first.
+    dated = sorted(((snapshots.snapshot_date(os.path.basename(d)), d) for d in snapshot_dirs), reverse=True)
+    kept = {}
+    if dated:
+        kept.setdefault(dated[0][1], []).append("newest")
+
+    for i, (date, backup_dir) in enumerate(dated):
+        if (weekly and i < weekly) or (not weekly and (today - date).days <= retention_days):
+            kept.setdefault(backup_dir, []).append("weekly")
+
+    for tier, count, bucket in (("monthly", monthly, lambda d: (d.year, d.month)),
+                                ("yearly", yearly, lambda d: d.year)):
+        seen = set()
+        for date, backup_dir in dated:
+            if len(seen) >= count:
+                break
+            if bucket(date) not in seen:
+                seen.add(bucket(date))
+                kept.setdefault(backup_dir, []).append(tier)
+
+    expired = [backup_dir for _, backup_dir in reversed(dated) if backup_dir not in kept]
+    return kept, expired
+
+def _scan_dir(path, delete):
+    # One directory level: lstat + (optionally) unlink its files, return its subdirectories.
+    files = []
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+                continue
+            st = entry.stat(follow_symlinks=False)
+            files.append((st.st_dev, st.st_ino, st.st_nlink, st.st_blocks * 512))
+            if delete:
+                os.unlink(entry.path)
+    return path, files, subdirs
+
+def scan_trees(roots, workers=DEFAULT_WORKERS, delete=False):
+    # Walks (and deletes) all trees with a pool of workers, one task per directory. No task waits on
+    # another, the main thread hands out subdirectories as their parents finish.
+    # Returns (files, dirs, reclaimable bytes).
+    inodes = {}
+    dirs = []
+    files = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_scan_dir, root, delete) for root in roots}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                path, entries, subdirs = future.result()
+                dirs.append(path)
+                files += len(entries)
+                for dev, ino, nlink, size in entries:
+                    seen = inodes.get((dev, ino))
+                    # Our own unlinks lower nlink for later stats of the same inode, keep the largest.
+                    inodes[(dev, ino)] = (max(nlink, seen[0]) if seen else nlink, size, (seen[2] if seen else 0) + 1)
+                pending.update(pool.submit(_scan_dir, subdir, delete) for subdir in subdirs)
+
+    if delete:
+        # Children always sort after their parent, so reverse order removes the deepest dirs first.
+        for path in sorted(dirs, reverse=True):
+            os.rmdir(path)
+
+    # An inode only frees space once every hard link to it is gone. When deleting, every unlink comes
+    # after its own stat, so the first (largest) nlink seen is the count from before this run.
+    reclaimed = sum(size for nlink, size, seen in inodes.values() if seen >= nlink)
+    return files, len(dirs), reclaimed
+
+def purge(host_dir, today, retention_days, weekly=0, monthly=0, yearly=0, dry_run=False, workers=DEFAULT_WORKERS):
+    # Apply the policy to one host directory. Returns (kept, expired, files, bytes reclaimed).
+    kept, expired = select_expired(snapshots.list_snapshots(host_dir, packed=True), today, retention_days,
+                                   weekly, monthly, yearly)
+    if not expired:
+        return kept, expired, 0, 0
+    packs = [backup_dir for backup_dir in expired if snapshots.is_packed(backup_dir)]
+    trees = [backup_dir for backup_dir in expired if os.path.isdir(backup_dir)]
+    if not dry_run:
+        # Dedup snapshots give their chunk references back first, the store GC frees the chunks later.
+        store = dedup_store.store_dir(os.path.dirname(host_dir))
+        for backup_dir in expired:
+            dedup_store.release(backup_dir, store)
+    # All expired snapshots are scanned together so links shared between two of them count as freed.
+    files, _, reclaimed = scan_trees(trees, workers, delete=not dry_run)
+    for backup_dir in packs:
+        for path in (backup_dir + snapshots.PACK_SUFFIX, backup_dir + snapshots.PACK_SUFFIX + ".idx"):
+            files += 1
+            reclaimed += os.stat(path).st_blocks * 512
+            if not dry_run:
+                os.remove(path)
+    if not dry_run:
+        for backup_dir in expired:
+            manifest = snapshot_manifest.manifest_path(backup_dir)
+            if os.path.exists(manifest):
+                os.remove(manifest)
+    return kept, expired, files, reclaimed
+
+def main():
+    parser = argparse.ArgumentParser(description="Purge weekly snapshots with a tiered retention policy")
+    parser.add_argument("host", help="Host directory name under --base")
+    parser.add_argument("--base", default=snapshots.DEFAULT_BACKUP_BASE, help="Backup base directory")
+    parser.add_argument("--days", type=int, default=30*6, help="Keep every snapshot younger than this")
+    parser.add_argument("--weekly", type=int, default=0, help="Keep the newest N snapshots instead of --days")
+    parser.add_argument("--monthly", type=int, default=0, help="Keep the newest snapshot of the last M months")
+    parser.add_argument("--yearly", type=int, default=0, help="Keep the newest snapshot of the last Y years")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be purged")
+    args = parser.parse_args()
+
+    kept, expired, files, reclaimed = purge(os.path.join(args.base, args.host), datetime.date.today(), args.days,
+                                            args.weekly, args.monthly, args.yearly, args.dry_run, args.workers)
+    for backup_dir, reasons in sorted(kept.items()):
+        print(f"keep   {os.path.basename(backup_dir)} ({', '.join(reasons)})")
+    for backup_dir in expired:
+        print(f"{'expire' if args.dry_run else 'purged'} {os.path.basename(backup_dir)}")
+    verb = "Would reclaim" if args.dry_run else "Reclaimed"
+    print(f"{verb} {reclaimed / 1024**3:.2f} GiB from {files} files in {len(expired)} snapshots")
+
+if __name__ == "__main__":
+    main()
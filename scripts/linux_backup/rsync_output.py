@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# Streaming parser for rsync output. Lines are classified by rsync's own output
+# grammar only, no filesystem calls, so parsing never slows rsync down through the pipe.
+import re, sys, time
+
+# Every transferred/changed item is printed as ITEM|<itemize changes>|<length>|<mtime>|<permissions>|<path>
+# Ex: ITEM|>f.st......|4096|2025/07/26-03:26:00|rw-r--r--|etc/hosts
+# Only the path can contain "|", it is last so splitting from the left is safe.
+RSYNC_OUT_FORMAT = "ITEM|%i|%l|%M|%B|%n"
+ITEM_PREFIX = "ITEM|"
+
+# --info=progress2 line. Ex:
+#   35,243,536   0%  223.03kB/s    0:02:34 (xfr#80, ir-chk=1002/82824)
+PROGRESS_RE = re.compile(
+    r"^\s*([\d,]+)\s+(\d+)%\s+([\d.]+)([kMGT]?B)/s\s+(\d+:\d\d:\d\d)"
+    r"(?:\s+\(xfr#(\d+), (?:ir|to)-chk=(\d+)/(\d+)\))?"
+)
+RATE_UNITS = {"B": 1, "kB": 1024, "MB": 1024**2, "GB": 1024**3, "TB": 1024**4}
+
+# --stats block keys, the values are left for the caller to parse.
+STATS_PREFIXES = (
+    "Number of ", "Total file size", "Total transferred file size", "Literal data",
+    "Matched data", "File list ", "Total bytes ",
+)
+# End of run summary lines we don't need for anything.
+SUMMARY_PREFIXES = ("sent ", "total size is ", "sending incremental file list", "receiving incremental file list")
+ERROR_PREFIXES = ("rsync:", "rsync error:", "rsync warning:", "file has vanished:")
+
+def to_int(number):
+    return int(number.replace(",", ""))
+
+def parse_line(line):
+    # Turn one line of rsync output into an event dict, or None for noise.
+    line = line.rstrip("\r\n")
+    if not line.strip():
+        return None
+    if line.startswith(ITEM_PREFIX):
+        _, itemize, length, mtime, perms, path = line.split("|", 5)
+        return {"event": "item", "itemize": itemize, "length": int(length or 0),
+                "mtime": mtime, "perms": perms, "path": path}
+    progress = PROGRESS_RE.match(line)
+    if progress:
+        size, percent, rate, unit, eta, xfr, to_check, total = progress.groups()
+        return {
+            "event": "progress",
+            "bytes": to_int(size),
+            "percent": int(percent),
+            "rate": float(rate) * RATE_UNITS[unit],
+            "eta": eta,
+            "files": int(xfr) if xfr else 0,
+            "to_check": int(to_check) if to_check else 0,
+            "total_files": int(total) if total else 0,
+        }
+    if line.startswith(ERROR_PREFIXES):
+        return {"event": "error", "line": line}
+    if line.startswith(STATS_PREFIXES):
+        return {"event": "stats", "line": line}
+    if line.startswith(SUMMARY_PREFIXES):
+        return None
+    # Anything else is not part of the grammar we asked rsync for, treat it like an error message.
+    return {"event": "error", "line": line}
+
+def parse_rsync_output(stream):
+    # Generator of events for every line rsync writes. progress2 redraws with \r,
+    # text mode pipes already split those into separate lines for us.
+    for line in stream:
+        event = parse_line(line)
+        if event:
+            yield event
+
+class ProgressDisplay:
+    # Reserved 3 line console status area, redrawn at most once every `interval` seconds.
+    # Turns itself off when stdout is not a TTY (cron), nothing is printed per line then.
+    NUM_LINES = 3
+
+    def __init__(self, interval=0.25, stream=sys.stdout, enabled=None):
+        self.interval = interval
+        self.stream = stream
+        self.enabled = stream.isatty() if enabled is None else enabled
+        self.last_draw = 0.0
+        self.progress_line = ""
+        self.path_line = ""
+        self.status_line = ""
+        if self.enabled:
+            # Static header for progress line, then reserve lines for the console
+            self.stream.write("Transferred(b)   Percent   Speed        ETA       Transfer Info\n")
+            self.stream.write("\n" * self.NUM_LINES)
+
+    def update(self, event):
+        if not self.enabled:
+            return
+        kind = event["event"]
+        if kind == "progress":
+            self.progress_line = (f"{event['bytes']:,}  {event['percent']}%  {event['rate'] / 1024**2:.2f}MB/s  "
+                                  f"{event['eta']}  (xfr#{event['files']}, to-chk={event['to_check']}/{event['total_files']})")
+        elif kind == "item":
+            self.path_line = "/" + event["path"]
+        elif kind == "error":
+            self.status_line = event["line"]
+        now = time.monotonic()
+        if now - self.last_draw >= self.interval:
+            self.draw()
+            self.last_draw = now
+
+    def draw(self):
+        # Move cursor up NUM_LINES, then clear + rewrite each line. !!MUST MATCH NUM_LINES!!
+        self.stream.write(f"\033[{self.NUM_LINES}F")
+        self.stream.write("\033[K" + "Last Status Msg: " + self.status_line + "\n")
+        self.stream.write("\033[K" + "Status: " + self.progress_line + "\n")
+        self.stream.write("\033[K" + "Last File: " + self.path_line + "\n")
+        self.stream.flush()
+
+    def finish(self):
+        # Always show the final state, even if the last update was throttled.
+        if self.enabled:
+            self.draw()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# Bit-rot scrub for the snapshots under BACKUP_BASE.
+#
+# Every regular file is hashed with a thread pool using large sequential (mmap) reads. Checksums are
+# kept per inode in BACKUP_BASE/.scrub.db, so a file hard-linked into many weekly snapshots is read
+# once. The first time an inode is seen its hash becomes the baseline. Later passes re-read it once
+# the last verification is older than --verify-days and compare it against:
+#   - the baseline hash in .scrub.db
+#   - the hash recorded in the snapshot manifest, when backups run with MANIFEST_HASH
+# Dedup store chunks are verified against their file name, which is their hash. They are recorded per
+# inode like snapshot files, so --verify-days, --max-minutes and resuming work the same way.
+#
+# Progress is committed as it goes and finished snapshots are remembered, so the scrub can be run in
+# bounded nightly windows (--max-minutes) and picks up where it stopped.
+#
+# Usage:
+#   scrub.py [--host hostname] [--max-minutes 120] [--workers 4] [--verify-days 30] [--chunks]
+import argparse, concurrent.futures, hashlib, mmap, os, sqlite3, stat, sys, time
+
+import dedup_store, snapshots, snapshot_manifest
+
+DB_NAME = ".scrub.db"
+READ_SIZE = 8 * 1024 * 1024
+COMMIT_SECONDS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inodes (
+    dev   INTEGER NOT NULL,
+    ino   INTEGER NOT NULL,
+    size  INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash  TEXT NOT NULL,
+    verified_at INTEGER NOT NULL,
+    PRIMARY KEY (dev, ino)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS finished (snapshot TEXT PRIMARY KEY, finished_at INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS mismatches (path TEXT, expected TEXT, actual TEXT, source TEXT, found_at INTEGER);
+"""
+
+def hash_path(path, digest_size=20):
+    # blake2b like the manifest. mmap gives one big sequential read and hashlib drops the GIL while
+    # hashing it, so several threads keep the disks busy.
+    digest = hashlib.blake2b(digest_size=digest_size)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return digest.hexdigest(), 0
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(mapped)
+                for offset in range(0, size, READ_SIZE):
+                    digest.update(view[offset:offset + READ_SIZE])
+                view.release()
+        except (OSError, ValueError):
+            # Some filesystems (NFS with certain options, FUSE) refuse mmap, plain reads then.
+            f.seek(0)
+            while block := f.read(READ_SIZE):
+                digest.update(block)
+    return digest.hexdigest(), size
+
+class Scrubber:
+    def __init__(self, backup_base, workers=4, verify_days=30, deadline=None):
+        self.backup_base = backup_base
+        self.workers = workers
+        self.verify_before = int(time.time()) - verify_days * 86400
+        self.deadline = deadline
+        self.db = sqlite3.connect(os.path.join(backup_base, DB_NAME))
+        self.db.executescript(SCHEMA)
+        self.in_flight = {}
+        self.files = self.bytes = self.skipped = self.mismatches = 0
+        self.last_commit = time.monotonic()
+
+    def out_of_time(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def report_mismatch(self, path, expected, actual, source):
+        self.mismatches += 1
+        print(f"[!] MISMATCH ({source}) {path}: expected {expected}, got {actual}")
+        self.db.execute("INSERT INTO mismatches VALUES (?, ?, ?, ?, ?)", (path, expected, actual, source, int(time.time())))
+
+    def collect(self, done):
+        for future in done:
+            path, st, expected, recorded, source = self.in_flight.pop(future)
+            try:
+                actual, size = future.result()
+            except OSError as e:
+                self.report_mismatch(path, "readable", str(e), "read")
+                continue
+            self.files += 1
+            self.bytes += size
+            if expected and expected != actual:
+                self.report_mismatch(path, expected, actual, "baseline")
+            if recorded and recorded != actual:
+                self.report_mismatch(path, recorded, actual, source)
+            # A mismatch keeps its old baseline so it is reported again until someone looks at it.
+            baseline = expected if expected and expected != actual else actual
+            self.db.execute("INSERT OR REPLACE INTO inodes VALUES (?, ?, ?, ?, ?, ?)",
+                            (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, baseline, int(time.time())))
+        if time.monotonic() - self.last_commit >= COMMIT_SECONDS:
+            self.db.commit()
+            self.last_commit = time.monotonic()
+
+    def submit(self, pool, path, st, manifest=None, chunk=False):
+        key = (st.st_dev, st.st_ino)
+        row = self.db.execute("SELECT hash, verified_at, size, mtime_ns FROM inodes WHERE dev = ? AND ino = ?",
+                              key).fetchone()
+        if row and (row[2], row[3]) != (st.st_size, st.st_mtime_ns):
+            # Snapshot files are never rewritten in place, so this is a reused inode number of a purged file.
+            row = None
+        if row and row[1] >= self.verify_before:
+            self.skipped += 1
+            return
+        if any(key == (s.st_dev, s.st_ino) for _, s, _, _, _ in self.in_flight.values()):
+            return  # Another link to this inode is being hashed right now.
+        recorded, source, digest_size = None, "manifest", 20
+        if chunk:
+            recorded, source, digest_size = os.path.basename(path), "chunk", 32
+        elif manifest:
+            rel = "/" + os.path.relpath(path, manifest[1])
+            found = manifest[0].execute("SELECT hash FROM files WHERE path = ?", (rel,)).fetchone()
+            recorded = found[0] if found else None
+        self.in_flight[pool.submit(hash_path, path, digest_size)] = (path, st, row[0] if row else None, recorded, source)
+        if len(self.in_flight) >= self.workers * 4:
+            done, _ = concurrent.futures.wait(self.in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            self.collect(done)
+
+    def scrub_snapshot(self, pool, backup_dir):
+        # Returns True when the whole snapshot was covered.
+        manifest = None
+        if os.path.exists(snapshot_manifest.manifest_path(backup_dir)):
+            manifest = (snapshot_manifest.open_manifest(backup_dir), backup_dir)
+        pending = [backup_dir]
+        while pending:
+            if self.out_of_time():
+                return False
+            path = pending.pop()
+            try:
+                with os.scandir(path) as entries:
+                    entries = sorted(entries, key=lambda e: e.name)
+            except OSError as e:
+                self.report_mismatch(path, "readable", str(e), "read")
+                continue
+            for entry in entries:
+                st = entry.stat(follow_symlinks=False)
+                if stat.S_ISDIR(st.st_mode):
+                    pending.append(entry.path)
+                elif stat.S_ISREG(st.st_mode) and entry.name != dedup_store.INDEX_NAME:
+                    self.submit(pool, entry.path, st, manifest)
+        return True
+
+    def run(self, snapshot_dirs):
+        started = time.monotonic()
+        finished = {row[0] for row in self.db.execute("SELECT snapshot FROM finished")}
+        todo = [d for d in snapshot_dirs if d not in finished]
+        if not todo:
+            # Every snapshot got a full pass, start the next cycle.
+            self.db.execute("DELETE FROM finished")
+            todo = snapshot_dirs
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for backup_dir in todo:
+                print(f"[*] Scrubbing {backup_dir}")
+                complete = self.scrub_snapshot(pool, backup_dir)
+                self.collect(concurrent.futures.wait(self.in_flight).done)
+                if not complete:
+                    print("[*] Time window used up, the next run resumes from here.")
+                    break
+                self.db.execute("INSERT OR REPLACE INTO finished VALUES (?, ?)", (backup_dir, int(time.time())))
+        self.db.commit()
+        self.print_summary(time.monotonic() - started)
+
+    def scrub_chunks(self, store):
+        # Chunk files are named after their blake2b-256 hash, that is what they are checked against.
+        started = time.monotonic()
+        chunk_root = os.path.join(store, "chunks")
+        try:
+            prefixes = sorted(os.listdir(chunk_root))
+        except OSError as e:
+            self.report_mismatch(chunk_root, "readable", str(e), "read")
+            prefixes = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for prefix in prefixes:
+                if self.out_of_time():
+                    print("[*] Time window used up, the next run resumes from here.")
+                    break
+                path = os.path.join(chunk_root, prefix)
+                try:
+                    with os.scandir(path) as entries:
+                        entries = sorted(entries, key=lambda e: e.name)
+                    for entry in entries:
+                        if entry.name.endswith(".tmp"):
+                            continue
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                        except FileNotFoundError:
+                            continue  # Collected by the store GC meanwhile.
+                        if stat.S_ISREG(st.st_mode):
+                            self.submit(pool, entry.path, st, chunk=True)
+                except OSError as e:
+                    self.report_mismatch(path, "readable", str(e), "read")
+            self.collect(concurrent.futures.wait(self.in_flight).done)
+        self.db.commit()
+        self.print_summary(time.monotonic() - started)
+
+    def print_summary(self, elapsed):
+        rate = self.bytes / 1024**2 / elapsed if elapsed else 0
+        print(f"[*] Hashed {self.files} files ({self.bytes / 1024**3:.2f} GiB) in {elapsed:.0f}s, {rate:.1f} MB/s. "
+              f"{self.skipped} recently verified, {self.mismatches} mismatches.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify stored snapshots against recorded checksums")
+    parser.add_argument("--base", default=snapshots.DEFAULT_BACKUP_BASE, help="Backup base directory")
+    parser.add_argument("--host", help="Only scrub this host's snapshots")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--verify-days", type=int, default=30, help="Re-read files last verified before this")
+    parser.add_argument("--max-minutes", type=float, help="Stop after this long, the next run resumes")
+    parser.add_argument("--chunks", action="store_true", help="Verify the dedup chunk store instead")
+    args = parser.parse_args()
+
+    deadline = time.monotonic() + args.max_minutes * 60 if args.max_minutes else None
+    scrubber = Scrubber(args.base, args.workers, args.verify_days, deadline)
+    if args.chunks:
+        scrubber.scrub_chunks(dedup_store.store_dir(args.base))
+    else:
+        hosts = [os.path.join(args.base, args.host)] if args.host else snapshots.list_hosts(args.base)
+        scrubber.run([d for host in hosts for d in snapshots.list_snapshots(host)])
+    sys.exit(1 if scrubber.mismatches else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# Per-snapshot file manifest stored as SQLite next to each weekly backup:
+#   /disk01/backups/hostname/hostname-W30-2025            <- snapshot tree
+#   /disk01/backups/hostname/hostname-W30-2025.manifest   <- this index
+# Filled from rsync's item lines while the backup runs, so there is no second walk of the tree.
+#
+# Usage:
+#   snapshot_manifest.py find hostname /etc/hosts          Which snapshots have this file
+#   snapshot_manifest.py diff hostname-W29-2025 hostname-W30-2025 [--prefix /etc]
+#   snapshot_manifest.py du hostname-W30-2025 [/home]      Size rollup of a dir and its children
+import argparse, hashlib, os, queue, shutil, sqlite3, stat, sys, threading, time
+
+import snapshots
+
+MANIFEST_SUFFIX = ".manifest"
+BATCH_SIZE = 5000
+HASH_BLOCK = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE files (
+    path   TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    size   INTEGER NOT NULL,
+    mtime  INTEGER NOT NULL,
+    mode   INTEGER NOT NULL,
+    inode  INTEGER,
+    hash   TEXT,
+    changed INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE dir_sizes (
+    dir    TEXT PRIMARY KEY,
+    parent TEXT,
+    files  INTEGER NOT NULL,
+    bytes  INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+# Built after the bulk load, much cheaper than maintaining them row by row.
+INDEXES = """
+CREATE INDEX files_parent ON files(parent);
+CREATE INDEX files_inode ON files(inode);
+CREATE INDEX dir_sizes_parent ON dir_sizes(parent);
+"""
+
+# Incremental runs start from a copy of the last manifest, derived data is rebuilt at the end.
+DROP_DERIVED = """
+DROP INDEX IF EXISTS files_parent;
+DROP INDEX IF EXISTS files_inode;
+DROP INDEX IF EXISTS dir_sizes_parent;
+DELETE FROM dir_sizes;
+DELETE FROM meta;
+"""
+
+# rsync itemize type character -> file type bits.
+FILE_TYPES = {"f": stat.S_IFREG, "d": stat.S_IFDIR, "L": stat.S_IFLNK, "D": stat.S_IFCHR, "S": stat.S_IFIFO}
+
+def manifest_path(backup_dir):
+    return backup_dir.rstrip(os.sep) + MANIFEST_SUFFIX
+
+def parse_perms(perms):
+    # rsync %B, Ex: rwxr-sr-t -> 0o3755
+    mode = 0
+    for i, char in enumerate(perms[:9]):
+        if char not in "-ST":
+            mode |= 1 << (8 - i)
+    if perms[2:3] in ("s", "S"):
+        mode |= stat.S_ISUID
+    if perms[5:6] in ("s", "S"):
+        mode |= stat.S_ISGID
+    if perms[8:9] in ("t", "T"):
+        mode |= stat.S_ISVTX
+    return mode
+
+def parse_mtime(mtime):
+    # rsync %M, Ex: 2025/07/26-03:26:00 in local time. Sliced by hand, strptime is too slow for millions of rows.
+    return int(time.mktime((int(mtime[0:4]), int(mtime[5:7]), int(mtime[8:10]),
+                            int(mtime[11:13]), int(mtime[14:16]), int(mtime[17:19]), 0, 0, -1)))
+
+def hash_file(path):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ManifestWriter:
+    # Collects rsync item events (from one or many threads) and writes them into a fresh
+    # manifest on a background thread, so the rsync output loop never waits on SQLite.
+    # The manifest is built in a temp file and renamed over the old one on close(). If the writer
+    # thread fails, add() and close() raise its error and the old manifest stays.
+
+    def __init__(self, backup_dir, seed_dir=None, hash_files=False, incremental=False):
+        # incremental=True starts from the snapshot's current manifest and only upserts the items
+        # rsync reports, for runs that did not list the whole tree (rsync --files-from).
+        self.backup_dir = backup_dir
+        self.incremental = incremental
+        self.seed_dir = seed_dir
+        self.hash_files = hash_files
+        self.path = manifest_path(backup_dir)
+        self.tmp_path = self.path + ".tmp"
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.rows = 0
+        self.lock = threading.Lock()
+        self.batch = []
+        self.queue = queue.Queue(maxsize=16)
+        self.error = None
+        self.thread = threading.Thread(target=self._write, name="manifest-writer", daemon=True)
+        self.thread.start()
+
+    def add(self, event):
+        # event is an "item" event from rsync_output.parse_line()
+        with self.lock:
+            self.batch.append(event)
+            if len(self.batch) >= BATCH_SIZE:
+                self._put(self.batch)
+                self.batch = []
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError(f"Manifest writer failed: {self.error}") from self.error
+
+    def _put(self, batch):
+        # A dead writer never empties the queue, wait in steps so its error ends the wait.
+        while True:
+            self._check()
+            try:
+                self.queue.put(batch, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def close(self):
+        with self.lock:
+            if self.batch:
+                self._put(self.batch)
+            self.batch = []
+        self._put(None)
+        self.thread.join()
+        self._check()
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def _row(self, event):
+        itemize = event["itemize"]
+        if itemize.startswith("*"):  # *deleting
+            return None
+        path = "/" + event["path"].rstrip("/")
+        if path == "/.":
+            path = "/"
+        mode = FILE_TYPES.get(itemize[1:2], 0) | parse_perms(event["perms"])
+        changed = itemize[:1] in ("<", ">", "c")
+        inode = digest = None
+        dest = os.path.join(self.backup_dir, path.lstrip("/"))
+        try:
+            inode = os.lstat(dest).st_ino
+            if self.hash_files and changed and stat.S_ISREG(mode):
+                digest = hash_file(dest)
+        except OSError:
+            pass
+
+        return (path, os.path.dirname(path) if path != "/" else "", event["length"],
+                parse_mtime(event["mtime"]), mode, inode, digest, int(changed))
+
+    def _dir_sizes(self, conn):
+        # Per directory rollups from one pass over the table, every file counts towards all of its ancestors.
+        dir_sizes = {}
+        for path, size, mode in conn.execute("SELECT path, size, mode FROM files"):
+            if stat.S_ISDIR(mode):
+                dir_sizes.setdefault(path, [0, 0])
+                continue
+            parent = os.path.dirname(path)
+            while True:
+                totals = dir_sizes.setdefault(parent, [0, 0])
+                totals[0] += 1
+                totals[1] += size
+                if parent == "/":
+                    break
+                parent = os.path.dirname(parent)
+        return [(d, os.path.dirname(d) if d != "/" else None, f, b) for d, (f, b) in dir_sizes.items()]
+
+    def _write(self):
+        try:
+            self._load()
+        except Exception as e:
+            self.error = e
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+    def _load(self):
+        if self.incremental and os.path.exists(self.path):
+            shutil.copyfile(self.path, self.tmp_path)
+            conn = sqlite3.connect(self.tmp_path)
+            conn.executescript(DROP_DERIVED)
+        else:
+            conn = sqlite3.connect(self.tmp_path)
+            conn.executescript(SCHEMA)
+        # Temp file gets renamed into place at the end, no need for crash safety while loading.
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        while (batch := self.queue.get()) is not None:
+            rows = [row for row in map(self._row, batch) if row]
+            conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.rows += len(rows)
+
+        conn.executemany("INSERT INTO dir_sizes VALUES (?, ?, ?, ?)", self._dir_sizes(conn))
+        conn.executescript(INDEXES)
+        # Unchanged files keep the hash recorded by the seed snapshot (or by this snapshot's
+        # previous run) instead of being read again.
+        previous = manifest_path(self.seed_dir) if self.seed_dir else self.path
+        if self.hash_files and os.path.exists(previous):
+            conn.execute("ATTACH DATABASE ? AS seed", (previous,))
+            conn.execute("""UPDATE files SET hash = (SELECT s.hash FROM seed.files s WHERE s.path = files.path
+                            AND s.size = files.size AND s.mtime = files.mtime)
+                            WHERE hash IS NULL AND changed = 0""")
+            conn.commit()
+            conn.execute("DETACH DATABASE seed")
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ("snapshot", os.path.basename(self.backup_dir)),
+            ("seed", self.seed_dir or ""),
+            ("created", str(int(time.time()))),
+            ("files", str(conn.execute("SELECT COUNT(*) FROM files").fetchone()[0])),
+        ])
+        conn.commit()
+        conn.close()
+
+# === QUERIES ===
+
+def open_manifest(backup_dir):
+    # Read-only connection, sqlite3.connect would silently create a missing file otherwise.
+    return sqlite3.connect(f"file:{manifest_path(backup_dir)}?mode=ro", uri=True)
+
+def find_path(host_dir, path):
+    # [(snapshot dir, size, mtime, mode, hash)] for every snapshot that has `path`, oldest first.
+    found = []
+    for backup_dir in snapshots.list_snapshots(host_dir):
+        if not os.path.exists(manifest_path(backup_dir)):
+            continue
+        with open_manifest(backup_dir) as conn:
+            row = conn.execute("SELECT size, mtime, mode, hash FROM files WHERE path = ?", (path,)).fetchone()
+        if row:
+            found.append((backup_dir,) + row)
+    return found
+
+def diff_snapshots(old_dir, new_dir, prefix="/"):
+    # Returns (added, removed, changed) path lists between two snapshots, limited to `prefix`.
+    prefix = prefix.rstrip("/")
+    conn = open_manifest(new_dir)
+    conn.execute("ATTACH DATABASE ? AS old", (f"file:{manifest_path(old_dir)}?mode=ro",))
+    # "0" sorts right after "/": exactly the paths below prefix, unlike LIKE (case, "_" and "%").
+    scope = "(n.path = ? OR (n.path >= ? AND n.path < ?))"
+    bounds = (prefix or "/", prefix + "/", prefix + "0")
+    added = [r[0] for r in conn.execute(
+        f"SELECT n.path FROM files n LEFT JOIN old.files o ON o.path = n.path WHERE o.path IS NULL AND {scope} ORDER BY n.path",
+        bounds)]
+    removed = [r[0] for r in conn.execute(
+        f"SELECT n.path FROM old.files n LEFT JOIN files o ON o.path = n.path WHERE o.path IS NULL AND {scope} ORDER BY n.path",
+        bounds)]
+    changed = [r[0] for r in conn.execute(
+        f"""SELECT n.path FROM files n JOIN old.files o ON o.path = n.path
+            WHERE (n.size != o.size OR n.mtime != o.mtime OR n.mode != o.mode
+                   OR (n.hash IS NOT NULL AND o.hash IS NOT NULL AND n.hash != o.hash)) AND {scope} ORDER BY n.path""",
+        bounds)]
+    conn.close()
+    return added, removed, changed
+
+def dir_usage(backup_dir, directory="/"):
+    # ((dir, files, bytes), [(child dir, files, bytes), ...]) straight from the precomputed rollups.
+    directory = directory.rstrip("/") or "/"
+    with open_manifest(backup_dir) as conn:
+        total = conn.execute("SELECT dir, files, bytes FROM dir_sizes WHERE dir = ?", (directory,)).fetchone()
+        children = conn.execute("SELECT dir, files, bytes FROM dir_sizes WHERE parent = ? ORDER BY bytes DESC",
+                                (directory,)).fetchall()
+    return total, children
+
+# === CLI ===
+
+def resolve_snapshot(name, backup_base):
+    # Accept a snapshot path or just its name, Ex: hostname-W30-2025
+    if os.path.isdir(name):
+        return name.rstrip(os.sep)
+    parsed = snapshots.parse_snapshot_name(name)
+    if not parsed:
+        sys.exit(f"Not a snapshot: {name}")
+    return os.path.join(backup_base, parsed[0], name)
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the per-snapshot manifests written by backup_host.py")
+    parser.add_argument("--base", default=snapshots.DEFAULT_BACKUP_BASE, help="Backup base directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    find = commands.add_parser("find", help="List snapshots that contain a path")
+    find.add_argument("host")
+    find.add_argument("path")
+    diff = commands.add_parser("diff", help="Files added, removed or changed between two snapshots")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    diff.add_argument("--prefix", default="/")
+    du = commands.add_parser("du", help="Size rollup of a directory in a snapshot")
+    du.add_argument("snapshot")
+    du.add_argument("dir", nargs="?", default="/")
+    args = parser.parse_args()
+
+    if args.command == "find":
+        for backup_dir, size, mtime, mode, digest in find_path(os.path.join(args.base, args.host), args.path):
+            print(f"{os.path.basename(backup_dir)}  {stat.filemode(mode)}  {size:>14,}  "
+                  f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime))}  {digest or ''}")
+    elif args.command == "diff":
+        added, removed, changed = diff_snapshots(resolve_snapshot(args.old, args.base),
+                                                 resolve_snapshot(args.new, args.base), args.prefix)
+        for mark, paths in (("+", added), ("-", removed), ("M", changed)):
+            for path in paths:
+                print(f"{mark} {path}")
+        print(f"{len(added)} added, {len(removed)} removed, {len(changed)} changed")
+    elif args.command == "du":
+        total, children = dir_usage(resolve_snapshot(args.snapshot, args.base), args.dir)
+        if not total:
+            sys.exit(f"{args.dir} is not in the manifest")
+        for directory, files, size in children + [total]:
+            print(f"{size:>16,}  {files:>10,}  {directory}")
+
+if __name__ == "__main__":
+    main()
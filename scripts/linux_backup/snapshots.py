@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# Helpers for the BACKUP_BASE/<host>/<host>-Wnn-yyyy snapshot layout, shared by the backup tools.
+import datetime, os, re
+
+DEFAULT_BACKUP_BASE = "/disk01/backups"
+# Ex: hostname-W30-2025, hostnames may contain dashes themselves.
+SNAPSHOT_RE = re.compile(r"^(?P<host>.+)-W(?P<week>\d{1,2})-(?P<year>\d{4})$")
+# A snapshot packed by archive.py is hostname-Wnn-yyyy.pack plus its .pack.idx instead of a tree.
+PACK_SUFFIX = ".pack"
+
+def parse_snapshot_name(name):
+    # Returns (host, year, week) or None when name is not a weekly snapshot.
+    match = SNAPSHOT_RE.match(name)
+    if not match:
+        return None
+    return match.group("host"), int(match.group("year")), int(match.group("week"))
+
+def snapshot_date(name):
+    # Monday of the snapshot's ISO week.
+    _, year, week = parse_snapshot_name(name)
+    return datetime.date.fromisocalendar(year, week, 1)
+
+def list_hosts(backup_base=DEFAULT_BACKUP_BASE):
+    # Dot dirs are not hosts, Ex: the .dedup chunk store.
+    return sorted(entry.path for entry in os.scandir(backup_base)
+                  if entry.is_dir(follow_symlinks=False) and not entry.name.startswith("."))
+
+def is_packed(backup_dir):
+    # The index is written last, a pack without one is unfinished.
+    return os.path.exists(backup_dir + PACK_SUFFIX + ".idx")
+
+def list_snapshots(host_dir, packed=False):
+    # Snapshot directories of one host, oldest first. packed=True adds the snapshots archive.py
+    # packed, by the path their directory had.
+    snapshots = {}
+    for entry in os.scandir(host_dir):
+        if entry.is_dir(follow_symlinks=False):
+            name, path = entry.name, entry.path
+        elif packed and entry.name.endswith(PACK_SUFFIX + ".idx"):
+            name = entry.name[:-len(PACK_SUFFIX + ".idx")]
+            path = os.path.join(host_dir, name)
+        else:
+            continue
+        parsed = parse_snapshot_name(name)
+        if parsed:
+            snapshots[path] = (parsed[1], parsed[2])
+    return sorted(snapshots, key=snapshots.get)
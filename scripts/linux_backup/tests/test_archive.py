@@ -0,0 +1,62 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive
+
+@pytest.fixture
+def packed(tmp_path):
+    tree = tmp_path / "h" / "h-W30-2025"
+    for path in ("etc/ssh", "ETC", "data/a_b", "data/aXb", "data/100%"):
+        (tree / path).mkdir(parents=True)
+    (tree / "etc" / "hosts").write_text("127.0.0.1 localhost\n")
+    (tree / "etc" / "ssh" / "sshd_config").write_text("Port 22\n")
+    os.link(tree / "etc" / "ssh" / "sshd_config", tree / "etc" / "ssh" / "sshd_config.link")
+    os.symlink("sshd_config", tree / "etc" / "ssh" / "current")
+    os.mkfifo(tree / "etc" / "ssh" / "fifo")
+    for path in ("ETC/upper", "data/a_b/f", "data/aXb/f", "data/100%/f"):
+        (tree / path).write_text(path)
+    archive.pack(str(tree))
+    return str(tree)
+
+def paths(pack, prefix):
+    return [row[0] for row in pack.entries(prefix)]
+
+def test_entries_match_the_prefix_literally(packed):
+    pack = archive.Pack(packed)
+    assert paths(pack, "/data/a_b") == ["/data/a_b", "/data/a_b/f"]
+    assert paths(pack, "/data/100%") == ["/data/100%", "/data/100%/f"]
+    assert paths(pack, "/etc/") == ["/etc", "/etc/hosts", "/etc/ssh", "/etc/ssh/current", "/etc/ssh/fifo",
+                                    "/etc/ssh/sshd_config", "/etc/ssh/sshd_config.link"]
+    assert len(paths(pack, "/")) == len(pack.index.execute("SELECT path FROM files").fetchall())
+    pack.close()
+
+def test_overlapping_prefixes_into_one_target(packed, tmp_path):
+    target = tmp_path / "restore"
+    archive.extract(packed, str(target), "/etc")
+    archive.extract(packed, str(target), "/etc/ssh")
+    ssh = target / "etc" / "ssh"
+    assert (ssh / "sshd_config").read_text() == "Port 22\n"
+    assert os.readlink(ssh / "current") == "sshd_config"
+    assert os.stat(ssh / "sshd_config").st_ino == os.stat(ssh / "sshd_config.link").st_ino
+    assert (target / "etc" / "hosts").exists()
+    assert not (target / "ETC").exists()
+
+def test_extract_reads_only_the_frames_of_the_prefix(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "FRAME_SIZE", 4096)
+    tree = tmp_path / "h" / "h-W30-2025"
+    (tree / "data").mkdir(parents=True)
+    for i in range(20):
+        (tree / "data" / f"f{i:02d}").write_bytes(os.urandom(3000))
+    archive.pack(str(tree))
+    pack = archive.Pack(str(tree))
+    total = len(pack.index.execute("SELECT * FROM frames").fetchall())
+    pack.close()
+    assert total > 10
+    target = tmp_path / "restore"
+    entries, frames = archive.extract(str(tree), str(target), "/data/f10")
+    assert entries == 1
+    assert frames in (1, 2)
+    assert (target / "data" / "f10").stat().st_size == 3000
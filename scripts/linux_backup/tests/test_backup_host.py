@@ -0,0 +1,56 @@
+import datetime, os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backup_host
+
+@pytest.mark.parametrize("path, excluded", [
+    ("/home/u/.cache", True),
+    ("/home/u/.cache/pip/x", True),
+    ("/home/u/src/proj/.cache", False),       # * doesn't cross "/"
+    ("/home/u/Downloads", False),             # /home/*/Downloads/* only excludes the contents
+    ("/home/u/Downloads/a/b", True),
+    ("/proc/1/status", True),
+    ("/bin/ls", True),
+    ("/binx", False),
+    ("/etc/hosts", False),
+])
+def test_is_excluded(path, excluded):
+    assert backup_host.is_excluded(path) == excluded
+
+def test_exclude_regex_wildcards():
+    assert backup_host.exclude_regex("/var/**/*.log").match("/var/a/b/c.log")
+    assert not backup_host.exclude_regex("/var/*.log").match("/var/a/c.log")
+    assert backup_host.exclude_regex(".git").match("/srv/repo/.git/config")
+    assert not backup_host.exclude_regex(".git").match("/srv/repo/x.git")
+
+def test_every_run_of_the_week_links_against_the_previous_week(tmp_path, monkeypatch):
+    hostname = os.uname().nodename
+    previous = tmp_path / hostname / f"{hostname}-W29-2025"
+    previous.mkdir(parents=True)
+    commands = []
+    def rsync(cmd, manifest):
+        commands.append(cmd)
+        return 0, {}
+    monkeypatch.setattr(backup_host, "BACKUP_BASE", str(tmp_path))
+    monkeypatch.setattr(backup_host, "BACKUP_BACKEND", "rsync")
+    monkeypatch.setattr(backup_host, "SNAPSHOT_MODE", "link")
+    monkeypatch.setattr(backup_host, "CHANGE_JOURNAL", False)
+    monkeypatch.setattr(backup_host, "MANIFEST", False)
+    monkeypatch.setattr(backup_host, "SHARD_WORKERS", 0)
+    monkeypatch.setattr(backup_host, "run_rsync_console", rsync)
+    for day in (21, 22):
+        backup_host.run_backup(datetime.date(2025, 7, day))
+        (tmp_path / hostname / f"{hostname}-W30-2025").mkdir(exist_ok=True)
+    assert [f"--link-dest={previous}" in cmd for cmd in commands] == [True, True]
+
+def test_sharded_backup_merges_stats_and_is_quiet_without_a_terminal(tmp_path, monkeypatch, capsys):
+    stats = {"/srv": {"files": 10, "file_list_seconds": 2.5}, "/home": {"files": 5, "file_list_seconds": 4.0},
+             "/": {"files": 1, "file_list_seconds": 0.5}}
+    monkeypatch.setattr(backup_host, "find_shards", lambda: ["/srv", "/home"])
+    monkeypatch.setattr(backup_host, "run_rsync_shard", lambda cmd, label, manifest: (0, stats[label]))
+    returncode, merged = backup_host.run_sharded_backup([], str(tmp_path), workers=2)
+    assert (returncode, merged) == (0, {"files": 16, "file_list_seconds": 4.0})
+    assert "Shards done" not in capsys.readouterr().out
@@ -0,0 +1,27 @@
+import io, os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backup_host, change_tracker
+
+def test_watches_follow_rsync_excludes(tmp_path):
+    for path in ("home/u/.cache/pip", "home/u/src/proj/.cache", "proc/1"):
+        (tmp_path / path).mkdir(parents=True)
+    root = str(tmp_path)
+    exclude = lambda path: backup_host.is_excluded(os.path.normpath("/" + os.path.relpath(path, root)))
+    tracker = change_tracker.Tracker(root=root, exclude=exclude, journal_dir=root)
+    assert tracker.watch_tree(root)
+    watched = {"/" + os.path.relpath(path, root) for path in tracker.watches.values()}
+    assert "/home/u/src/proj/.cache" in watched
+    assert "/proc" in watched
+    assert not watched & {"/home/u/.cache", "/home/u/.cache/pip", "/proc/1"}
+
+def test_write_files_from_skips_paths_below_recursed_dirs(tmp_path):
+    for path in ("a/b", "c"):
+        (tmp_path / path).mkdir(parents=True)
+    (tmp_path / "a" / "b" / "f").write_text("x")
+    (tmp_path / "c" / "g").write_text("x")
+    files = [str(tmp_path / "a" / "b" / "f"), str(tmp_path / "c" / "g"), str(tmp_path / "gone")]
+    out = io.StringIO()
+    assert change_tracker.write_files_from(files, [str(tmp_path / "a")], out) == 2
+    assert out.getvalue().splitlines() == [str(tmp_path / "a").lstrip("/"), str(tmp_path / "c" / "g").lstrip("/")]
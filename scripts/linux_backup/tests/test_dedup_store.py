@@ -0,0 +1,70 @@
+import os, random, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dedup_store
+
+REAL_CHUNK_FILE = dedup_store.chunk_file
+
+def unreadable_shadow(store, path):
+    # Runs in the forked process pool, so it has to be importable, not a closure.
+    if path.endswith("shadow"):
+        raise PermissionError(13, "Permission denied", path)
+    return REAL_CHUNK_FILE(store, path)
+
+def test_unreadable_file_is_left_out(tmp_path, monkeypatch, caplog):
+    source = tmp_path / "src"
+    (source / "etc").mkdir(parents=True)
+    (source / "etc" / "hosts").write_bytes(b"127.0.0.1 localhost\n")
+    (source / "etc" / "shadow").write_bytes(b"secret\n")
+    monkeypatch.setattr(dedup_store, "chunk_file", unreadable_shadow)
+    backup_dir = str(tmp_path / "h" / "h-W30-2025")
+    store = str(tmp_path / ".dedup")
+    result = dedup_store.ingest(str(source), backup_dir, store, workers=1)
+    assert (result["files"], result["errors"]) == (2, 1)
+    assert "/etc/shadow" in caplog.text
+
+    target = tmp_path / "restore"
+    dedup_store.materialize(backup_dir, str(target), store)
+    assert (target / "etc" / "hosts").read_bytes() == b"127.0.0.1 localhost\n"
+    assert not (target / "etc" / "shadow").exists()
+
+def test_materialize_prefix_is_literal(tmp_path):
+    source = tmp_path / "src"
+    for path in ("srv/a_b", "srv/aXb", "SRV"):
+        (source / path).mkdir(parents=True)
+        (source / path / "f").write_text(path)
+    backup_dir = str(tmp_path / "h" / "h-W30-2025")
+    store = str(tmp_path / ".dedup")
+    dedup_store.ingest(str(source), backup_dir, store, workers=1)
+    target = tmp_path / "restore"
+    assert dedup_store.materialize(backup_dir, str(target), store, "/srv/a_b") == 2
+    assert (target / "srv" / "a_b" / "f").read_text() == "srv/a_b"
+    assert not (target / "srv" / "aXb").exists()
+    assert not (target / "SRV").exists()
+
+def test_materialize_hard_links(tmp_path):
+    source = tmp_path / "src"
+    (source / "etc").mkdir(parents=True)
+    for i in range(20):
+        (source / "etc" / f"f{i}").write_bytes(os.urandom(64 * 1024))
+        os.link(source / "etc" / f"f{i}", source / "etc" / f"f{i}.link")
+    backup_dir = str(tmp_path / "h" / "h-W30-2025")
+    store = str(tmp_path / ".dedup")
+    dedup_store.ingest(str(source), backup_dir, store, workers=1)
+    target = tmp_path / "restore"
+    dedup_store.materialize(backup_dir, str(target), store)
+    for i in range(20):
+        first, link = target / "etc" / f"f{i}", target / "etc" / f"f{i}.link"
+        assert os.stat(first).st_ino == os.stat(link).st_ino
+        assert first.read_bytes() == (source / "etc" / f"f{i}").read_bytes()
+
+def test_insert_only_changes_nearby_chunks(tmp_path):
+    data = random.Random(1).randbytes(16 * 1024 * 1024)
+    store = str(tmp_path / ".dedup")
+    (tmp_path / "a").write_bytes(data)
+    (tmp_path / "b").write_bytes(data[:8_000_000] + b"inserted" + data[8_000_000:])
+    _, before = dedup_store.chunk_file(store, str(tmp_path / "a"))
+    _, after = dedup_store.chunk_file(store, str(tmp_path / "b"))
+    assert all(dedup_store.MIN_CHUNK <= size <= dedup_store.MAX_CHUNK for _, size in before[:-1])
+    assert len(set(before) - set(after)) <= 2
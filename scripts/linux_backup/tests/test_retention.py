@@ -0,0 +1,38 @@
+import datetime, os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import retention
+
+def make_host(tmp_path):
+    # Three weekly snapshots, shared.bin hard linked into all of them, own.bin only in the oldest two.
+    host_dir = tmp_path / "h"
+    names = ["h-W10-2025", "h-W11-2025", "h-W12-2025"]
+    for name in names:
+        (host_dir / name / "etc").mkdir(parents=True)
+    shared = host_dir / names[0] / "etc" / "shared.bin"
+    shared.write_bytes(b"s" * 65536)
+    own = host_dir / names[0] / "etc" / "own.bin"
+    own.write_bytes(b"o" * 65536)
+    os.link(shared, host_dir / names[1] / "etc" / "shared.bin")
+    os.link(shared, host_dir / names[2] / "etc" / "shared.bin")
+    os.link(own, host_dir / names[1] / "etc" / "own.bin")
+    return str(host_dir), os.stat(own).st_blocks * 512
+
+def test_kept_link_is_not_reclaimed(tmp_path):
+    host_dir, own_bytes = make_host(tmp_path)
+    today = datetime.date(2025, 6, 1)
+    kept, expired, _, dry_bytes = retention.purge(host_dir, today, 30, weekly=1, dry_run=True)
+    assert sorted(os.path.basename(d) for d in expired) == ["h-W10-2025", "h-W11-2025"]
+    assert dry_bytes == own_bytes
+
+    _, _, _, reclaimed = retention.purge(host_dir, today, 30, weekly=1, workers=1)
+    assert reclaimed == dry_bytes
+    assert sorted(os.listdir(host_dir)) == ["h-W12-2025"]
+    assert os.stat(os.path.join(host_dir, "h-W12-2025", "etc", "shared.bin")).st_nlink == 1
+
+def test_dry_run_matches_delete_with_many_workers(tmp_path):
+    host_dir, own_bytes = make_host(tmp_path)
+    today = datetime.date(2025, 6, 1)
+    dry = retention.purge(host_dir, today, 30, weekly=1, dry_run=True, workers=8)[3]
+    assert retention.purge(host_dir, today, 30, weekly=1, workers=8)[3] == dry == own_bytes
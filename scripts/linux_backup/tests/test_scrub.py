@@ -0,0 +1,44 @@
+import hashlib, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dedup_store, scrub
+
+def write_chunk(store, data, digest=None):
+    digest = digest or hashlib.blake2b(data, digest_size=32).hexdigest()
+    path = dedup_store.chunk_path(store, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+def test_chunk_scrub_reports_errors_and_keeps_going(tmp_path):
+    store = str(tmp_path / ".dedup")
+    write_chunk(store, b"good")
+    bad = write_chunk(store, b"rotten", digest="ff" + "0" * 62)
+    # A prefix that can't be listed must not stop the rest.
+    open(os.path.join(store, "chunks", "00"), "w").close()
+    scrubber = scrub.Scrubber(str(tmp_path))
+    scrubber.scrub_chunks(store)
+    assert scrubber.files == 2
+    sources = {row[0]: row[1] for row in scrubber.db.execute("SELECT path, source FROM mismatches")}
+    assert sources == {bad: "chunk", os.path.join(store, "chunks", "00"): "read"}
+
+def test_missing_store_is_reported(tmp_path):
+    scrubber = scrub.Scrubber(str(tmp_path))
+    scrubber.scrub_chunks(str(tmp_path / ".dedup"))
+    assert scrubber.mismatches == 1
+
+def test_chunk_scrub_honours_deadline_and_resumes(tmp_path):
+    store = str(tmp_path / ".dedup")
+    for i in range(3):
+        write_chunk(store, b"chunk %d" % i)
+    stopped = scrub.Scrubber(str(tmp_path), deadline=time.monotonic())
+    stopped.scrub_chunks(store)
+    assert stopped.files == 0
+    first = scrub.Scrubber(str(tmp_path))
+    first.scrub_chunks(store)
+    assert (first.files, first.skipped) == (3, 0)
+    second = scrub.Scrubber(str(tmp_path))
+    second.scrub_chunks(store)
+    assert (second.files, second.skipped) == (0, 3)
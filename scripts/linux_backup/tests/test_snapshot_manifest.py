@@ -0,0 +1,41 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot_manifest
+
+ITEM = {"itemize": ">f+++++++++", "path": "etc/hosts", "perms": "rw-r--r--", "length": 10,
+        "mtime": "2025/07/26-03:26:00"}
+
+def test_writes_manifest(tmp_path):
+    writer = snapshot_manifest.ManifestWriter(str(tmp_path / "h-W30-2025"))
+    for i in range(snapshot_manifest.BATCH_SIZE + 1):
+        writer.add(dict(ITEM, path=f"etc/file{i}"))
+    assert writer.close() == str(tmp_path / "h-W30-2025.manifest")
+    assert writer.rows == snapshot_manifest.BATCH_SIZE + 1
+
+def test_writer_failure_raises_and_keeps_old_manifest(tmp_path):
+    old = tmp_path / "h-W30-2025.manifest"
+    old.write_bytes(b"previous")
+    writer = snapshot_manifest.ManifestWriter(str(tmp_path / "h-W30-2025"))
+    with pytest.raises(RuntimeError):
+        # Far more batches than the queue holds, add() must not block once the writer is dead.
+        for _ in range(snapshot_manifest.BATCH_SIZE * 40):
+            writer.add(dict(ITEM, mtime="not a time"))
+        writer.close()
+    with pytest.raises(RuntimeError):
+        writer.close()
+    assert old.read_bytes() == b"previous"
+    assert not os.path.exists(writer.tmp_path)
+
+def test_diff_prefix_is_literal(tmp_path):
+    for name, paths in (("h-W29-2025", ["srv/a_b/old"]), ("h-W30-2025", ["srv/a_b/new", "srv/aXb/new", "SRV/new"])):
+        writer = snapshot_manifest.ManifestWriter(str(tmp_path / name))
+        for path in paths:
+            writer.add(dict(ITEM, path=path))
+        writer.close()
+    added, removed, changed = snapshot_manifest.diff_snapshots(str(tmp_path / "h-W29-2025"),
+                                                               str(tmp_path / "h-W30-2025"), "/srv/a_b")
+    assert (added, removed, changed) == (["/srv/a_b/new"], ["/srv/a_b/old"], [])
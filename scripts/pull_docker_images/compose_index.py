@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Cached discovery of compose projects for pull_docker_images.py.
+#
+# Every directory seen under the base dir is remembered with its mtime, compose file and subdirectories.
+# A directory's mtime only changes when entries are added, removed or renamed in it, so on later runs
+# an unchanged directory costs one stat() instead of a listing. Data directories are never entered:
+#   - names in PRUNE_DIRS (bind-mounted volumes, VCS dirs)
+#   - anything below a compose project unless NESTED_PROJECTS, those are almost always ./data mounts
+#
+# Index file: {"base": "/home/user/docker", "dirs": {path: {"mtime_ns", "compose", "subdirs"}}}
+import json, os
+
+# Same order compose itself looks for them in.
+COMPOSE_FILENAMES = ("compose.yaml", "compose.yml", "docker-compose.yaml", "docker-compose.yml")
+# Never project names, but often huge. Directories with service names (postgres, ...) may be projects.
+PRUNE_DIRS = {".git", "node_modules", "__pycache__", "lost+found", "data", "volumes"}
+NESTED_PROJECTS = False
+
+def _list_dir(path):
+    # (compose file name or None, [subdir names]) from one directory listing.
+    files = set()
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in PRUNE_DIRS:
+                    subdirs.append(entry.name)
+            else:
+                files.add(entry.name)
+    compose = next((name for name in COMPOSE_FILENAMES if name in files), None)
+    return compose, sorted(subdirs)
+
+class ComposeIndex:
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            data = {}
+        self.base = data.get("base")
+        self.dirs = data.get("dirs", {})
+        self.listed = 0
+
+    def scan(self, base_dir, rescan=False):
+        # Returns the compose file paths under base_dir, sorted. Drops index entries of vanished dirs.
+        base_dir = os.path.abspath(os.path.expanduser(base_dir))
+        if rescan or base_dir != self.base:
+            self.dirs = {}
+        self.base = base_dir
+        seen = {}
+        compose_files = []
+        pending = [base_dir]
+        while pending:
+            path = pending.pop()
+            try:
+                mtime_ns = os.stat(path, follow_symlinks=False).st_mtime_ns
+            except OSError:
+                continue
+            entry = self.dirs.get(path)
+            if not entry or entry["mtime_ns"] != mtime_ns:
+                try:
+                    compose, subdirs = _list_dir(path)
+                except OSError:
+                    continue
+                entry = {"mtime_ns": mtime_ns, "compose": compose, "subdirs": subdirs}
+                self.listed += 1
+            seen[path] = entry
+            if entry["compose"]:
+                compose_files.append(os.path.join(path, entry["compose"]))
+                if not NESTED_PROJECTS and path != base_dir:
+                    continue
+            pending.extend(os.path.join(path, name) for name in entry["subdirs"])
+        self.dirs = seen
+        return sorted(compose_files)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"base": self.base, "dirs": self.dirs}, f)
+        os.replace(self.path + ".tmp", self.path)
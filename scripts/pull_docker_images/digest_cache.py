@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Image reference -> manifest digest cache for pull_docker_images.py.
+#
+# A HEAD request for an image's manifest returns its digest (Docker-Content-Digest) without
+# downloading anything, and Docker Hub does not count it against the pull rate limit. When that digest
+# is the one we already have, `docker pull` is skipped. Digests are remembered with the time they were
+# checked; within the TTL the registry isn't asked at all.
+#
+# Cache file: {"docker.io/library/nginx:latest": {"digest": "sha256:...", "checked": 1753500000}, ...}
+import json, os, threading, time, urllib.error, urllib.parse, urllib.request
+
+# Manifest lists / OCI indexes first, that's the digest `docker pull` records in RepoDigests.
+MANIFEST_TYPES = ", ".join([
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+])
+TIMEOUT = 10
+
+def split_ref(ref):
+    # "docker.io/library/nginx:latest" -> ("docker.io", "library/nginx", "latest"), digests work as the tag.
+    registry, _, rest = ref.partition("/")
+    if "@" in rest:
+        repo, tag = rest.split("@", 1)
+    else:
+        repo, tag = rest.rsplit(":", 1)
+    return registry, repo, tag
+
+def registry_url(registry, insecure=()):
+    host = "registry-1.docker.io" if registry == "docker.io" else registry
+    return f"{'http' if registry in insecure else 'https'}://{host}"
+
+def _bearer_token(challenge):
+    # WWW-Authenticate: Bearer realm="https://auth.docker.io/token",service="registry.docker.io",scope="..."
+    params = dict(part.split("=", 1) for part in challenge[len("Bearer "):].split(","))
+    params = {key.strip(): value.strip('"') for key, value in params.items()}
+    realm = params.pop("realm")
+    with urllib.request.urlopen(f"{realm}?{urllib.parse.urlencode(params)}", timeout=TIMEOUT) as response:
+        body = json.load(response)
+    return body.get("token") or body.get("access_token")
+
+def remote_digest(ref, insecure=()):
+    # Anonymous token only, private registries raise and the caller just pulls.
+    registry, repo, tag = split_ref(ref)
+    url = f"{registry_url(registry, insecure)}/v2/{repo}/manifests/{tag}"
+    headers = {"Accept": MANIFEST_TYPES}
+    for attempt in range(2):
+        try:
+            request = urllib.request.Request(url, method="HEAD", headers=headers)
+            with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+                return response.headers.get("Docker-Content-Digest")
+        except urllib.error.HTTPError as e:
+            challenge = e.headers.get("WWW-Authenticate", "")
+            if e.code != 401 or attempt or not challenge.startswith("Bearer "):
+                raise
+            headers["Authorization"] = f"Bearer {_bearer_token(challenge)}"
+
+class DigestCache:
+    def __init__(self, path, ttl_seconds):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl_seconds
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def digest(self, ref):
+        with self.lock:
+            return self.entries.get(ref, {}).get("digest")
+
+    def fresh(self, ref):
+        # True when ref was checked less than the TTL ago.
+        with self.lock:
+            entry = self.entries.get(ref)
+            return bool(entry) and time.time() - entry["checked"] < self.ttl
+
+    def record(self, ref, digest):
+        with self.lock:
+            self.entries[ref] = {"digest": digest, "checked": int(time.time())}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
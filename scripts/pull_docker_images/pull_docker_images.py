@@ -1,38 +1,303 @@
 #!/usr/bin/env python3
-import subprocess
 from pathlib import Path
-import os
+import argparse, concurrent.futures, json, sys, threading, time
 
-def update_docker_images():
-    # Hard-coded base directory
-    base_dir = Path(os.path.expanduser("~/docker"))
+import compose_index, digest_cache, executor
 
-    # Recursively find all docker-compose.yml files
-    compose_files = list(base_dir.rglob("docker-compose.yml"))
+# === CONFIGURATION ===
+# Compose projects are looked for below BASE_DIR (--base-dir), see compose_index.py for the cached walk.
+BASE_DIR = "~/docker"
+COMPOSE_INDEX = "~/.cache/pull_docker_images/compose_index.json"
+COMPOSE_CMD = ["docker-compose"]
+DOCKER_CMD = "docker"
+# Images are pulled by a pool of PULL_WORKERS threads, with at most REGISTRY_LIMITS[registry]
+# (default DEFAULT_REGISTRY_LIMIT) pulls from the same registry at once. Docker Hub rate limits hard.
+PULL_WORKERS = 6
+DEFAULT_REGISTRY_LIMIT = 3
+REGISTRY_LIMITS = {
+    "docker.io": 2,
+}
+# Known manifest digests, see digest_cache.py. An image whose registry digest still matches is not pulled.
+# Within DIGEST_TTL_HOURS of the last check the registry isn't even asked. 0 always asks.
+DIGEST_CACHE = "~/.cache/pull_docker_images/digests.json"
+DIGEST_TTL_HOURS = 6
+# Registries spoken to over plain http, Ex: a local test registry "localhost:5000".
+INSECURE_REGISTRIES = []
+# After pulling, recreate (docker-compose up -d --no-deps) only the running services whose container
+# was created from an older image than the one now tagged locally. Stopped stacks are left stopped.
+# Up to RECREATE_WORKERS projects at once, each waits up to HEALTH_TIMEOUT seconds for its recreated
+# containers to be running (and healthy, when they have a healthcheck).
+RECREATE = False
+RECREATE_WORKERS = 3
+HEALTH_TIMEOUT = 120
+HEALTH_POLL_SECONDS = 2
+# A docker or compose command still running after COMMAND_TIMEOUT seconds is killed and counts as failed.
+COMMAND_TIMEOUT = 1800
+
+# Every docker/compose command goes through the shared executor (../executor.py): timings, EXECUTOR_TRACE,
+# record/replay. The worker threads above decide what runs, the executor caps it at PULL_WORKERS.
+EXECUTOR = executor.Executor(limit=PULL_WORKERS, timeout=COMMAND_TIMEOUT)
+
+def run(cmd, cwd=None):
+    return EXECUTOR.call(cmd, cwd=cwd)
+
+def normalize_image(image):
+    # "nginx" -> ("docker.io", "docker.io/library/nginx:latest"), so the same image written
+    # differently in two compose files is pulled once.
+    name, digest = image.split("@", 1) if "@" in image else (image, None)
+    first, _, rest = name.partition("/")
+    if rest and ("." in first or ":" in first or first == "localhost"):
+        registry, path = first, rest
+    else:
+        registry, path = "docker.io", name
+        if "/" not in path:
+            path = f"library/{path}"
+    if digest:
+        return registry, f"{registry}/{path}@{digest}"
+    if ":" not in path.rsplit("/", 1)[-1]:
+        path += ":latest"
+    return registry, f"{registry}/{path}"
+
+def project_images(project_dir):
+    # {service: image} of one compose project, resolved by compose itself so .env interpolation, extends
+    # and profiles behave exactly like `docker-compose pull`. Services that are built locally are skipped.
+    result = run(COMPOSE_CMD + ["config", "--format", "json"], cwd=project_dir)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "compose config failed")
+    services = json.loads(result.stdout).get("services", {})
+    return {name: service["image"] for name, service in services.items() if service.get("image") and "build" not in service}
+
+def local_digests(ref):
+    # Manifest digests docker recorded when it pulled ref, Ex: ["sha256:..."].
+    result = run([DOCKER_CMD, "image", "inspect", "--format", "{{json .RepoDigests}}", ref])
+    if result.returncode != 0:
+        return []
+    return [d.split("@", 1)[1] for d in json.loads(result.stdout) or [] if "@" in d]
+
+def image_id(ref):
+    result = run([DOCKER_CMD, "image", "inspect", "--format", "{{.Id}} {{.Size}}", ref])
+    if result.returncode != 0:
+        return None, 0
+    image, size = result.stdout.split()
+    return image, int(size)
+
+class Puller:
+    def __init__(self, workers=PULL_WORKERS, cache=None):
+        self.workers = workers
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.registry_slots = {}
+
+    def slot(self, registry):
+        with self.lock:
+            if registry not in self.registry_slots:
+                self.registry_slots[registry] = threading.Semaphore(REGISTRY_LIMITS.get(registry, DEFAULT_REGISTRY_LIMIT))
+            return self.registry_slots[registry]
+
+    def remote_unchanged(self, ref):
+        # (True, digest) when the registry still serves the digest we have locally. Any lookup error means pull.
+        # The cache only vouches for the registry side, an image removed locally is pulled again.
+        local = local_digests(ref)
+        if self.cache.fresh(ref) and self.cache.digest(ref) in local:
+            return True, self.cache.digest(ref)
+        try:
+            remote = digest_cache.remote_digest(ref, INSECURE_REGISTRIES)
+        except (OSError, ValueError, KeyError):
+            return False, None
+        if remote and remote in local:
+            self.cache.record(ref, remote)
+            return True, remote
+        return False, remote
+
+    def pull(self, registry, ref):
+        # Returns {"ref", "status": updated/unchanged/skipped/failed, "bytes", "seconds", "error"}.
+        with self.slot(registry):
+            started = time.monotonic()
+            remote = None
+            if self.cache:
+                unchanged, remote = self.remote_unchanged(ref)
+                if unchanged:
+                    return {"ref": ref, "status": "skipped", "bytes": 0, "seconds": time.monotonic() - started,
+                            "error": None}
+            before, _ = image_id(ref)
+            result = run([DOCKER_CMD, "pull", "--quiet", ref])
+            seconds = time.monotonic() - started
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+            return {"ref": ref, "status": "failed", "bytes": 0, "seconds": seconds, "error": error}
+        after, size = image_id(ref)
+        changed = after != before
+        if self.cache:
+            digest = remote or next(iter(local_digests(ref)), None)
+            if digest:
+                self.cache.record(ref, digest)
+        return {"ref": ref, "status": "updated" if changed else "unchanged", "bytes": size if changed else 0,
+                "seconds": seconds, "error": None}
+
+    def pull_all(self, images):
+        # images: {ref: registry}. Submitted round-robin across registries, so workers don't all
+        # queue up behind one registry's limit while others are idle.
+        by_registry = {}
+        for ref, registry in sorted(images.items()):
+            by_registry.setdefault(registry, []).append(ref)
+        order = []
+        while any(by_registry.values()):
+            for registry, refs in by_registry.items():
+                if refs:
+                    order.append((registry, refs.pop(0)))
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self.pull, registry, ref) for registry, ref in order]
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                result = future.result()
+                results[result["ref"]] = result
+                print(f"[{done}/{len(futures)}] {result['status']:<9} {result['ref']}")
+        return results
+
+def print_summary(projects, results):
+    print("=" * 60)
+    print(f"{'Image':<60} {'Status':<9} {'MB':>8} {'Time':>7}")
+    for ref in sorted(results):
+        r = results[ref]
+        print(f"{ref:<60} {r['status']:<9} {r['bytes'] / 1024**2:>8.1f} {r['seconds']:>6.1f}s")
+        if r["error"]:
+            print(f"    {r['error']}")
+    print("=" * 60)
+    print(f"{'Project':<40} {'Images':>6} {'Updated':>7} {'Failed':>6} {'MB':>8} {'Time':>7}")
+    for project_dir, refs in sorted(projects.items()):
+        if isinstance(refs, Exception):
+            print(f"{str(project_dir):<40} compose config failed: {refs}")
+            continue
+        rows = [results[ref] for ref in set(refs.values())]
+        updated = sum(r["status"] == "updated" for r in rows)
+        failed = sum(r["status"] == "failed" for r in rows)
+        # Pulls of one project run in parallel, its longest pull is how long it took.
+        seconds = max((r["seconds"] for r in rows), default=0)
+        size = sum(r["bytes"] for r in rows) / 1024**2
+        print(f"{str(project_dir):<40} {len(rows):>6} {updated:>7} {failed:>6} {size:>8.1f} {seconds:>6.1f}s")
+
+# === RECREATE ===
+
+def running_services(project_dir):
+    # {service: image ID its running container was created from}.
+    result = run(COMPOSE_CMD + ["ps", "-q"], cwd=project_dir)
+    ids = result.stdout.split()
+    if result.returncode != 0 or not ids:
+        return {}
+    result = run([DOCKER_CMD, "inspect", "--format",
+                  '{{index .Config.Labels "com.docker.compose.service"}} {{.Image}} {{.State.Running}}', *ids])
+    services = {}
+    for line in result.stdout.splitlines():
+        service, image, running = line.split()
+        if running == "true":
+            services[service] = image
+    return services
+
+def stale_services(project_dir, service_refs, image_ids):
+    # Running services whose image ID differs from what their image ref points at now.
+    return sorted(service for service, image in running_services(project_dir).items()
+                  if service in service_refs and image_ids.get(service_refs[service]) not in (None, image))
+
+def wait_healthy(project_dir, services, timeout=HEALTH_TIMEOUT):
+    # "healthy" once every container of services runs and passes its healthcheck (if it has one),
+    # "unhealthy" as soon as one fails or exits, "timeout" otherwise.
+    deadline = time.monotonic() + timeout
+    while True:
+        ids = run(COMPOSE_CMD + ["ps", "-q", *services], cwd=project_dir).stdout.split()
+        result = run([DOCKER_CMD, "inspect", "--format",
+                      "{{.State.Status}} {{if .State.Health}}{{.State.Health.Status}}{{else}}none{{end}}", *ids])
+        states = [line.split() for line in result.stdout.splitlines() if line.strip()]
+        if ids and all(status == "running" and health in ("healthy", "none") for status, health in states):
+            return "healthy"
+        if any(health == "unhealthy" or status in ("exited", "dead") for status, health in states):
+            return "unhealthy"
+        if time.monotonic() >= deadline:
+            return "timeout"
+        time.sleep(HEALTH_POLL_SECONDS)
+
+def recreate_project(project_dir, services):
+    # Returns {"project", "services", "status": healthy/unhealthy/timeout/failed, "seconds", "error"}.
+    started = time.monotonic()
+    result = run(COMPOSE_CMD + ["up", "-d", "--no-deps", *services], cwd=project_dir)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+        status = "failed"
+    else:
+        error = None
+        status = wait_healthy(project_dir, services)
+    return {"project": project_dir, "services": services, "status": status,
+            "seconds": time.monotonic() - started, "error": error}
+
+def recreate_changed(projects):
+    # Recreate only stale services, RECREATE_WORKERS projects at a time. Returns the recreate results.
+    projects = {d: refs for d, refs in projects.items() if isinstance(refs, dict)}
+    refs = sorted({ref for service_refs in projects.values() for ref in service_refs.values()})
+    with concurrent.futures.ThreadPoolExecutor(max_workers=PULL_WORKERS) as pool:
+        image_ids = dict(zip(refs, (image for image, _ in pool.map(image_id, refs))))
+        stale = dict(zip(projects, pool.map(lambda d: stale_services(d, projects[d], image_ids), projects)))
+    stale = {d: services for d, services in stale.items() if services}
+    if not stale:
+        print("No running containers use an outdated image.")
+        return []
+
+    print("=" * 60)
+    print(f"Recreating {sum(map(len, stale.values()))} services in {len(stale)} projects")
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=RECREATE_WORKERS) as pool:
+        futures = [pool.submit(recreate_project, d, services) for d, services in stale.items()]
+        for future in concurrent.futures.as_completed(futures):
+            r = future.result()
+            results.append(r)
+            print(f"{r['status']:<9} {str(r['project']):<40} {', '.join(r['services'])} ({r['seconds']:.1f}s)")
+            if r["error"]:
+                print(f"    {r['error']}")
+    return results
+
+def update_docker_images(base_dir=BASE_DIR, rescan=False):
+    # Find every compose project, only directories changed since the last run are listed again.
+    index = compose_index.ComposeIndex(COMPOSE_INDEX)
+    compose_files = [Path(f) for f in index.scan(base_dir, rescan)]
+    index.save()
+    print(f"Found {len(compose_files)} compose projects in {base_dir} ({index.listed} directories listed)")
 
     if not compose_files:
-        print("No docker-compose.yml files found in ~/docker.")
+        print(f"No compose files found in {base_dir}.")
         return
 
-    for compose_file in compose_files:
-        dir_path = compose_file.parent
-        print("="*60)
-        print(f"Updating Docker images in: {dir_path}")
-        print("="*60)
-        try:
-            # Pull latest images
-            subprocess.run(
-                ["docker-compose", "pull"],
-                cwd=dir_path,
-                check=True
-            )
-            # Optionally recreate containers
-            # subprocess.run(["docker-compose", "up", "-d"], cwd=dir_path, check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"Failed to update images in {dir_path}: {e}")
+    # Collect every project's images first, an image used by several projects is pulled once.
+    projects = {}
+    images = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=PULL_WORKERS) as pool:
+        futures = {pool.submit(project_images, f.parent): f.parent for f in compose_files}
+        for future in concurrent.futures.as_completed(futures):
+            project_dir = futures[future]
+            try:
+                refs = {service: normalize_image(image) for service, image in future.result().items()}
+            except (RuntimeError, ValueError) as e:
+                projects[project_dir] = e
+                continue
+            projects[project_dir] = {service: ref for service, (_, ref) in refs.items()}
+            images.update({ref: registry for registry, ref in refs.values()})
+
+    print(f"Pulling {len(images)} unique images for {len(projects)} projects")
+    cache = digest_cache.DigestCache(DIGEST_CACHE, DIGEST_TTL_HOURS * 3600)
+    results = Puller(cache=cache).pull_all(images)
+    cache.save()
+    print_summary(projects, results)
 
+    failed = [r for r in results.values() if r["status"] == "failed"]
+    failed += [p for p in projects.values() if isinstance(p, Exception)]
+    if RECREATE:
+        recreated = recreate_changed(projects)
+        failed += [r for r in recreated if r["status"] != "healthy"]
+    if failed:
+        print(f"{len(failed)} images or projects failed to update.")
+        sys.exit(1)
     print("All Docker images updated!")
 
 if __name__ == "__main__":
-    update_docker_images()
-
+    parser = argparse.ArgumentParser(description="Pull updated images for every compose project")
+    parser.add_argument("--base-dir", default=BASE_DIR, help=f"Where to look for compose projects (default {BASE_DIR})")
+    parser.add_argument("--rescan", action="store_true", help="Ignore the discovery index and walk everything")
+    args = parser.parse_args()
+    update_docker_images(args.base_dir, args.rescan)
@@ -0,0 +1,39 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compose_index
+
+def touch_dir(path):
+    # Newer mtime even on file systems with coarse timestamps.
+    mtime_ns = os.stat(path).st_mtime_ns + 10**9
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def test_rescans_only_directories_whose_mtime_changed(tmp_path):
+    base = tmp_path / "docker"
+    for path in ("app/data/db", "group/web", "group/tools/node_modules", "notes"):
+        (base / path).mkdir(parents=True)
+    (base / "app" / "compose.yaml").write_text("")
+    (base / "group" / "web" / "docker-compose.yml").write_text("")
+    index_path = str(tmp_path / "compose_index.json")
+
+    index = compose_index.ComposeIndex(index_path)
+    assert index.scan(str(base)) == [str(base / "app" / "compose.yaml"), str(base / "group" / "web" / "docker-compose.yml")]
+    # base, app, group, group/web, group/tools and notes. Not app/data (project) or node_modules (pruned).
+    assert index.listed == 6
+    index.save()
+
+    index = compose_index.ComposeIndex(index_path)
+    assert len(index.scan(str(base))) == 2
+    assert index.listed == 0
+
+    (base / "group" / "db").mkdir()
+    (base / "group" / "db" / "compose.yml").write_text("")
+    touch_dir(base / "group")
+    assert index.scan(str(base))[1] == str(base / "group" / "db" / "compose.yml")
+    # group and the new group/db.
+    assert index.listed == 2
+
+    index.listed = 0
+    assert len(index.scan(str(base), rescan=True)) == 3
+    assert index.listed == 7
@@ -0,0 +1,186 @@
+import http.server, json, os, sys, threading, time
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import digest_cache, pull_docker_images
+
+@pytest.fixture
+def stub_docker(tmp_path, monkeypatch):
+    # tests/bin/docker and docker-compose first on PATH, their state in tmp_path.
+    monkeypatch.setenv("PATH", os.path.join(HERE, "bin") + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("STUB_DOCKER_DIR", str(tmp_path))
+    return tmp_path
+
+class Registry(http.server.BaseHTTPRequestHandler):
+    # HEAD /v2/<repo>/manifests/<tag> answers with the digest in `digests`, after a token from /token.
+    digests = {}
+    requests = []
+
+    def do_HEAD(self):
+        if self.headers.get("Authorization") != "Bearer stand-in":
+            realm = f"http://{self.headers['Host']}/token"
+            return self.reply(401, {"WWW-Authenticate": f'Bearer realm="{realm}",service="stand-in"'})
+        self.requests.append(self.path)
+        repo_tag = self.path[len("/v2/"):].replace("/manifests/", ":")
+        if repo_tag not in self.digests:
+            return self.reply(404)
+        self.reply(200, {"Docker-Content-Digest": self.digests[repo_tag]})
+
+    def do_GET(self):
+        body = json.dumps({"token": "stand-in"}).encode()
+        self.reply(200, {"Content-Type": "application/json", "Content-Length": str(len(body))}, body)
+
+    def reply(self, code, headers=None, body=b""):
+        headers = headers or {}
+        self.send_response(code)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if "Content-Length" not in headers:
+            self.send_header("Content-Length", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def registry(monkeypatch):
+    # A plain http registry on localhost, returns its name for image refs.
+    Registry.digests, Registry.requests = {}, []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Registry)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    name = f"127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(pull_docker_images, "INSECURE_REGISTRIES", [name])
+    yield name
+    server.shutdown()
+    server.server_close()
+
+def max_concurrent(log_path, refs=None):
+    # Most pulls (of refs, default all) running at the same time according to the stub's log.
+    events = []
+    with open(log_path) as f:
+        for line in f:
+            kind, ref, when = line.split()
+            if refs is None or ref in refs:
+                events.append((float(when), kind == "start"))
+    running = peak = 0
+    for _, start in sorted(events):
+        running += 1 if start else -1
+        peak = max(peak, running)
+    return peak
+
+def test_pulls_run_concurrently_within_registry_limits(stub_docker, monkeypatch):
+    monkeypatch.setitem(pull_docker_images.REGISTRY_LIMITS, "docker.io", 2)
+    hub = {f"docker.io/library/app{i}:latest": "docker.io" for i in range(5)}
+    ghcr = {f"ghcr.io/org/tool{i}:latest": "ghcr.io" for i in range(3)}
+    results = pull_docker_images.Puller(workers=6).pull_all({**hub, **ghcr})
+
+    assert {r["status"] for r in results.values()} == {"updated"}
+    assert all(r["bytes"] == 1048576 for r in results.values())
+    log = stub_docker / "pulls.log"
+    assert max_concurrent(log, hub) == 2
+    assert max_concurrent(log, ghcr) == 3
+    assert max_concurrent(log) == 5
+
+def test_pull_without_new_image_is_unchanged(stub_docker, monkeypatch):
+    monkeypatch.setenv("STUB_PULL_SECONDS", "0")
+    ref = "docker.io/library/nginx:latest"
+    puller = pull_docker_images.Puller(workers=2)
+    assert puller.pull("docker.io", ref)["status"] == "updated"
+    unchanged = puller.pull("docker.io", ref)
+    assert (unchanged["status"], unchanged["bytes"]) == ("unchanged", 0)
+    monkeypatch.setenv("STUB_IMAGE_VERSION", "2")
+    assert puller.pull("docker.io", ref)["status"] == "updated"
+
+def test_failed_pull_is_reported(stub_docker, capsys):
+    images = {"docker.io/library/broken:latest": "docker.io", "docker.io/library/ok:latest": "docker.io"}
+    results = pull_docker_images.Puller(workers=2).pull_all(images)
+    failed = results["docker.io/library/broken:latest"]
+    assert failed["status"] == "failed"
+    assert failed["error"].endswith("manifest unknown")
+    assert results["docker.io/library/ok:latest"]["status"] == "updated"
+
+    pull_docker_images.print_summary({"/srv/app": {"web": "docker.io/library/broken:latest"}}, results)
+    out = capsys.readouterr().out
+    assert "manifest unknown" in out
+    assert "failed" in out
+
+def test_update_exits_nonzero_on_failure(stub_docker, tmp_path, monkeypatch, capsys):
+    for name, image in (("good", "redis:7"), ("bad", "ghcr.io/org/broken")):
+        project = tmp_path / "docker" / name
+        project.mkdir(parents=True)
+        (project / "compose.yaml").write_text("")
+        (project / "services.json").write_text(json.dumps({"services": {"app": {"image": image}}}))
+    monkeypatch.setattr(pull_docker_images, "COMPOSE_INDEX", str(tmp_path / "compose_index.json"))
+    monkeypatch.setattr(pull_docker_images, "DIGEST_CACHE", str(tmp_path / "digests.json"))
+    # No registry to ask, every image is pulled.
+    monkeypatch.setattr(digest_cache, "remote_digest", lambda ref, insecure: None)
+
+    with pytest.raises(SystemExit) as exit:
+        pull_docker_images.update_docker_images(str(tmp_path / "docker"))
+    assert exit.value.code == 1
+    out = capsys.readouterr().out
+    assert "updated   docker.io/library/redis:7" in out
+    assert "failed    ghcr.io/org/broken:latest" in out
+    assert "1 images or projects failed to update." in out
+
+def test_digest_cache_hit_miss_and_expiry(stub_docker, registry, monkeypatch, tmp_path):
+    monkeypatch.setenv("STUB_PULL_SECONDS", "0")
+    ref = f"{registry}/org/app:latest"
+    # The stub docker reports sha256:aaa as the digest of every image it has.
+    Registry.digests["org/app:latest"] = "sha256:aaa"
+    cache = digest_cache.DigestCache(str(tmp_path / "digests.json"), 3600)
+    puller = pull_docker_images.Puller(workers=1, cache=cache)
+
+    # Miss: not pulled yet, the registry is asked and the image pulled.
+    assert puller.pull(registry, ref)["status"] == "updated"
+    assert len(Registry.requests) == 1
+    # Hit: within the TTL and present locally, neither the registry nor docker pull is used.
+    assert puller.pull(registry, ref)["status"] == "skipped"
+    assert len(Registry.requests) == 1
+    assert (stub_docker / "pulls.log").read_text().count("start") == 1
+
+    # Expired: the registry is asked again and still serves the local digest, no pull.
+    cache.entries[ref]["checked"] = time.time() - 7200
+    assert puller.pull(registry, ref)["status"] == "skipped"
+    assert len(Registry.requests) == 2
+    assert cache.fresh(ref)
+
+    # A new digest on the registry is pulled once the entry expired.
+    cache.entries[ref]["checked"] = time.time() - 7200
+    Registry.digests["org/app:latest"] = "sha256:bbb"
+    monkeypatch.setenv("STUB_IMAGE_VERSION", "2")
+    assert puller.pull(registry, ref)["status"] == "updated"
+    assert cache.digest(ref) == "sha256:bbb"
+
+def test_fresh_cache_entry_for_a_removed_image_is_pulled(stub_docker, registry, monkeypatch, tmp_path):
+    monkeypatch.setenv("STUB_PULL_SECONDS", "0")
+    ref = f"{registry}/org/app:latest"
+    Registry.digests["org/app:latest"] = "sha256:aaa"
+    cache = digest_cache.DigestCache(str(tmp_path / "digests.json"), 3600)
+    cache.record(ref, "sha256:aaa")
+    assert pull_docker_images.Puller(workers=1, cache=cache).pull(registry, ref)["status"] == "updated"
+    assert (stub_docker / "pulls.log").read_text().count("start") == 1
+
+def test_only_services_whose_image_changed_are_recreated(stub_docker, monkeypatch):
+    monkeypatch.setenv("STUB_PULL_SECONDS", "0")
+    web, db, cache = "docker.io/library/nginx:latest", "docker.io/library/postgres:16", "docker.io/library/redis:7"
+    for ref in (web, db, cache):
+        pull_docker_images.run(["docker", "pull", "--quiet", ref])
+    image = lambda ref: pull_docker_images.image_id(ref)[0]
+    (stub_docker / "containers").mkdir()
+    # app: web runs the current image, db an older one. tools: up to date.
+    (stub_docker / "containers" / "app-web").write_text(f"web {image(web)}\n")
+    (stub_docker / "containers" / "app-db").write_text("db sha256:0-old\n")
+    (stub_docker / "containers" / "tools-cache").write_text(f"cache {image(cache)}\n")
+    projects = {}
+    for name, services in (("app", {"web": web, "db": db}), ("tools", {"cache": cache})):
+        (stub_docker / name).mkdir()
+        projects[str(stub_docker / name)] = services
+
+    results = pull_docker_images.recreate_changed(projects)
+    assert [(r["project"], r["services"], r["status"]) for r in results] == [(str(stub_docker / "app"), ["db"], "healthy")]
+    assert (stub_docker / "compose.log").read_text() == "app up -d --no-deps db\n"
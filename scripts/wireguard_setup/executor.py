@@ -0,0 +1 @@
+../executor.py
\ No newline at end of file
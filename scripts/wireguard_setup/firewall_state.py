@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# Declarative firewalld setup for wireguard_setup.py.
+#
+# The permanent zones and policies are read once (`firewall-cmd --permanent --list-all-zones` and
+# `--list-all-policies`), compared with the wanted state and only the difference is written, a few
+# grouped firewall-cmd calls and one reload. Nothing is run when the system already matches.
+#
+# Wanted state, same keys as the listings:
+#   zones    = {"wg": {"interfaces": ["wg0"], "ports": ["51820/udp"], "masquerade": "yes"}}
+#   policies = {"wg-to-docker": {"target": "ACCEPT", "ingress-zones": ["wg"], "egress-zones": ["docker"]}}
+# Zones are shared with everything else on the host, so their lists are only added to. Policies are
+# ours by name, their zone lists are made exact.
+import re
+
+# List keys and the firewall-cmd option adding one entry. Interfaces are moved, not added, so one
+# that is already in another zone doesn't fail with ZONE_CONFLICT.
+LIST_OPTIONS = {"interfaces": "change-interface", "services": "add-service", "ports": "add-port",
+                "ingress-zones": "add-ingress-zone", "egress-zones": "add-egress-zone"}
+LIST_KEY = re.compile(r"^\s+([a-z][a-z -]*):\s*(.*)$")
+
+def parse_listing(text):
+    # {name: {key: value}} from a --list-all-zones / --list-all-policies listing. List keys are split.
+    objects = {}
+    current = None
+    for line in text.splitlines():
+        if line and not line[0].isspace():
+            current = objects.setdefault(line.split()[0], {})
+            continue
+        match = LIST_KEY.match(line)
+        if match and current is not None:
+            key, value = match.groups()
+            current[key] = value.split() if key in LIST_OPTIONS else value.strip()
+    return objects
+
+def _list_changes(option, have, want, exact):
+    args = [f"--{option}={value}" for value in want if value not in have]
+    if exact:
+        args += [f"--{option.replace('add-', 'remove-', 1)}={value}" for value in have if value not in want]
+    return args
+
+def _object_changes(flag, name, have, want, exact):
+    # firewall-cmd argument lists turning have into want, one call per kind of change.
+    calls = []
+    for key, value in want.items():
+        if key in LIST_OPTIONS:
+            changes = _list_changes(LIST_OPTIONS[key], have.get(key, []), value, exact)
+            # Only one interface move per call.
+            groups = [[arg] for arg in changes] if key == "interfaces" else [changes] if changes else []
+            calls += [[f"--{flag}={name}"] + group for group in groups]
+        elif key == "masquerade" and have.get(key) != value:
+            calls.append([f"--{flag}={name}", "--add-masquerade" if value == "yes" else "--remove-masquerade"])
+        elif key == "target" and have.get(key) != value:
+            calls.append([f"--{flag}={name}", f"--set-target={value}"])
+    return calls
+
+def plan(zones, policies, current_zones, current_policies):
+    # The firewall-cmd --permanent calls (argument lists) that bring the current state to the wanted one.
+    calls = []
+    for flag, wanted, current, exact in (("zone", zones, current_zones, False),
+                                         ("policy", policies, current_policies, True)):
+        for name, want in wanted.items():
+            if name not in current:
+                calls.append([f"--new-{flag}={name}"])
+            calls += _object_changes(flag, name, current.get(name, {}), want, exact)
+    return calls
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Persistent address allocator for the WireGuard subnets, IPv4 and IPv6.
+#
+# Addresses are kept as offsets into their network. New ones come from a cursor that only moves
+# forward, released ones go on a free list and are handed out again first. Allocate and release are
+# O(1) and no address is ever enumerated, so a /8 or an IPv6 /64 costs the same as a /24.
+#
+# State file, one pool per network:
+#   {"10.0.10.0/24": {"cursor": 5, "free": [3], "allocated": {"@server": 1, "alice": 2, "bob": 4},
+#                     "reserved": [[240, 254]]}}
+import ipaddress, json, os
+
+SERVER = "@server"  # Not a valid peer name on the command line, can't clash.
+
+class AddressPool:
+    def __init__(self, network, state=None):
+        self.network = ipaddress.ip_network(network)
+        state = state or {}
+        self.cursor = state.get("cursor", 1)
+        self.free = state.get("free", [])
+        self.allocated = state.get("allocated", {})
+        # Inclusive offset ranges that are never handed out, Ex: a block kept for static hosts.
+        self.reserved = sorted(state.get("reserved", []))
+        # Offset 0 is the network address, the last IPv4 offset the broadcast address.
+        size = self.network.num_addresses
+        self.last = size - 1 if self.network.version == 6 or size <= 2 else size - 2
+
+    def state(self):
+        return {"cursor": self.cursor, "free": self.free, "allocated": self.allocated, "reserved": self.reserved}
+
+    def address(self, name):
+        offset = self.allocated.get(name)
+        return None if offset is None else str(self.network[offset])
+
+    def _skip_reserved(self, offset):
+        for first, last in self.reserved:
+            if first <= offset <= last:
+                offset = last + 1
+        return offset
+
+    def allocate(self, name):
+        # Address of name, allocating one the first time. Raises ValueError when the pool is full.
+        if name not in self.allocated:
+            if self.free:
+                offset = self.free.pop()
+            else:
+                offset = self._skip_reserved(self.cursor)
+                if offset > self.last:
+                    raise ValueError(f"No free addresses left in {self.network}")
+                self.cursor = offset + 1
+            self.allocated[name] = offset
+        return self.address(name)
+
+    def release(self, name):
+        offset = self.allocated.pop(name, None)
+        if offset is not None:
+            self.free.append(offset)
+
+    def reserve(self, first, last):
+        # Keep the address range first..last (inclusive) out of the pool. Already allocated ones stay.
+        span = f"{first}-{last}"
+        first = int(ipaddress.ip_address(first)) - int(self.network.network_address)
+        last = int(ipaddress.ip_address(last)) - int(self.network.network_address)
+        if not 0 < first <= last <= self.last:
+            raise ValueError(f"{span} is not inside {self.network}")
+        if [first, last] in self.reserved:
+            return
+        self.reserved = sorted(self.reserved + [[first, last]])
+        self.free = [o for o in self.free if not first <= o <= last]
+
+class Allocator:
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        self.pools = {network: AddressPool(network, state) for network, state in data.items()}
+
+    def pool(self, network):
+        network = str(ipaddress.ip_network(network, strict=False))
+        if network not in self.pools:
+            self.pools[network] = AddressPool(network)
+        return self.pools[network]
+
+    def retain(self, networks):
+        # Forget pools of subnets no longer in use.
+        keep = {str(ipaddress.ip_network(n, strict=False)) for n in networks}
+        self.pools = {network: pool for network, pool in self.pools.items() if network in keep}
+
+    def release(self, name):
+        for pool in self.pools.values():
+            pool.release(name)
+
+    def save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({network: pool.state() for network, pool in self.pools.items()}, f, indent=1)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, self.path)
@@ -0,0 +1,69 @@
+import json, os, sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import wireguard_setup
+
+CONF = """[Interface]
+Address = 10.0.10.1/24
+PrivateKey = server-private
+
+[Peer]
+# alice, new
+PublicKey = alice=
+AllowedIPs = 10.0.10.2/32, fd00:10::2/128
+
+[Peer]
+# bob, address changed
+PublicKey = bob=
+AllowedIPs = 10.0.10.5/32
+
+[Peer]
+# carol, unchanged
+PublicKey = carol=
+AllowedIPs = 10.0.10.4/32
+"""
+
+@pytest.fixture
+def fake_wg(tmp_path, monkeypatch):
+    # tests/bin/wg first on PATH. Returns the path of its state, {public key: allowed ips}.
+    state = tmp_path / "wg0.json"
+    monkeypatch.setenv("PATH", os.path.join(HERE, "bin") + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("FAKE_WG_STATE", str(state))
+    monkeypatch.setattr(wireguard_setup, "WG_CONF", tmp_path / "wg0.conf")
+    (tmp_path / "wg0.conf").write_text(CONF)
+    return state
+
+def set_calls(state):
+    log = state.parent / (state.name + ".log")
+    return log.read_text().splitlines() if log.exists() else []
+
+def test_applies_only_the_difference(fake_wg):
+    fake_wg.write_text(json.dumps({"bob=": "10.0.10.3/32", "carol=": "10.0.10.4/32", "dave=": "10.0.10.6/32"}))
+    added, removed, updated = wireguard_setup.apply_peers()
+    assert (added, removed, updated) == (["alice="], ["dave="], ["bob="])
+    assert set_calls(fake_wg) == [
+        "set wg0 peer dave= remove peer alice= allowed-ips 10.0.10.2/32,fd00:10::2/128 "
+        "peer bob= allowed-ips 10.0.10.5/32"]
+    assert json.loads(fake_wg.read_text()) == {"alice=": "10.0.10.2/32,fd00:10::2/128", "bob=": "10.0.10.5/32",
+                                               "carol=": "10.0.10.4/32"}
+
+def test_nothing_to_do_runs_no_set(fake_wg):
+    fake_wg.write_text(json.dumps({"alice=": "fd00:10::2/128,10.0.10.2/32", "bob=": "10.0.10.5/32",
+                                   "carol=": "10.0.10.4/32"}))
+    assert wireguard_setup.apply_peers() == ([], [], [])
+    assert set_calls(fake_wg) == []
+
+def test_changes_are_batched(fake_wg):
+    fake_wg.write_text(json.dumps({"dave=": "10.0.10.6/32"}))
+    wireguard_setup.apply_peers(batch=2)
+    assert set_calls(fake_wg) == [
+        "set wg0 peer dave= remove peer alice= allowed-ips 10.0.10.2/32,fd00:10::2/128",
+        "set wg0 peer bob= allowed-ips 10.0.10.5/32 peer carol= allowed-ips 10.0.10.4/32"]
+
+def test_interface_down(fake_wg):
+    assert wireguard_setup.apply_peers() is None
+    assert set_calls(fake_wg) == []
@@ -0,0 +1,54 @@
+import json, os, sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import wireguard_setup
+
+ZONES = wireguard_setup.firewall_zones("eth0", 51820)
+POLICIES = {"wg-to-docker": {"target": "ACCEPT", "ingress-zones": ["wg"], "egress-zones": ["docker"]}}
+
+@pytest.fixture
+def fake_firewall(tmp_path, monkeypatch):
+    # tests/bin/firewall-cmd first on PATH. Returns the path of its state, a fresh install by default.
+    state = tmp_path / "firewalld.json"
+    monkeypatch.setenv("PATH", os.path.join(HERE, "bin") + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("FAKE_FIREWALL_STATE", str(state))
+    state.write_text(json.dumps({"zones": {"public": {"services": ["ssh"]}, "docker": {}}, "policies": {}}))
+    return state
+
+def calls(state):
+    log = state.parent / (state.name + ".log")
+    return log.read_text().splitlines() if log.exists() else []
+
+def test_first_run_groups_calls_and_reloads_once(fake_firewall):
+    assert wireguard_setup.reconcile_firewall(ZONES, POLICIES) == 9
+    assert calls(fake_firewall) == [
+        "--permanent --zone=public --change-interface=eth0",
+        "--permanent --zone=public --add-port=51820/udp",
+        "--permanent --zone=public --add-masquerade",
+        "--permanent --new-zone=wg",
+        "--permanent --zone=wg --change-interface=wg0",
+        "--permanent --new-policy=wg-to-docker",
+        "--permanent --policy=wg-to-docker --set-target=ACCEPT",
+        "--permanent --policy=wg-to-docker --add-ingress-zone=wg",
+        "--permanent --policy=wg-to-docker --add-egress-zone=docker",
+        "--reload"]
+
+def test_converged_listing_writes_nothing(fake_firewall):
+    wireguard_setup.reconcile_firewall(ZONES, POLICIES)
+    written = calls(fake_firewall)
+    assert wireguard_setup.reconcile_firewall(ZONES, POLICIES) == 0
+    assert calls(fake_firewall) == written
+
+def test_extra_policy_ingress_zone_is_removed(fake_firewall):
+    wireguard_setup.reconcile_firewall(ZONES, POLICIES)
+    state = json.loads(fake_firewall.read_text())
+    state["policies"]["wg-to-docker"]["ingress-zones"].append("public")
+    fake_firewall.write_text(json.dumps(state))
+    written = len(calls(fake_firewall))
+    assert wireguard_setup.reconcile_firewall(ZONES, POLICIES) == 1
+    assert calls(fake_firewall)[written:] == ["--permanent --policy=wg-to-docker --remove-ingress-zone=public",
+                                              "--reload"]
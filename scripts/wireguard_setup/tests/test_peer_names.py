@@ -0,0 +1,24 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wireguard_setup
+
+@pytest.mark.parametrize("name", ["client1", "alice.laptop", "bob_phone-2"])
+def test_valid_names(name):
+    wireguard_setup.check_peer_names([name])
+
+@pytest.mark.parametrize("name", ["../etc/passwd", "a b", "x;rm -rf /", "", "@server", "$(id)"])
+def test_invalid_names(name):
+    with pytest.raises(SystemExit):
+        wireguard_setup.check_peer_names(["ok", name])
+
+def test_add_peers_rejects_before_touching_anything(tmp_path, monkeypatch):
+    monkeypatch.setattr(wireguard_setup, "SETTINGS", tmp_path / "server.json")
+    monkeypatch.setattr(wireguard_setup, "PEERS", tmp_path / "peers.json")
+    (tmp_path / "server.json").write_text('{"subnets": ["10.0.10.0/24"]}')
+    with pytest.raises(SystemExit):
+        wireguard_setup.provision_peers(add=["good", "../bad"])
+    assert not (tmp_path / "peers.json").exists()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# WireGuard keys in-process: Curve25519 (RFC 7748) in pure Python, so provisioning hundreds of
+# peers doesn't spawn a `wg genkey | tee | wg pubkey` shell pipeline per key.
+import base64, os
+
+P = 2**255 - 19
+A24 = 121665
+BASE_POINT = 9
+
+def _x25519(scalar, u):
+    # Montgomery ladder from RFC 7748 section 5, scalar is 32 little endian bytes.
+    k = int.from_bytes(scalar, "little")
+    k &= ~7
+    k &= ~(128 << 8 * 31)
+    k |= 64 << 8 * 31
+    x1, x2, z2, x3, z3 = u, 1, 0, u, 1
+    swap = 0
+    for t in reversed(range(255)):
+        bit = (k >> t) & 1
+        if swap ^ bit:
+            x2, x3, z2, z3 = x3, x2, z3, z2
+        swap = bit
+        a, b = x2 + z2, x2 - z2
+        c, d = x3 + z3, x3 - z3
+        aa, bb = a * a % P, b * b % P
+        e = aa - bb
+        da, cb = d * a % P, c * b % P
+        x3, z3 = (da + cb) ** 2 % P, x1 * (da - cb) ** 2 % P
+        x2, z2 = aa * bb % P, e * (aa + A24 * e) % P
+    if swap:
+        x2, z2 = x3, z3
+    return x2 * pow(z2, P - 2, P) % P
+
+def gen_private():
+    # Same as `wg genkey`: 32 random bytes, clamped, base64.
+    key = bytearray(os.urandom(32))
+    key[0] &= 248
+    key[31] &= 127
+    key[31] |= 64
+    return base64.b64encode(bytes(key)).decode()
+
+def public_key(private_b64):
+    # Same as `wg pubkey`.
+    point = _x25519(base64.b64decode(private_b64), BASE_POINT)
+    return base64.b64encode(point.to_bytes(32, "little")).decode()
+
+def write_keypair(priv_path, pub_path):
+    # Creates the pair unless priv_path exists, returns the public key. Never replaces an existing key.
+    if priv_path.exists():
+        public = public_key(priv_path.read_text().strip())
+    else:
+        private = gen_private()
+        fd = os.open(priv_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(private + "\n")
+        public = public_key(private)
+    if not pub_path.exists() or pub_path.read_text().strip() != public:
+        pub_path.write_text(public + "\n")
+    return public
@@ -4,25 +4,42 @@
 # This install is setup for Fedora Linux which use DNF package manager.
 #
 ####################
-import os, time
+import os, re, shlex, time
 import subprocess
+import hashlib
 from pathlib import Path
 import ipaddress
+import argparse, json
+
+import executor, firewall_state, ip_allocator, wg_keys
 
 WG_DIR = Path("/etc/wireguard")
 SERVER_PRIV = WG_DIR / "server_private.key"
 SERVER_PUB = WG_DIR / "server_public.key"
-CLIENT_PRIV = WG_DIR / "client1_private.key"
-CLIENT_PUB = WG_DIR / "client1_public.key"
 WG_CONF = WG_DIR / "wg0.conf"
-CLIENT_CONF = WG_DIR / "client1.conf"
-CLIENT_PNG = WG_DIR / "client1.png"
+# Answers of the interactive setup, so peers can be added later without asking again.
+SETTINGS = WG_DIR / "server.json"
+# Provisioned peers: {name: {"addresses": ["10.0.10.2", "fd00:10::2"]}}. Keys, .conf and .png live next
+# to it as <name>_private.key, <name>_public.key, <name>.conf and <name>.png.
+PEERS = WG_DIR / "peers.json"
+# Address allocator state (ip_allocator.py), the source of truth for who has which address.
+IPAM = WG_DIR / "ipam.json"
+# sha256 of each peer's .conf its QR codes were made from: {name: hex}. Unchanged peers are skipped.
+BUNDLES = WG_DIR / "bundles.json"
+BUNDLE_WORKERS = os.cpu_count() or 4
+
+# Every command goes through the shared executor (../executor.py): timings, EXECUTOR_TRACE, record/replay.
+EXECUTOR = executor.Executor(limit=BUNDLE_WORKERS)
+DEFAULT_PEER = "client1"
+# Peer names end up in file names and wg0.conf comments.
+PEER_NAME = re.compile(r"^[A-Za-z0-9_.-]+$")
 
 def run(cmd, capture=False):
-    print("[~] " + cmd)
+    # cmd is an argument list, nothing goes through a shell.
+    print("[~] " + shlex.join(str(arg) for arg in cmd))
+    result = EXECUTOR.call(cmd, capture=capture, check=True)
     if capture:
-        return subprocess.check_output(cmd, shell=True, text=True).strip()
-    subprocess.check_call(cmd, shell=True)
+        return result.stdout.strip()
 
 def ensure_dir():
     WG_DIR.mkdir(parents=True, exist_ok=True)
@@ -30,52 +47,102 @@ def ensure_dir():
 
 def install_packages():
     print("[*] Installing packages...")
-    run("dnf install -y wireguard-tools qrencode firewalld curl iproute")
+    run(["dnf", "install", "-y", "wireguard-tools", "qrencode", "firewalld", "curl", "iproute"])
+
+def check_peer_names(names):
+    invalid = [name for name in names if not PEER_NAME.match(name)]
+    if invalid:
+        raise SystemExit(f"[!] Invalid peer names (letters, digits, '_', '.' and '-' only): {', '.join(invalid)}")
+
+def peer_files(name):
+    # (private key, public key, client conf, QR png, terminal QR) of one peer.
+    return (WG_DIR / f"{name}_private.key", WG_DIR / f"{name}_public.key",
+            WG_DIR / f"{name}.conf", WG_DIR / f"{name}.png", WG_DIR / f"{name}.qr")
 
-def gen_keys():
+def gen_keys(names=()):
+    # Keys are generated in-process (wg_keys.py), existing keys are kept.
     print("[*] Generating keys...")
-    if not SERVER_PRIV.exists():
-        run(f"wg genkey | tee {SERVER_PRIV} | wg pubkey > {SERVER_PUB}")
-        os.chmod(SERVER_PRIV, 0o600)
-    if not CLIENT_PRIV.exists():
-        run(f"wg genkey | tee {CLIENT_PRIV} | wg pubkey > {CLIENT_PUB}")
-        os.chmod(CLIENT_PRIV, 0o600)
+    wg_keys.write_keypair(SERVER_PRIV, SERVER_PUB)
+    for name in names:
+        priv, pub = peer_files(name)[:2]
+        wg_keys.write_keypair(priv, pub)
 
 def read_file(path):
     return path.read_text().strip()
 
-def write_server_conf(pub_iface, server_ip, subnet, client_ip, port):
-    print("[*] Writing server config...")
+def load_json(path, default):
+    return json.loads(path.read_text()) if path.exists() else default
+
+def save_json(path, data):
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n")
+    os.chmod(tmp, 0o600)
+    os.replace(tmp, path)
+
+def allocate_addresses(settings, peers):
+    # Addresses of the server and every peer, one per subnet, from the persistent allocator (ipam.json).
+    # Returns (server addresses, {name: addresses}).
+    allocator = ip_allocator.Allocator(IPAM)
+    subnets = settings["subnets"]
+    allocator.retain(subnets)
+    pools = [allocator.pool(subnet) for subnet in subnets]
+    for pool in pools:
+        for span in settings.get("reserved", []):
+            first, last = span.split("-")
+            if ipaddress.ip_address(first) in pool.network:
+                pool.reserve(first, last)
+    server_ips = [pool.allocate(ip_allocator.SERVER) for pool in pools]
+    addresses = {name: [pool.allocate(name) for pool in pools] for name in sorted(peers)}
+    allocator.save()
+    return server_ips, addresses
+
+def interface_addresses(addresses, subnets):
+    # "10.0.10.2/24, fd00:10::2/64"
+    return ", ".join(f"{address}/{ipaddress.ip_network(subnet).prefixlen}"
+                     for address, subnet in zip(addresses, subnets))
+
+def allowed_ips(addresses):
+    # A peer routes only its own addresses: /32 and /128.
+    return ", ".join(f"{address}/{ipaddress.ip_address(address).max_prefixlen}" for address in addresses)
+
+def write_server_conf(pub_iface, server_ips, subnets, peers, port):
+    print(f"[*] Writing server config with {len(peers)} peers...")
     server_priv = read_file(SERVER_PRIV)
-    client_pub = read_file(CLIENT_PUB)
+    peer_blocks = "".join(f"""
+[Peer]
+# {name}
+PublicKey = {read_file(peer_files(name)[1])}
+AllowedIPs = {allowed_ips(peers[name])}
+""" for name in sorted(peers))
+
+    firewall = ["iptables"]
+    if any(ipaddress.ip_network(subnet).version == 6 for subnet in subnets):
+        firewall.append("ip6tables")
+    post_up = "".join(f"""PostUp = {cmd} -A FORWARD -i wg0 -j ACCEPT
+PostUp = {cmd} -A FORWARD -o wg0 -j ACCEPT
+PostUp = {cmd} -t nat -A POSTROUTING -o {pub_iface} -j MASQUERADE
+""" for cmd in firewall)
+    post_down = "".join(f"""PostDown = {cmd} -D FORWARD -i wg0 -j ACCEPT
+PostDown = {cmd} -D FORWARD -o wg0 -j ACCEPT
+PostDown = {cmd} -t nat -D POSTROUTING -o {pub_iface} -j MASQUERADE
+""" for cmd in firewall)
 
     conf = f"""[Interface]
-Address = {server_ip}/{subnet.prefixlen}
+Address = {interface_addresses(server_ips, subnets)}
 ListenPort = {port}
 PrivateKey = {server_priv}
 PostUp = sysctl -w net.ipv4.ip_forward=1
-PostUp = iptables -A FORWARD -i wg0 -j ACCEPT
-PostUp = iptables -A FORWARD -o wg0 -j ACCEPT
-PostUp = iptables -t nat -A POSTROUTING -o {pub_iface} -j MASQUERADE
-PostDown = iptables -D FORWARD -i wg0 -j ACCEPT
-PostDown = iptables -D FORWARD -o wg0 -j ACCEPT
-PostDown = iptables -t nat -D POSTROUTING -o {pub_iface} -j MASQUERADE
-
-[Peer]
-PublicKey = {client_pub}
-AllowedIPs = {client_ip}/32
-"""
+{post_up}{post_down}{peer_blocks}"""
     WG_CONF.write_text(conf)
     os.chmod(WG_CONF, 0o600)
 
-def write_client_conf(endpoint, client_ip, server_ip, subnet, port):
-    print("[*] Writing client config...")
-    client_priv = read_file(CLIENT_PRIV)
+def render_client_conf(name, endpoint, client_ips, subnets, port):
+    client_priv = read_file(peer_files(name)[0])
     server_pub = read_file(SERVER_PUB)
 
-    conf = f"""[Interface]
+    return f"""[Interface]
 PrivateKey = {client_priv}
-Address = {client_ip}/{subnet.prefixlen}
+Address = {interface_addresses(client_ips, subnets)}
 DNS = 1.1.1.1
 
 [Peer]
@@ -84,58 +151,184 @@ Endpoint = {endpoint}:{port}
 AllowedIPs = 0.0.0.0/0, ::/0
 PersistentKeepalive = 25
 """
-    CLIENT_CONF.write_text(conf)
-    os.chmod(CLIENT_CONF, 0o600)
-
-def make_qr():
-    print("[*] Generating QR code...")
-    run(f"qrencode -o {CLIENT_PNG} -t PNG -s 10 < {CLIENT_CONF}")
 
-def show_qr_console():
+async def write_bundle(name, conf):
+    # .conf, QR png and terminal QR of one peer, qrencode reads the config on stdin.
+    # Returns None, or the error that stopped it.
+    _, _, client_conf, client_png, client_qr = peer_files(name)
+    try:
+        client_conf.write_text(conf)
+        os.chmod(client_conf, 0o600)
+        for qr_type, path in (("PNG", client_png), ("ANSIUTF8", client_qr)):
+            args = ["qrencode", "-o", str(path), "-t", qr_type] + (["-s", "10"] if qr_type == "PNG" else [])
+            await EXECUTOR.run(args, input=conf, check=True)
+            os.chmod(path, 0o600)
+    except (OSError, subprocess.CalledProcessError) as e:
+        return e
+
+def generate_bundles(confs):
+    # Writes the bundles of {name: conf text} whose conf hash changed or whose files are missing, up to
+    # BUNDLE_WORKERS at once (qrencode is the slow part). Returns the regenerated names.
+    hashes = load_json(BUNDLES, {})
+    hashes = {name: digest for name, digest in hashes.items() if name in confs}
+    todo = {}
+    for name, conf in confs.items():
+        digest = hashlib.sha256(conf.encode()).hexdigest()
+        if hashes.get(name) != digest or not all(path.exists() for path in peer_files(name)[2:]):
+            todo[name] = digest
+    done, failed = [], []
+    errors = EXECUTOR.gather(*(write_bundle(name, confs[name]) for name in todo))
+    for name, error in zip(todo, errors):
+        if error:
+            print(f"[!] Bundle for {name} failed: {error}")
+            hashes.pop(name, None)
+            failed.append(name)
+        else:
+            hashes[name] = todo[name]
+            done.append(name)
+    save_json(BUNDLES, hashes)
+    done.sort()
+    print(f"[*] Client bundles: {len(done)} regenerated, {len(confs) - len(todo)} unchanged, {len(failed)} failed.")
+    if done:
+        print("[*] Regenerated: " + ", ".join(done[:20]) + (f" and {len(done) - 20} more" if len(done) > 20 else ""))
+    return done
+
+def show_qr_console(name=DEFAULT_PEER):
     print("[*] Printing QR code to console...\n")
-    run(f"qrencode -t ANSIUTF8 < {CLIENT_CONF}")    
-
-def enable_forwarding():
-    print("[*] Enabling IPv4 forwarding...")
+    print(peer_files(name)[4].read_text())
+
+def provision_peers(add=(), remove=()):
+    # Idempotent: existing peers keep their keys and addresses, only new or changed client bundles
+    # (.conf and QR codes) are written. wg0.conf always lists every peer. Returns the changed peer names.
+    settings = load_json(SETTINGS, None)
+    if not settings:
+        raise SystemExit(f"[!] {SETTINGS} not found, run the interactive setup first.")
+    check_peer_names(add)
+    subnets = settings["subnets"]
+    peers = load_json(PEERS, {})
+    removed = []
+    for name in remove:
+        if peers.pop(name, None) is not None:
+            print(f"[*] Removing peer {name}")
+            removed.append(name)
+            for path in peer_files(name):
+                path.unlink(missing_ok=True)
+    if removed:
+        allocator = ip_allocator.Allocator(IPAM)
+        for name in removed:
+            allocator.release(name)
+        allocator.save()
+    new = [name for name in add if name not in peers]
+    for name in new:
+        peers[name] = {}
+    gen_keys(new)
+    server_ips, addresses = allocate_addresses(settings, peers)
+    save_json(PEERS, {name: {"addresses": addresses[name]} for name in peers})
+
+    write_server_conf(settings["pub_iface"], server_ips, subnets, addresses, settings["port"])
+    changed = generate_bundles({name: render_client_conf(name, settings["endpoint"], addresses[name], subnets,
+                                                         settings["port"])
+                                for name in sorted(peers)})
+    print(f"[*] {len(new)} peers added, {len(peers)} peers total.")
+    return changed
+
+def enable_forwarding(ipv6=False):
+    print("[*] Enabling IP forwarding...")
     sysctl_conf = Path("/etc/sysctl.d/99-wireguard.conf")
-    sysctl_conf.write_text("net.ipv4.ip_forward = 1\n")
-    run("sysctl --system")
+    sysctl_conf.write_text("net.ipv4.ip_forward = 1\n" + ("net.ipv6.conf.all.forwarding = 1\n" if ipv6 else ""))
+    run(["sysctl", "--system"])
+
+def firewall_zones(pub_iface, port):
+    # Public side: WireGuard port and NAT. wg0 gets a zone of its own.
+    return {"public": {"interfaces": [pub_iface], "ports": [f"{port}/udp"], "masquerade": "yes"},
+            "wg": {"interfaces": ["wg0"]}}
+
+def reconcile_firewall(zones, policies=None):
+    # Brings the permanent firewalld config to zones/policies (see firewall_state.py), reloads once.
+    # Returns the number of changes, 0 when everything was already in place.
+    current_zones = firewall_state.parse_listing(run(["firewall-cmd", "--permanent", "--list-all-zones"], capture=True))
+    current_policies = {}
+    if policies:
+        current_policies = firewall_state.parse_listing(
+            run(["firewall-cmd", "--permanent", "--list-all-policies"], capture=True))
+    calls = firewall_state.plan(zones, policies or {}, current_zones, current_policies)
+    if not calls:
+        print("[*] Firewall already configured.")
+        return 0
+    for args in calls:
+        run(["firewall-cmd", "--permanent"] + args)
+    run(["firewall-cmd", "--reload"])
+    return len(calls)
 
 def setup_firewalld(pub_iface, port):
     print("[*] Configuring firewalld...")
-    run("systemctl enable --now firewalld")
-
-    # Lets start fresh. Delete any existing wg firewall zones and policies.
-    #TODO - This is proving to be sticky.
-    #delete_firewall_zone_if_exists_and_recreate("wg")
-
-    # Allow the specified UDP port.
-    run(f"firewall-cmd --permanent --add-port={port}/udp")
-
-    # Enable NAT masquerading
-    run("firewall-cmd --permanent --add-masquerade")
-
-    # Assign the public interface to the public zone
-    run(f"firewall-cmd --permanent --zone=public --change-interface={pub_iface}")
-
-    # Create and assign a WireGuard zone
-    run("firewall-cmd --permanent --new-zone=wg || true")
-    run("firewall-cmd --permanent --zone=wg --add-interface=wg0 || true")
-
-    # Reload firewalld to apply changes
-    run("firewall-cmd --reload")
+    run(["systemctl", "enable", "--now", "firewalld"])
+    reconcile_firewall(firewall_zones(pub_iface, port))
 
 def bring_up():
     print("[*] Enabling WireGuard service...")
-    run("systemctl enable --now wg-quick@wg0")
+    run(["systemctl", "enable", "--now", "wg-quick@wg0"])
 
 def bring_down():
     print("[*] Stopping WireGuard service...")
-    run("systemctl stop wg-quick@wg0")
+    run(["systemctl", "stop", "wg-quick@wg0"])
+
+def conf_peers(text):
+    # {public key: sorted allowed ips} of the [Peer] sections of a wg-quick config.
+    peers = {}
+    key = None
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line.startswith("["):
+            key = None
+        elif "=" in line:
+            option, value = (part.strip() for part in line.split("=", 1))
+            if option == "PublicKey":
+                key = value
+                peers[key] = []
+            elif option == "AllowedIPs" and key:
+                peers[key] += [str(ipaddress.ip_network(ip.strip(), strict=False)) for ip in value.split(",")]
+    return {key: sorted(ips) for key, ips in peers.items()}
+
+def running_peers(interface="wg0"):
+    # Same as conf_peers for the live interface, from `wg show <iface> dump`. None if it isn't up.
+    try:
+        dump = run(["wg", "show", interface, "dump"], capture=True)
+    except subprocess.CalledProcessError:
+        return None
+    peers = {}
+    # First line is the interface itself, then: public-key preshared-key endpoint allowed-ips ...
+    for line in dump.splitlines()[1:]:
+        fields = line.split("\t")
+        ips = [] if fields[3] == "(none)" else fields[3].split(",")
+        peers[fields[0]] = sorted(str(ipaddress.ip_network(ip, strict=False)) for ip in ips)
+    return peers
+
+def apply_peers(interface="wg0", batch=100):
+    # Bring the running interface's peers in line with WG_CONF without restarting wg-quick, connected
+    # tunnels stay up. Peer addresses are inside the interface subnets, so no routes need adding.
+    # Returns (added, removed, updated) public keys, None if the interface isn't up.
+    current = running_peers(interface)
+    if current is None:
+        print(f"[*] {interface} is not up, the peers are loaded when it starts.")
+        return None
+    desired = conf_peers(WG_CONF.read_text())
+    added = [key for key in desired if key not in current]
+    removed = [key for key in current if key not in desired]
+    updated = [key for key in desired if key in current and desired[key] != current[key]]
+
+    clauses = [["peer", key, "remove"] for key in removed]
+    clauses += [["peer", key, "allowed-ips", ",".join(desired[key])] for key in added + updated]
+    for start in range(0, len(clauses), batch):
+        args = [arg for clause in clauses[start:start + batch] for arg in clause]
+        run(["wg", "set", interface] + args)
+    print(f"[*] {interface}: {len(added)} peers added, {len(removed)} removed, {len(updated)} updated, "
+          f"{len(desired) - len(added) - len(updated)} unchanged.")
+    return added, removed, updated
 
 def check_running():
     try:
-        status = run("systemctl is-active wg-quick@wg0", capture=True)
+        status = run(["systemctl", "is-active", "wg-quick@wg0"], capture=True)
         if status == "active":
             print("[!] wg-quick@wg0 is already running!")
             
@@ -153,53 +346,24 @@ def check_running():
 
 def detect_external_ip():
     try:
-        return run("curl -s ifconfig.me", capture=True)
+        return run(["curl", "-s", "ifconfig.me"], capture=True)
     except subprocess.CalledProcessError:
         return None
 
-def get_allowed_ip(subnet):
-    # Convert subnet to a network object
-    net = ipaddress.ip_network(subnet, strict=False)
-    # Return the second IP in the network (.2)
-    return str(net[2]) + '/32'
-
-def delete_firewall_policy_if_exists(policy_name):
-    """Deletes a firewall policy if it already exists."""
-    try:
-        # Check if the policy exists
-        output = subprocess.check_output(f"sudo firewall-cmd --permanent --list-all-policies", shell=True, text=True)
-        existing_policies = output.strip().split()
-        if policy_name in existing_policies:
-            print(f"[*] Deleting existing firewall policy: {policy_name}")
-            run(f"sudo firewall-cmd --permanent --delete-policy {policy_name}")
-    except subprocess.CalledProcessError as e:
-        print(f"[!] Error checking existing policies: {e}")
-
-def setup_docker_firewall_rules():
+def setup_docker_firewall_rules(pub_iface, port):
     print("[*] Setting up firewall rules to allow WireGuard and Docker network traffic.")
-
-    print("[*] Allow WireGuard to use all ports to access docker services running in the docker zone.")
-    run(f"sudo firewall-cmd --zone=wg --add-port=0-65535/udp --permanent")
-    run(f"sudo firewall-cmd --zone=wg --add-port=0-65535/tcp --permanent")
-
-    # Define policies
-    policies = [
-        # Key     Value        ,  Key        Value,    Key       Value
-        {"name": "wg-to-docker", "ingress": "wg",     "egress": "docker"},
-        {"name": "docker-to-wg", "ingress": "docker", "egress": "wg"}
-    ]
-
-    for p in policies:
-        delete_firewall_policy_if_exists(p["name"])
-        print(f"[*] Create firewall policy: {p['name']}")
-        run(f"sudo firewall-cmd --permanent --new-policy {p['name']}")
-        run(f"sudo firewall-cmd --permanent --policy {p['name']} --set-target ACCEPT")
-        run(f"sudo firewall-cmd --permanent --policy {p['name']} --add-ingress-zone {p['ingress']}")
-        run(f"sudo firewall-cmd --permanent --policy {p['name']} --add-egress-zone {p['egress']}")
+    zones = firewall_zones(pub_iface, port)
+    # Allow WireGuard to use all ports to access docker services running in the docker zone.
+    zones["wg"]["ports"] = ["0-65535/udp", "0-65535/tcp"]
+    policies = {
+        "wg-to-docker": {"target": "ACCEPT", "ingress-zones": ["wg"], "egress-zones": ["docker"]},
+        "docker-to-wg": {"target": "ACCEPT", "ingress-zones": ["docker"], "egress-zones": ["wg"]},
+    }
+    reconcile_firewall(zones, policies)
 
 def choose_interface():
     print("[*] Detecting interfaces with IP addresses...")
-    output = run("ip -o -4 addr show", capture=True)
+    output = run(["ip", "-o", "-4", "addr", "show"], capture=True)
     ifaces = []
     for line in output.splitlines():
         parts = line.split()
@@ -242,18 +406,20 @@ def choose_UDP_port():
 def choose_subnet():
     while True:
         print()
-        cidr = input(">>> Enter your desired VPN subnet (CIDR), e.g. 10.0.10.0/24: ").strip()
+        cidrs = input(">>> Enter your desired VPN subnet (CIDR), e.g. 10.0.10.0/24 or 10.0.10.0/24, fd00:10::/64: ")
         try:
-            subnet = ipaddress.ip_network(cidr, strict=False)
-            hosts = list(subnet.hosts())
-            if len(hosts) < 2:
-                print("Subnet too small, need at least 2 addresses.")
-                continue
-            return subnet, str(hosts[0]), str(hosts[1])  # server = first, client = second
+            subnets = [ipaddress.ip_network(cidr.strip(), strict=False) for cidr in cidrs.split(",")]
         except ValueError as e:
             print(f"Invalid subnet: {e}")
-
-def main():
+            continue
+        if any(subnet.num_addresses < 4 for subnet in subnets):
+            print("Subnet too small, need at least 2 addresses.")
+        elif len({subnet.version for subnet in subnets}) != len(subnets):
+            print("Use at most one IPv4 and one IPv6 subnet.")
+        else:
+            return [str(subnet) for subnet in subnets]
+
+def setup(peer_names):
     check_running()
     ensure_dir()
     install_packages()
@@ -269,28 +435,31 @@ def main():
     pub_iface = choose_interface()
     print(f"[*] Selected interface: {pub_iface}")
 
-    subnet, server_ip, client_ip = choose_subnet()
-    print(f"[*] Using subnet {subnet}, server IP {server_ip}, client IP {client_ip}")
+    subnets = choose_subnet()
+    print(f"[*] Using subnet {', '.join(subnets)}")
 
     port = choose_UDP_port()
     print(f"[*] Using port {port}")
 
-    write_server_conf(pub_iface, server_ip, subnet, client_ip, port)
-    write_client_conf(endpoint, client_ip, server_ip, subnet, port)
-    make_qr()
-    enable_forwarding()
+    # A changed subnet gives every peer a new address in it, the allocator drops the old pool. Keys are kept.
+    reserved = load_json(SETTINGS, {}).get("reserved", [])
+    save_json(SETTINGS, {"endpoint": endpoint, "pub_iface": pub_iface, "subnets": subnets,
+                         "reserved": reserved, "port": port})
+    provision_peers(add=peer_names)
+    enable_forwarding(any(ipaddress.ip_network(subnet).version == 6 for subnet in subnets))
     setup_firewalld(pub_iface, port)
     print("[+] Done!\n")
 
     print()
     choice = input(">>> Would you like to allow traffic between docker containers and your wireguard VPN tunnel? [y/N]")
     if choice == "y":
-        setup_docker_firewall_rules()
+        setup_docker_firewall_rules(pub_iface, port)
 
-    print()
-    choice = input(">>> Would you like to show the quick connect QR code now? [y/N]")
-    if choice == "y":
-        show_qr_console()
+    if len(peer_names) == 1:
+        print()
+        choice = input(">>> Would you like to show the quick connect QR code now? [y/N]")
+        if choice == "y":
+            show_qr_console(peer_names[0])
 
     print()
     choice = input(">>> Do you want to enable/start the service now? [y/N]: ").strip()
@@ -298,15 +467,53 @@ def main():
         bring_up()
 
     print(f"[*] Server config location: {WG_CONF}")
-    print(f"[*] Client config location: {CLIENT_CONF}")
-    print(f"[*] Client QR PNG location: {CLIENT_PNG}")
-    print(f"[*] Copying {CLIENT_CONF} & {CLIENT_PNG} to current working directory.")
-    run(f"cp {CLIENT_CONF} .")
-    run(f"cp {CLIENT_PNG} .")
-    print("[*] Scan client1.png with WireGuard mobile app or import client1.conf.")
+    if len(peer_names) == 1:
+        client_conf, client_png = peer_files(peer_names[0])[2:4]
+        print(f"[*] Client config location: {client_conf}")
+        print(f"[*] Client QR PNG location: {client_png}")
+        print(f"[*] Copying {client_conf} & {client_png} to current working directory.")
+        run(["cp", client_conf, client_png, "."])
+        print(f"[*] Scan {client_png.name} with WireGuard mobile app or import {client_conf.name}.")
+    else:
+        print(f"[*] Client configs and QR PNGs are in {WG_DIR} as <name>.conf and <name>.png")
     print("[*] Dont forget to forward the UDP port from your router to your server!")
 
     print("\n\n ======== WireGuard installation & setup complete ======== \n\n")
 
+def peer_names(args):
+    # Names given on the command line, plus --count generated ones: client1, client2, ...
+    return list(args.names) + [f"{args.prefix}{i}" for i in range(1, args.count + 1)]
+
+def main():
+    parser = argparse.ArgumentParser(description="WireGuard server setup and peer provisioning")
+    sub = parser.add_subparsers(dest="command")
+    for command, help_text in (("setup", "Interactive server setup (default)"),
+                               ("add-peers", "Add peers to an existing setup, existing peers are kept"),
+                               ("remove-peers", "Remove peers and their keys")):
+        p = sub.add_parser(command, help=help_text)
+        p.add_argument("names", nargs="*", help="Peer names")
+        p.add_argument("--count", type=int, default=0, help="Also add PREFIX1..PREFIXn")
+        p.add_argument("--prefix", default="client")
+    sub.add_parser("apply", help="Load wg0.conf's peers into the running interface without restarting it")
+    args = parser.parse_args()
+
+    if args.command == "apply":
+        apply_peers()
+        return
+    names = peer_names(args) if args.command else []
+    if args.command != "remove-peers":
+        check_peer_names(names)
+    if args.command in (None, "setup"):
+        setup(names or [DEFAULT_PEER])
+        return
+    if not names:
+        parser.error("no peer names given")
+    if args.command == "add-peers":
+        ensure_dir()
+        provision_peers(add=names)
+    else:
+        provision_peers(remove=names)
+    apply_peers()
+
 if __name__ == "__main__":
     main()